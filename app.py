@@ -1,172 +1,414 @@
+import io
 import os
+import json
+import time
+import hashlib
+import atexit
 import logging
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+import tempfile
+import threading
+import click
+from flask import Flask, Blueprint, Response, current_app, render_template, request, redirect, url_for, session, flash, jsonify, stream_with_context
+from flask.cli import with_appcontext
 from werkzeug.security import check_password_hash, generate_password_hash
-import pandas as pd
-import base64
-import numpy as np
 from datetime import datetime
-import json
-from models import db, User, Section, Group, Subject, Student, Attendance
-from utils.face_recognition_utils import process_face_recognition, load_known_faces
-from utils.csv_utils import export_attendance_to_csv
-# from utils.sms_utils import send_absence_notification
-
-# Setup logging
-logging.basicConfig(level=logging.DEBUG)
-
-# Create Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev_key_for_testing")
-
-# Configure SQLite database
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///attendance.db"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-
-# Function to create tables and initial data
-def create_tables_and_data():
-    # Create all tables
-    db.create_all()
-    
-    # Check if we need to populate initial data
-    if not User.query.filter_by(username="Lachoo").first():
-        # Create admin user
-        admin = User(username="Lachoo", password_hash=generate_password_hash("Lachoo"))
-        db.session.add(admin)
-        
-        # Create sections
-        sections = ["J", "K", "L"]
-        for section_name in sections:
-            section = Section(name=section_name)
-            db.session.add(section)
-        
-        db.session.commit()
-        
-        # Create groups
-        section_j = Section.query.filter_by(name="J").first()
-        section_k = Section.query.filter_by(name="K").first()
-        section_l = Section.query.filter_by(name="L").first()
-        
-        for i in range(1, 4):
-            db.session.add(Group(name=f"J{i}", section_id=section_j.id))
-            db.session.add(Group(name=f"K{i}", section_id=section_k.id))
-            db.session.add(Group(name=f"L{i}", section_id=section_l.id))
-        
-        db.session.commit()
-        
-        # Create subjects
-        subjects = ["Python", "Java", "Software Engineering"]
-        for subject_name in subjects:
-            subject = Subject(name=subject_name)
-            db.session.add(subject)
-        
-        db.session.commit()
-        
-        # Create students with sample phone numbers for demonstration
-        student_data = [
-            {"name": "Tanish", "phone": "+919876543201"},
-            {"name": "Yuvraj", "phone": "+919876543202"},
-            {"name": "Vishal", "phone": "+919876543203"},
-            {"name": "Suraj", "phone": "+919876543204"},
-            {"name": "Sanyam", "phone": "+919876543205"}
-        ]
-        
-        for student_info in student_data:
-            student = Student(
-                name=student_info["name"],
-                phone_number=student_info["phone"]
-            )
-            db.session.add(student)
-        
-        db.session.commit()
+from models import db, User, Section, Group, Subject, Student, Enrollment, SyncedMark
+from utils.face_recognition_utils import process_face_recognition, identify_face, recognize_group, configure_gallery, get_gallery, serialize_gallery_for_client, decode_image_data
+from utils.face_backends import configure_backend
+from utils.face_archive import FaceArchive
+from utils.recognition_worker import RecognitionPool, QueueFullError
+from utils.attendance_writer import AttendanceWriter, make_mark
+from utils.attendance_queries import get_class_marks, get_day_attendance, iter_attendance
+from utils.csv_utils import stream_attendance_csv, archive_filename_for
+from utils.attendance_analytics import analytics_cache, build_term_report, DEFAULT_THRESHOLD
+from utils.migrations import upgrade
+from utils.database import DEFAULT_DATABASE_URL, engine_options, init_database, normalize_database_url
+from utils.reference_cache import ReferenceCache, get_reference_cache
+from utils.metrics import Counter, init_metrics, pipeline_timer, render_metrics
+from utils.notifications import NotificationDispatcher
+from utils.frame_filter import FrameCache, frame_fingerprint
+from utils.bulk_enrollment import enroll_students
+from utils.live_board import BoardFullError, LiveBoard, board_key, format_event, mark_event
+from utils.sms_utils import make_provider
+
+# Setup logging; messages are %-formatted lazily, so DEBUG ones cost nothing unless enabled
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 
-# Initialize the database
-db.init_app(app)
+# Maximum number of classroom frames accepted for one group photo
+MAX_GROUP_FRAMES = 5
 
-# Create the application context
-app_ctx = app.app_context()
-app_ctx.push()
+# Maximum number of offline-queued marks accepted in one sync, and how old they may be
+MAX_SYNC_BATCH = 50
+SYNC_MAX_AGE_DAYS = 7
 
-# Drop all tables and recreate them
-db.drop_all()
-db.create_all()
-create_tables_and_data()
+# Seconds between keep-alive comments on an idle live board stream
+BOARD_HEARTBEAT = 15
 
-# Ensure the student faces directory exists
+# Student photos and the archive of recognised faces
 FACES_DIR = os.path.join(os.path.dirname(__file__), 'static', 'faces')
 RECOGNIZED_FACES_DIR = os.path.join(os.path.dirname(__file__), 'static', 'recognized_faces')
-os.makedirs(FACES_DIR, exist_ok=True)
-os.makedirs(RECOGNIZED_FACES_DIR, exist_ok=True)
 
-# Create student face folders
-for student in ['Tanish', 'Yuvraj', 'Vishal', 'Suraj', 'Sanyam']:
-    student_dir = os.path.join(RECOGNIZED_FACES_DIR, student)
-    os.makedirs(student_dir, exist_ok=True)
-    # Create all tables
-    db.create_all()
-    
+# All the pages and API endpoints
+views = Blueprint('views', __name__)
+
+def create_app(config=None):
+    """
+    Create and configure the Flask app
+
+    Nothing slow happens here: the schema is brought up to date with the
+    pending migrations only (a single query once it is current), nothing is
+    seeded (see `flask seed-db`), and the face gallery and recognition
+    workers are started lazily, or warmed up in a background thread when
+    RECOGNITION_WARM_UP is on. The time taken is logged and kept in
+    app.config["STARTUP_TIME_MS"].
+
+    Args:
+        config: Optional dict of settings that override the defaults and environment
+    """
+    start = time.perf_counter()
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "dev_key_for_testing")
+
+    # Configure the database: SQLite in the instance folder by default, or a
+    # PostgreSQL URL (postgresql://...) in DATABASE_URL; no other database is supported
+    app.config["SQLALCHEMY_DATABASE_URI"] = normalize_database_url(os.environ.get("DATABASE_URL", DEFAULT_DATABASE_URL))
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # Connection pool per process for server databases; size it to the worker's
+    # request threads plus one for the attendance writer
+    app.config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", 5))
+    app.config["DB_MAX_OVERFLOW"] = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    app.config["DB_POOL_TIMEOUT"] = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+
+    # SQLite settings applied to every connection, so several worker processes can write
+    app.config["SQLITE_JOURNAL_MODE"] = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+    app.config["SQLITE_SYNCHRONOUS"] = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    app.config["SQLITE_BUSY_TIMEOUT_MS"] = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+    # Apply pending schema migrations when the app starts; turn off to run `flask upgrade-db` separately
+    app.config["AUTO_MIGRATE"] = os.environ.get("AUTO_MIGRATE", "1") == "1"
+
+    # Face recognition worker pool: number of worker processes (0 runs recognition inline),
+    # maximum number of queued jobs before requests are turned away, and how long a
+    # request waits for its result before telling the client to poll for it
+    app.config["RECOGNITION_WORKERS"] = int(os.environ.get("RECOGNITION_WORKERS", min(4, os.cpu_count() or 1)))
+    app.config["RECOGNITION_QUEUE_SIZE"] = int(os.environ.get("RECOGNITION_QUEUE_SIZE", 0)) or None
+    app.config["RECOGNITION_WAIT_TIMEOUT"] = float(os.environ.get("RECOGNITION_WAIT_TIMEOUT", 5))
+
+    # Load the face models and gallery in a background thread as soon as the app
+    # starts, instead of on the first recognition request
+    app.config["RECOGNITION_WARM_UP"] = os.environ.get("RECOGNITION_WARM_UP", "1") == "1"
+
+    # Captured frames are cropped to the middle of the picture and downscaled in the browser
+    # to at most this many pixels a side, then uploaded as JPEG at this quality
+    app.config["CAPTURE_SIZE"] = int(os.environ.get("CAPTURE_SIZE", 320))
+    app.config["CAPTURE_QUALITY"] = float(os.environ.get("CAPTURE_QUALITY", 0.8))
+
+    # Let the browser download the (quantised) face gallery and match faces itself
+    app.config["CLIENT_SIDE_MATCHING"] = os.environ.get("CLIENT_SIDE_MATCHING", "0") == "1"
+
+    # Face detection/embedding backend: "sface" (YuNet + SFace ONNX models from
+    # FACE_MODELS_DIR), "thumbnail" (Haar cascade, no model files) or "auto" to use
+    # SFace whenever its models are present
+    app.config["FACE_BACKEND"] = os.environ.get("FACE_BACKEND", "auto")
+    app.config["FACE_MODELS_DIR"] = os.environ.get("FACE_MODELS_DIR", os.path.join(app.instance_path, 'face_models'))
+
+    # Where student photos are read from and recognised faces archived to; the
+    # gallery index keeps the photos' encodings between runs
+    app.config["FACES_DIR"] = FACES_DIR
+    app.config["RECOGNIZED_FACES_DIR"] = RECOGNIZED_FACES_DIR
+    app.config["GALLERY_INDEX_PATH"] = os.path.join(app.instance_path, 'face_gallery.json')
+
+    # Worker processes that prepare photos during bulk enrolment (0 prepares them in the request)
+    app.config["ENROLLMENT_WORKERS"] = int(os.environ.get("ENROLLMENT_WORKERS", os.cpu_count() or 1))
+
+    # Days to keep archived thumbnails of recognised faces (0 keeps them forever)
+    app.config["FACE_ARCHIVE_RETENTION_DAYS"] = int(os.environ.get("FACE_ARCHIVE_RETENTION_DAYS", 90))
+
+    # Sections, groups, subjects and students are cached for this many seconds; changes
+    # made in this process show up at once, other workers see them after the TTL
+    app.config["REFERENCE_CACHE_TTL"] = float(os.environ.get("REFERENCE_CACHE_TTL", 300))
+
+    # Term reports are cached until this process commits a mark they cover, or for at most
+    # this many seconds, after which marks committed by other workers show up too
+    app.config["ANALYTICS_CACHE_TTL"] = float(os.environ.get("ANALYTICS_CACHE_TTL", 60))
+
+    # Attendance marks arriving within this many seconds of each other are committed together
+    app.config["ATTENDANCE_WRITE_WINDOW"] = float(os.environ.get("ATTENDANCE_WRITE_WINDOW", 0.05))
+
+    # A retried capture whose perceptual hash is within FRAME_MATCH_DISTANCE bits of a frame
+    # of the same student seen in the last FRAME_CACHE_TTL seconds reuses that frame's result
+    app.config["FRAME_CACHE_TTL"] = float(os.environ.get("FRAME_CACHE_TTL", 120))
+    app.config["FRAME_MATCH_DISTANCE"] = int(os.environ.get("FRAME_MATCH_DISTANCE", 8))
+
+    # Live attendance boards get marks committed by this process at once, and look for marks
+    # from other worker processes this often (0 turns that off for single-process servers).
+    # Each open board holds one of the worker's request threads, so a worker streams to at
+    # most LIVE_BOARD_MAX_STREAMS boards at once (gunicorn.conf.py gives it that many threads
+    # on top of the ones for other requests), each for at most LIVE_BOARD_MAX_STREAM_SECONDS
+    app.config["LIVE_BOARD_POLL_INTERVAL"] = float(os.environ.get("LIVE_BOARD_POLL_INTERVAL", 5))
+    app.config["LIVE_BOARD_MAX_STREAMS"] = int(os.environ.get("LIVE_BOARD_MAX_STREAMS", 32))
+    app.config["LIVE_BOARD_MAX_STREAM_SECONDS"] = float(os.environ.get("LIVE_BOARD_MAX_STREAM_SECONDS", 300))
+
+    # Time requests, count their SQL statements and serve the numbers at /metrics
+    app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+    # Absent students are sent an SMS by a background dispatcher: provider "twilio",
+    # "fake" (logs instead of sending), "none" or "auto" (Twilio when its credentials
+    # are set), messages claimed per batch, messages per second allowed by the provider
+    # (per worker process, 0 for no limit), and attempts before giving up, the first
+    # retry coming after NOTIFICATION_RETRY_DELAY seconds and each later one after twice as long
+    app.config["NOTIFICATION_PROVIDER"] = os.environ.get("NOTIFICATION_PROVIDER", "auto")
+    app.config["NOTIFICATION_BATCH_SIZE"] = int(os.environ.get("NOTIFICATION_BATCH_SIZE", 50))
+    app.config["NOTIFICATION_RATE_LIMIT"] = float(os.environ.get("NOTIFICATION_RATE_LIMIT", 1))
+    app.config["NOTIFICATION_MAX_ATTEMPTS"] = int(os.environ.get("NOTIFICATION_MAX_ATTEMPTS", 5))
+    app.config["NOTIFICATION_RETRY_DELAY"] = float(os.environ.get("NOTIFICATION_RETRY_DELAY", 30))
+
+    if config:
+        app.config.update(config)
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config))
+
+    # Initialize the database
+    init_database(app)
+    if app.config["METRICS_ENABLED"]:
+        init_metrics(app)
+    if app.config["AUTO_MIGRATE"]:
+        with app.app_context():
+            upgrade()
+
+    # Batch attendance writes; anything still buffered is written on shutdown
+    attendance_writer = AttendanceWriter(app, window=app.config["ATTENDANCE_WRITE_WINDOW"])
+    atexit.register(attendance_writer.close)
+
+    # Cached term reports only go stale for the sections and dates that new marks touch;
+    # marks from other worker processes are picked up when the entries expire
+    analytics_cache.ttl = app.config["ANALYTICS_CACHE_TTL"]
+    attendance_writer.add_listener(analytics_cache.note_marks)
+
+    # Committed marks are pushed to the live attendance boards watching their class
+    live_board = LiveBoard(app, poll_interval=app.config["LIVE_BOARD_POLL_INTERVAL"],
+                           max_subscribers=app.config["LIVE_BOARD_MAX_STREAMS"])
+    attendance_writer.add_listener(live_board.publish)
+    atexit.register(live_board.close)
+
+    # Notifications wait in the outbox until delivered; with no provider they just wait
+    notification_dispatcher = None
+    sms_provider = make_provider(app.config["NOTIFICATION_PROVIDER"])
+    if sms_provider is not None:
+        notification_dispatcher = NotificationDispatcher(app, sms_provider,
+                                                         batch_size=app.config["NOTIFICATION_BATCH_SIZE"],
+                                                         rate_limit=app.config["NOTIFICATION_RATE_LIMIT"],
+                                                         max_attempts=app.config["NOTIFICATION_MAX_ATTEMPTS"],
+                                                         retry_delay=app.config["NOTIFICATION_RETRY_DELAY"])
+        attendance_writer.add_listener(notification_dispatcher.wake)
+        notification_dispatcher.start()
+        atexit.register(notification_dispatcher.close)
+
+    # Ensure the student faces directories exist
+    os.makedirs(app.config["FACES_DIR"], exist_ok=True)
+    os.makedirs(app.config["RECOGNIZED_FACES_DIR"], exist_ok=True)
+
+    # The face gallery is built on first use; only photos added or changed since the
+    # last run are re-read, the rest comes from the on-disk index
+    configure_backend(app.config["FACE_BACKEND"], app.config["FACE_MODELS_DIR"])
+    configure_gallery(app.config["FACES_DIR"], app.config["GALLERY_INDEX_PATH"])
+
+    # Recognition workers are started on first use; each one warms up the face models
+    # and loads the gallery index once
+    recognition_pool = RecognitionPool(app.config["FACES_DIR"], app.config["GALLERY_INDEX_PATH"],
+                                       workers=app.config["RECOGNITION_WORKERS"],
+                                       max_queue=app.config["RECOGNITION_QUEUE_SIZE"])
+    atexit.register(recognition_pool.shutdown)
+
+    # Thumbnails of recognised faces are packed per day and group by a background writer
+    face_archive = FaceArchive(app.config["RECOGNIZED_FACES_DIR"],
+                               retention_days=app.config["FACE_ARCHIVE_RETENTION_DAYS"])
+    atexit.register(face_archive.close)
+
+    app.extensions["attendance_writer"] = attendance_writer
+    app.extensions["recognition_pool"] = recognition_pool
+    app.extensions["face_archive"] = face_archive
+    app.extensions["notification_dispatcher"] = notification_dispatcher
+    app.extensions["live_board"] = live_board
+    app.extensions["reference_cache"] = ReferenceCache(ttl=app.config["REFERENCE_CACHE_TTL"])
+    app.extensions["frame_cache"] = FrameCache(ttl=app.config["FRAME_CACHE_TTL"],
+                                               distance=app.config["FRAME_MATCH_DISTANCE"])
+
+    app.register_blueprint(views)
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(seed_db_command)
+    app.cli.add_command(compact_face_archive_command)
+    app.cli.add_command(enroll_students_command)
+
+    if app.config["RECOGNITION_WARM_UP"]:
+        threading.Thread(target=warm_up_recognition, args=(recognition_pool,),
+                         name='recognition-warm-up', daemon=True).start()
+
+    app.config["STARTUP_TIME_MS"] = (time.perf_counter() - start) * 1000
+    logging.info("App created in %.0f ms", app.config['STARTUP_TIME_MS'])
+    return app
+
+def warm_up_recognition(recognition_pool):
+    """Bring the shared gallery file up to date in this process, then start the recognition workers that map it"""
+    start = time.perf_counter()
+    try:
+        get_gallery()
+        if recognition_pool.workers:
+            recognition_pool.warm_up()
+    except Exception as e:
+        logging.error("Error warming up face recognition: %s", e)
+        return
+    logging.info("Face recognition warmed up in %.0f ms", (time.perf_counter() - start) * 1000)
+
+def get_attendance_writer():
+    """The current app's attendance write buffer"""
+    return current_app.extensions["attendance_writer"]
+
+def get_recognition_pool():
+    """The current app's face recognition worker pool"""
+    return current_app.extensions["recognition_pool"]
+
+def get_face_archive():
+    """The current app's archive of recognised faces"""
+    return current_app.extensions["face_archive"]
+
+def get_live_board():
+    """The current app's live attendance board pub/sub"""
+    return current_app.extensions["live_board"]
+
+def get_frame_cache():
+    """The current app's cache of recently recognised frames"""
+    return current_app.extensions["frame_cache"]
+
+def attendance_session_key(user_id, section_id, group_id, subject_id):
+    """Identifies one user marking one class, whose recent frames are kept together"""
+    return tuple(str(value) for value in (user_id, section_id, group_id, subject_id))
+
+def fingerprint_capture(image_bytes):
+    """Fingerprint a captured frame, timing it as the 'fingerprint' stage"""
+    timings = {}
+    with pipeline_timer.stage('fingerprint', timings):
+        frame = frame_fingerprint(image_bytes)
+    pipeline_timer.add(timings)
+    return frame
+
+def seed_data():
+    """
+    Add the admin user, sections, groups, subjects and demo students
+
+    Does nothing if the admin user already exists
+
+    Returns:
+        bool: True if the data was added
+    """
     # Check if we need to populate initial data
-    if not User.query.filter_by(username="Lachoo").first():
-        # Create admin user
-        admin = User(username="Lachoo", password_hash=generate_password_hash("Lachoo"))
-        db.session.add(admin)
-        
-        # Create sections
-        sections = ["J", "K", "L"]
-        for section_name in sections:
-            section = Section(name=section_name)
-            db.session.add(section)
-        
-        db.session.commit()
-        
-        # Create groups
-        section_j = Section.query.filter_by(name="J").first()
-        section_k = Section.query.filter_by(name="K").first()
-        section_l = Section.query.filter_by(name="L").first()
-        
-        for i in range(1, 4):
-            db.session.add(Group(name=f"J{i}", section_id=section_j.id))
-            db.session.add(Group(name=f"K{i}", section_id=section_k.id))
-            db.session.add(Group(name=f"L{i}", section_id=section_l.id))
-        
-        db.session.commit()
-        
-        # Create subjects
-        subjects = ["Python", "Java", "Software Engineering"]
-        for subject_name in subjects:
-            subject = Subject(name=subject_name)
-            db.session.add(subject)
-        
-        db.session.commit()
-        
-        # Create students with sample phone numbers for demonstration
-        # student_data = [
-        #     {"name": "Tanish", "phone": "+919928687408"},
-        #     {"name": "Yuvraj", "phone": "+916376405987"},
-        #     {"name": "Vishal", "phone": "+919509595111"},
-        #     {"name": "Suraj", "phone": "+919876543204"},
-        #     {"name": "Sanyam", "phone": "+919876543205"}
-        # ]
-        
-        # for student_info in student_data:
-        #     student = Student(
-        #         name=student_info["name"],
-        #         phone_number=student_info["phone"]
-        #     )
-        #     db.session.add(student)
-        
-        db.session.commit()
+    if User.query.filter_by(username="Lachoo").first():
+        return False
+    
+    # Create admin user
+    admin = User(username="Lachoo", password_hash=generate_password_hash("Lachoo"))
+    db.session.add(admin)
+    
+    # Create sections
+    sections = ["J", "K", "L"]
+    for section_name in sections:
+        section = Section(name=section_name)
+        db.session.add(section)
+    
+    db.session.commit()
+    
+    # Create groups
+    section_j = Section.query.filter_by(name="J").first()
+    section_k = Section.query.filter_by(name="K").first()
+    section_l = Section.query.filter_by(name="L").first()
+    
+    for i in range(1, 4):
+        db.session.add(Group(name=f"J{i}", section_id=section_j.id))
+        db.session.add(Group(name=f"K{i}", section_id=section_k.id))
+        db.session.add(Group(name=f"L{i}", section_id=section_l.id))
+    
+    db.session.commit()
+    
+    # Create subjects
+    subjects = ["Python", "Java", "Software Engineering"]
+    for subject_name in subjects:
+        subject = Subject(name=subject_name)
+        db.session.add(subject)
+    
+    db.session.commit()
+    
+    # Create students with sample phone numbers for demonstration
+    student_data = [
+        {"name": "Tanish", "phone": "+919876543201"},
+        {"name": "Yuvraj", "phone": "+919876543202"},
+        {"name": "Vishal", "phone": "+919876543203"},
+        {"name": "Suraj", "phone": "+919876543204"},
+        {"name": "Sanyam", "phone": "+919876543205"}
+    ]
+    
+    for student_info in student_data:
+        student = Student(
+            name=student_info["name"],
+            phone_number=student_info["phone"]
+        )
+        db.session.add(student)
+    
+    db.session.commit()
+    
+    # Enroll the demo students in every group for every subject
+    groups = Group.query.all()
+    subjects = Subject.query.all()
+    for student in Student.query.all():
+        for group in groups:
+            for subject in subjects:
+                db.session.add(Enrollment(student_id=student.id, group_id=group.id, subject_id=subject.id))
+    
+    db.session.commit()
+    return True
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Apply pending schema migrations"""
+    applied = upgrade()
+    print(f"Applied {applied} migrations")
+
+@click.command('seed-db')
+@with_appcontext
+def seed_db_command():
+    """Create the schema if needed and add the initial users, classes and students"""
+    upgrade()
+    print("Seeded the database" if seed_data() else "Database already seeded")
+
+@click.command('compact-face-archive')
+@with_appcontext
+def compact_face_archive_command():
+    """Pack loose recognised-face JPEGs into the archive and apply the retention policy"""
+    face_archive = get_face_archive()
+    compacted = face_archive.compact_legacy()
+    removed = face_archive.apply_retention()
+    print(f"Compacted {compacted} captures, removed {removed} expired days")
+
+@click.command('enroll-students')
+@click.argument('roster', type=click.File('r', encoding='utf-8-sig'))
+@click.argument('photos', type=click.Path(exists=True))
+@click.option('--workers', type=int, default=None, help="Worker processes preparing photos (default: one per CPU)")
+@with_appcontext
+def enroll_students_command(roster, photos, workers):
+    """Create and enrol the students of a ROSTER CSV with their face PHOTOS (a directory or zip)"""
+    report = enroll_students(roster, photos, workers=workers)
+    for rejected in report["rejected"]:
+        print(f"Rejected {rejected['item']}: {rejected['reason']}")
+    print(f"{report['students']} students ({report['students_created']} new, "
+          f"{report['enrollments_added']} enrolments added), {report['photos_enrolled']} of {report['photos']} "
+          f"photos enrolled in {report['seconds']:.1f} s ({report['photos_per_second']} photos/s)")
 
 # Routes
-@app.route('/')
+@views.route('/')
 def index():
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
-@app.route('/login', methods=['GET', 'POST'])
+@views.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -177,21 +419,21 @@ def login():
         if user and check_password_hash(user.password_hash, password):
             session['user_id'] = user.id
             flash('Login successful!', 'success')
-            return redirect(url_for('selection'))
+            return redirect(url_for('.selection'))
         else:
             flash('Invalid username or password', 'danger')
     
     return render_template('login.html')
 
-@app.route('/logout')
+@views.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
-@app.route('/selection', methods=['GET', 'POST'])
+@views.route('/selection', methods=['GET', 'POST'])
 def selection():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     
     if request.method == 'POST':
         section_id = request.form.get('section')
@@ -200,214 +442,719 @@ def selection():
         
         if not all([section_id, group_id, subject_id]):
             flash('Please select all required fields', 'danger')
-            return redirect(url_for('selection'))
+            return redirect(url_for('.selection'))
         
         # Store selections in session
         session['section_id'] = section_id
         session['group_id'] = group_id
         session['subject_id'] = subject_id
         
-        return redirect(url_for('attendance'))
+        return redirect(url_for('.attendance'))
     
     # Fetch data for the form
-    sections = Section.query.all()
-    subjects = Subject.query.all()
+    reference_cache = get_reference_cache()
+    sections = reference_cache.sections()
+    subjects = reference_cache.subjects()
     
     return render_template('selection.html', sections=sections, subjects=subjects)
 
-@app.route('/get_groups/<section_id>')
+@views.route('/get_groups/<section_id>')
 def get_groups(section_id):
-    groups = Group.query.filter_by(section_id=section_id).all()
-    return jsonify([{"id": group.id, "name": group.name} for group in groups])
+    groups = get_reference_cache().groups(section_id)
+    
+    # Groups rarely change: let the browser reuse its copy for a minute, then revalidate with the ETag
+    payload = json.dumps([{"id": group.id, "name": group.name} for group in groups])
+    response = Response(payload, mimetype='application/json')
+    response.set_etag(hashlib.sha1(payload.encode()).hexdigest())
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response.make_conditional(request)
 
-@app.route('/attendance', methods=['GET', 'POST'])
+@views.route('/attendance', methods=['GET', 'POST'])
 def attendance():
     if 'user_id' not in session or not all(k in session for k in ['section_id', 'group_id', 'subject_id']):
-        return redirect(url_for('selection'))
+        return redirect(url_for('.selection'))
     
-    section = Section.query.get(session['section_id'])
-    group = Group.query.get(session['group_id'])
-    subject = Subject.query.get(session['subject_id'])
-    students = Student.query.all()
+    reference_cache = get_reference_cache()
+    section = reference_cache.section(session['section_id'])
+    group = reference_cache.group(session['group_id'])
+    subject = reference_cache.subject(session['subject_id'])
+    students = reference_cache.roster(session['group_id'], session['subject_id'])
     
-    # Load known faces for recognition
-    known_face_encodings, known_face_names = load_known_faces(FACES_DIR)
+    # The page carries no face encodings; with client-side matching the browser
+    # fetches the cached binary gallery separately
+    gallery_url = url_for('.known_faces_gallery') if current_app.config["CLIENT_SIDE_MATCHING"] else None
     
     return render_template('attendance.html', 
                           section=section, 
                           group=group, 
                           subject=subject, 
                           students=students,
-                          known_faces={'encodings': json.dumps([e.tolist() for e in known_face_encodings]), 
-                                      'names': json.dumps(known_face_names)})
+                          capture_size=current_app.config["CAPTURE_SIZE"],
+                          capture_quality=current_app.config["CAPTURE_QUALITY"],
+                          gallery_url=gallery_url)
 
-@app.route('/process_attendance', methods=['POST'])
-def process_attendance():
+@views.route('/attendance/stream')
+def attendance_stream():
+    """
+    Server-Sent Events stream of a class's attendance marks for one day
+
+    The class and day come from the section_id, group_id, subject_id and
+    date query parameters, defaulting to the class selected in the session
+    and today. The stream opens with a "snapshot" event listing every mark
+    so far, then sends a "mark" event for each new or changed mark, from
+    any teacher or device. A "reload" event asks the client to reconnect
+    for a fresh snapshot, after it fell too far behind.
+    
+    Streams hold a request thread, so they end with an "end" event after
+    LIVE_BOARD_MAX_STREAM_SECONDS, and a 503 is returned while
+    LIVE_BOARD_MAX_STREAMS are already open in this worker.
+    """
+    if 'user_id' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    
+    try:
+        key = board_key(request.args.get('section_id', session.get('section_id')),
+                        request.args.get('group_id', session.get('group_id')),
+                        request.args.get('subject_id', session.get('subject_id')),
+                        request.args.get('date') or datetime.now().date())
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "Choose a section, group, subject and date"}), 400
+    group = get_reference_cache().group(key[1])
+    if not group or group.section_id != key[0] or not get_reference_cache().subject(key[2]):
+        return jsonify({"success": False, "message": "Unknown class"}), 404
+    
+    # Subscribe before reading the snapshot so no mark falls in between; a mark in both is sent twice, which is harmless
+    try:
+        subscription = get_live_board().subscribe(key)
+    except BoardFullError:
+        return jsonify({"success": False, "message": "Too many live boards are open. Please try again later."}), 503, {"Retry-After": "30"}
+    try:
+        snapshot = get_class_marks(*key)
+    except Exception:
+        subscription.close()
+        raise
+    get_live_board().seen(key, snapshot)
+    marks = [mark_event(*mark) for mark in snapshot]
+    # The stream can stay open for hours; don't keep a database connection for it
+    db.session.close()
+    
+    deadline = time.monotonic() + current_app.config["LIVE_BOARD_MAX_STREAM_SECONDS"]
+    
+    def stream():
+        try:
+            yield format_event('snapshot', {"marks": marks})
+            while not subscription.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    yield format_event('end', {})
+                    return
+                events = subscription.get(timeout=min(BOARD_HEARTBEAT, remaining))
+                if subscription.overflowed:
+                    yield format_event('reload', {})
+                    return
+                if not events:
+                    yield ": keep-alive\n\n"
+                for event_id, data in events:
+                    yield format_event('mark', data, event_id)
+        finally:
+            subscription.close()
+    
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@views.route('/known_faces.bin')
+def known_faces_gallery():
+    """
+    Quantised face gallery for client-side matching
+
+    Served as a compact binary payload (see serialize_gallery_for_client),
+    int8 by default or float16 with ?dtype=float16. Once a class is selected
+    only its roster's photos are included. The ETag changes only when that
+    part of the gallery does, so browsers revalidate with If-None-Match and
+    get a 304 instead of downloading it again.
+    """
     if 'user_id' not in session:
         return jsonify({"success": False, "message": "Not logged in"}), 401
+    if not current_app.config["CLIENT_SIDE_MATCHING"]:
+        return jsonify({"success": False, "message": "Client-side matching is disabled"}), 404
+    
+    dtype = request.args.get('dtype', 'int8')
+    if dtype not in ('int8', 'float16'):
+        return jsonify({"success": False, "message": "dtype must be int8 or float16"}), 400
+    
+    roster = None
+    if 'group_id' in session and 'subject_id' in session:
+        roster = [student.name for student in
+                  get_reference_cache().roster(session['group_id'], session['subject_id'])]
+    payload, etag = serialize_gallery_for_client(dtype, student_names=roster)
+    response = Response(payload, mimetype='application/octet-stream')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+def record_attendance(student, status, section_id, group_id, subject_id):
+    """Save an attendance mark and build the JSON response for it"""
+    try:
+        # Wait until the write buffer has committed the mark; marking twice replaces the first mark
+        timings = {}
+        with pipeline_timer.stage('save', timings):
+            get_attendance_writer().write(make_mark(student, status, section_id, group_id, subject_id))
+        pipeline_timer.add(timings)
+        
+        # Prepare response message
+        response_message = f"Attendance marked as {status} for {student.name}"
+        if status == 'absent' and student.phone_number and current_app.extensions["notification_dispatcher"] is None:
+            response_message += ". SMS notifications are disabled."
+        elif status == 'absent' and student.phone_number:
+            response_message += ". SMS notification queued."
+        elif status == 'absent' and not student.phone_number:
+            response_message += ". No phone number available for SMS notification."
+            
+        return jsonify({
+            "success": True, 
+            "message": response_message
+        })
+    except Exception as e:
+        # The database error can describe other marks written in the same batch; keep it in the log
+        logging.error("Error recording attendance for student %s: %s", student.id, e)
+        return jsonify({"success": False, "message": "Error saving the attendance mark. Please try again."}), 500
+
+def archive_recognized_face(student_name, group_id, recognition_result):
+    """Queue the thumbnail of a matched face for the archive; nothing is written in the request"""
+    if recognition_result.get('success') and recognition_result.get('thumbnail'):
+        get_face_archive().submit(student_name, group_id, recognition_result['thumbnail'])
+
+def recognition_pending_response(job_id, message):
+    """Tell the client its recognition job is still running and where to poll for it"""
+    return jsonify({
+        "success": True,
+        "pending": True,
+        "job_id": job_id,
+        "poll_url": url_for('.poll_attendance', job_id=job_id),
+        "message": message
+    }), 202
+
+def read_attendance_request():
+    """
+    Get the student id, status and captured image from a mark request
+
+    Three encodings are accepted:
+        multipart/form-data with student_id, status and an "image" file,
+        a raw image/* body with student_id and status in the query string,
+        or the original JSON body with a base64 "image_data" data URL
+    
+    Returns:
+        tuple: (student_id, status, image) where image is bytes, a base64 string or None
+    """
+    if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        image_file = request.files.get('image')
+        return (request.form.get('student_id'), request.form.get('status'),
+                image_file.read() if image_file else None)
+    
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        return request.args.get('student_id'), request.args.get('status'), request.get_data() or None
     
     data = request.json
-    student_id = data.get('student_id')
-    status = data.get('status')
-    image_data = data.get('image_data')
+    return data.get('student_id'), data.get('status'), data.get('image_data')
+
+@views.route('/process_attendance', methods=['POST'])
+def process_attendance():
+    if 'user_id' not in session or not all(k in session for k in ['section_id', 'group_id', 'subject_id']):
+        return jsonify({"success": False, "message": "Not logged in"}), 401
     
-    student = Student.query.get(student_id)
-    if not student:
-        return jsonify({"success": False, "message": "Student not found"}), 404
+    student_id, status, image_data = read_attendance_request()
+    if status not in ('present', 'absent'):
+        return jsonify({"success": False, "message": "Status must be present or absent"}), 400
+    
+    # Validate the class before anything is queued for the write buffer, as check_synced_mark does
+    reference_cache = get_reference_cache()
+    section = reference_cache.section(session['section_id'])
+    group = reference_cache.group(session['group_id'])
+    subject = reference_cache.subject(session['subject_id'])
+    if not section or not group or group.section_id != section.id or not subject:
+        return jsonify({"success": False, "message": "Unknown class"}), 400
     
-    # Get section, group, and subject information
-    section = Section.query.get(session['section_id'])
-    group = Group.query.get(session['group_id'])
-    subject = Subject.query.get(session['subject_id'])
+    roster = reference_cache.roster(session['group_id'], session['subject_id'])
+    student = reference_cache.roster_student(session['group_id'], session['subject_id'], student_id)
+    if not student:
+        return jsonify({"success": False, "message": "Student not found in this class"}), 404
     
     # Process the attendance
     if status == 'present':
         if not image_data:
             return jsonify({"success": False, "message": "No image data provided for present student"}), 400
         
-        # Process face recognition
-        recognition_result = process_face_recognition(image_data, student.name, RECOGNIZED_FACES_DIR)
+        # Frames are fingerprinted before anything expensive: the same bytes that were
+        # recognised before are refused, and a near-identical retry reuses its earlier result
+        try:
+            image_bytes = decode_image_data(image_data)
+            frame = fingerprint_capture(image_bytes)
+        except Exception as e:
+            return jsonify({"success": False, "message": f"Error processing image: {str(e)}"}), 400
+        if get_frame_cache().is_replay(frame):
+            return jsonify({"success": False, "message": "This frame was already used. Please capture a new one."}), 409
+        session_key = attendance_session_key(session['user_id'], session['section_id'], session['group_id'],
+                                             session['subject_id'])
+        recognition_result = get_frame_cache().lookup(session_key, student.id, frame)
         
-    #     if not recognition_result['success']:
-    #         return jsonify({"success": False, "message": recognition_result['message']}), 400
-    # elif status == 'absent':
-    #     # Send SMS notification for absent student if phone number is available
-    #     if student.phone_number:
-    #         notification_result = send_absence_notification(
-    #             student_name=student.name,
-    #             phone_number=student.phone_number,
-    #             subject_name=subject.name,
-    #             section_name=section.name,
-    #             group_name=group.name,
-    #             date=datetime.now().strftime('%Y-%m-%d')
-    #         )
+        if recognition_result is None:
+            # Process face recognition in the worker pool, matching against this class only;
+            # keep what is needed to record the mark with the job in case the client has to poll for it
+            mark = {
+                "user_id": session['user_id'],
+                "student_id": student.id,
+                "status": status,
+                "section_id": session['section_id'],
+                "group_id": session['group_id'],
+                "subject_id": session['subject_id'],
+                "frame": frame
+            }
+            try:
+                job_id = get_recognition_pool().submit(process_face_recognition, image_bytes, student.name, None,
+                                                       [enrolled.name for enrolled in roster], context=mark)
+            except QueueFullError:
+                return jsonify({"success": False, "message": "Face recognition is busy. Please try again."}), 503, {"Retry-After": "2"}
             
-    #         if notification_result['success']:
-    #             logging.info(f"SMS notification sent to {student.name}")
-    #         else:
-    #             logging.warning(f"Failed to send SMS to {student.name}: {notification_result['message']}")
-    #     else:
-    #         logging.warning(f"No phone number available for {student.name}. SMS notification not sent.")
+            recognition_result = get_recognition_pool().wait(job_id, current_app.config["RECOGNITION_WAIT_TIMEOUT"])
+            if recognition_result is None:
+                return recognition_pending_response(job_id, f"Recognising {student.name}...")
+            get_recognition_pool().pop(job_id)
+            get_frame_cache().remember(session_key, student.id, frame, recognition_result)
+            archive_recognized_face(student.name, mark['group_id'], recognition_result)
+        
+        # A present mark needs the student's face, as in /sync_attendance
+        if not recognition_result['success']:
+            return jsonify({"success": False, "message": recognition_result['message']}), 400
     
     # Record the attendance
-    attendance = Attendance(
-        student_id=student_id,
-        section_id=session['section_id'],
-        group_id=session['group_id'],
-        subject_id=session['subject_id'],
-        status=status,
-        date=datetime.now().date(),
-        # Mark if notification was sent for absent students
-        notification_sent=(status == 'absent' and student.phone_number is not None)
-    )
-    db.session.add(attendance)
+    return record_attendance(student, status, session['section_id'], session['group_id'], session['subject_id'])
+
+@views.route('/process_attendance/<job_id>')
+def poll_attendance(job_id):
+    if 'user_id' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    
+    mark = get_recognition_pool().context(job_id)
+    if not mark or mark['user_id'] != session['user_id']:
+        return jsonify({"success": False, "message": "Unknown or expired recognition job"}), 404
+    
+    # Long-poll: hold the request until the job finishes or the wait times out
+    recognition_result = get_recognition_pool().wait(job_id, current_app.config["RECOGNITION_WAIT_TIMEOUT"])
+    if recognition_result is None:
+        return recognition_pending_response(job_id, "Still recognising...")
+    get_recognition_pool().pop(job_id)
+    
+    student = get_reference_cache().roster_student(mark['group_id'], mark['subject_id'], mark['student_id'])
+    if not student:
+        return jsonify({"success": False, "message": "Student not found in this class"}), 404
+    session_key = attendance_session_key(mark['user_id'], mark['section_id'], mark['group_id'], mark['subject_id'])
+    get_frame_cache().remember(session_key, student.id, mark['frame'], recognition_result)
+    archive_recognized_face(student.name, mark['group_id'], recognition_result)
+    if not recognition_result['success']:
+        return jsonify({"success": False, "message": recognition_result['message']}), 400
+    return record_attendance(student, mark['status'], mark['section_id'], mark['group_id'], mark['subject_id'])
+
+def check_synced_mark(mark):
+    """
+    Validate a mark sent by an offline client against the class it was taken in
+
+    Returns:
+        tuple: (student, date, None), or (None, None, error message)
+    """
+    if mark.get('status') not in ('present', 'absent'):
+        return None, None, "Status must be present or absent"
+    try:
+        day = datetime.strptime(str(mark.get('date')), '%Y-%m-%d').date()
+    except ValueError:
+        return None, None, "Invalid date"
+    age = (datetime.now().date() - day).days
+    if not -1 <= age <= SYNC_MAX_AGE_DAYS:
+        return None, None, f"Marks can only be synced within {SYNC_MAX_AGE_DAYS} days"
+    
+    reference_cache = get_reference_cache()
+    group = reference_cache.group(mark.get('group_id'))
+    if not group or str(group.section_id) != str(mark.get('section_id')):
+        return None, None, "Unknown class"
+    student = reference_cache.roster_student(mark.get('group_id'), mark.get('subject_id'), mark.get('student_id'))
+    if not student:
+        return None, None, "Student not found in this class"
+    return student, day, None
+
+@views.route('/sync_attendance', methods=['POST'])
+def sync_attendance():
+    """
+    Ingest a batch of marks queued by a client while it was offline
+
+    The body is multipart/form-data with a "marks" JSON array; each mark has a
+    client-generated idempotency "key", student_id, status, section_id,
+    group_id, subject_id and the date it was taken, and every present mark
+    comes with an "image-<key>" file. A key that was synced before gets its
+    first outcome back without anything being processed again; a batch with
+    a mark that has no key is refused.
+    
+    Captures that repeat an already recognised frame are rejected and
+    near-identical retries reuse their earlier result (see FrameCache); the
+    rest are recognised in parallel in the worker pool. Then all accepted
+    marks and the keys of every recognised or rejected mark are committed in
+    one transaction.
+    
+    Returns:
+        JSON with one result per mark: key, outcome ("recorded", "rejected", or
+        "retry" to send it again later), message and whether it was a duplicate
+    """
+    if 'user_id' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
     
     try:
-        db.session.commit()
+        marks = json.loads(request.form.get('marks') or '[]')
+    except ValueError:
+        return jsonify({"success": False, "message": "marks must be a JSON array"}), 400
+    if not isinstance(marks, list) or not all(isinstance(mark, dict) for mark in marks):
+        return jsonify({"success": False, "message": "marks must be a JSON array"}), 400
+    if len(marks) > MAX_SYNC_BATCH:
+        return jsonify({"success": False, "message": f"At most {MAX_SYNC_BATCH} marks can be synced at once"}), 400
+    
+    keys = [str(mark.get('key') or '')[:64] for mark in marks]
+    if not all(keys):
+        return jsonify({"success": False, "message": "Every mark needs an idempotency key"}), 400
+    synced_before = {synced.key: synced for synced in SyncedMark.query.filter(SyncedMark.key.in_(keys))}
+    
+    results = {}
+    accepted = {}  # key -> (mark, student, day, recognition job id or None, frame, earlier recognition result)
+    for key, mark in zip(keys, marks):
+        if key in synced_before:
+            synced = synced_before[key]
+            results[key] = {"outcome": synced.outcome, "message": synced.message, "duplicate": True}
+            continue
+        if key in results or key in accepted:
+            continue
         
-        # Prepare response message
-        response_message = f"Attendance marked as {status} for {student.name}"
-        if status == 'absent' and student.phone_number:
-            response_message += ". SMS notification sent."
-        elif status == 'absent' and not student.phone_number:
-            response_message += ". No phone number available for SMS notification."
-            
-        return jsonify({
-            "success": True, 
-            "message": response_message
+        student, day, error = check_synced_mark(mark)
+        if error:
+            results[key] = {"outcome": "rejected", "message": error, "duplicate": False}
+            continue
+        
+        job_id = frame = cached_result = None
+        if mark['status'] == 'present':
+            image_file = request.files.get(f'image-{key}')
+            if not image_file:
+                results[key] = {"outcome": "rejected", "message": "No image data provided for present student",
+                                "duplicate": False}
+                continue
+            image_bytes = image_file.read()
+            try:
+                frame = fingerprint_capture(image_bytes)
+            except Exception as e:
+                results[key] = {"outcome": "rejected", "message": f"Error processing image: {str(e)}",
+                                "duplicate": False}
+                continue
+            if get_frame_cache().is_replay(frame):
+                results[key] = {"outcome": "rejected", "message": "This frame was already used", "duplicate": False}
+                continue
+            session_key = attendance_session_key(session['user_id'], mark['section_id'], mark['group_id'],
+                                                 mark['subject_id'])
+            cached_result = get_frame_cache().lookup(session_key, student.id, frame)
+            if cached_result is None:
+                roster = [enrolled.name for enrolled in
+                          get_reference_cache().roster(mark['group_id'], mark['subject_id'])]
+                try:
+                    job_id = get_recognition_pool().submit(process_face_recognition, image_bytes, student.name,
+                                                           None, roster)
+                except QueueFullError:
+                    results[key] = {"outcome": "retry", "message": "Face recognition is busy", "duplicate": False}
+                    continue
+        accepted[key] = (mark, student, day, job_id, frame, cached_result)
+    
+    # Collect the recognition results, then commit the batch; the jobs run in parallel, so they
+    # share one RECOGNITION_WAIT_TIMEOUT, and marks whose job isn't done by then are retried later
+    rows = []
+    synced = []
+    deadline = time.monotonic() + current_app.config["RECOGNITION_WAIT_TIMEOUT"]
+    for key, (mark, student, day, job_id, frame, recognition_result) in accepted.items():
+        outcome, message = 'recorded', f"Attendance marked as {mark['status']} for {student.name}"
+        if job_id is not None:
+            try:
+                recognition_result = get_recognition_pool().wait(job_id, max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                recognition_result = {"success": False, "message": f"Error processing image: {str(e)}"}
+            get_recognition_pool().pop(job_id)
+            if recognition_result is None:
+                results[key] = {"outcome": "retry", "message": "Face recognition is taking too long",
+                                "duplicate": False}
+                continue
+            session_key = attendance_session_key(session['user_id'], mark['section_id'], mark['group_id'],
+                                                 mark['subject_id'])
+            get_frame_cache().remember(session_key, student.id, frame, recognition_result)
+            archive_recognized_face(student.name, mark['group_id'], recognition_result)
+        if recognition_result is not None and not recognition_result['success']:
+            outcome, message = 'rejected', recognition_result['message']
+        
+        if outcome == 'recorded':
+            rows.append(make_mark(student, mark['status'], mark['section_id'], mark['group_id'],
+                                  mark['subject_id'], date=day))
+        synced.append({"key": key, "user_id": session['user_id'], "student_id": student.id,
+                       "status": mark['status'], "outcome": outcome, "message": message[:200],
+                       "received_at": datetime.now()})
+        results[key] = {"outcome": outcome, "message": message, "duplicate": False}
+    
+    try:
+        get_attendance_writer().write(rows, synced)
+    except Exception as e:
+        logging.error("Error recording %d synced marks: %s", len(rows), e)
+        return jsonify({"success": False, "message": "Error saving the attendance marks. Please try again."}), 500
+    
+    return jsonify({
+        "success": True,
+        "message": f"{len(rows)} of {len(marks)} marks recorded",
+        "results": [dict(results[key], key=key) for key in keys]
+    })
+
+@views.route('/process_group_attendance', methods=['POST'])
+def process_group_attendance():
+    if 'user_id' not in session or not all(k in session for k in ['section_id', 'group_id', 'subject_id']):
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    
+    data = request.json
+    frames = data.get('frames') or []
+    if not frames:
+        return jsonify({"success": False, "message": "No image data provided"}), 400
+    if len(frames) > MAX_GROUP_FRAMES:
+        return jsonify({"success": False, "message": f"At most {MAX_GROUP_FRAMES} frames can be sent at once"}), 400
+    
+    students = get_reference_cache().roster(session['group_id'], session['subject_id'])
+    
+    # Detect every face in the frames and match them all against the class roster in one batch,
+    # in the worker pool so this thread isn't holding the GIL meanwhile
+    try:
+        job_id = get_recognition_pool().submit(recognize_group, frames, [student.name for student in students])
+        recognition_result = get_recognition_pool().wait(job_id, current_app.config["RECOGNITION_WAIT_TIMEOUT"])
+        get_recognition_pool().pop(job_id)
+    except QueueFullError:
+        return jsonify({"success": False, "message": "Face recognition is busy. Please try again."}), 503, {"Retry-After": "2"}
+    except Exception as e:
+        logging.error("Error in group recognition: %s", e)
+        return jsonify({"success": False, "message": f"Error processing image: {str(e)}"}), 400
+    if recognition_result is None:
+        return jsonify({"success": False, "message": "Face recognition is taking too long. Please try again."}), 503, {"Retry-After": "5"}
+    matches = recognition_result['matches']
+    
+    # Record attendance for the whole group in a single transaction
+    today = datetime.now().date()
+    marks = []
+    results = []
+    for student in students:
+        status = 'present' if student.name in matches else 'absent'
+        marks.append(make_mark(student, status, session['section_id'], session['group_id'],
+                               session['subject_id'], date=today))
+        results.append({
+            "student_id": student.id,
+            "student_name": student.name,
+            "status": status,
+            "similarity": matches.get(student.name)
         })
+    
+    try:
+        get_attendance_writer().write(marks)
     except Exception as e:
-        db.session.rollback()
-        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+        logging.error("Error recording group attendance: %s", e)
+        return jsonify({"success": False, "message": "Error saving the attendance marks. Please try again."}), 500
+    
+    present_count = len(matches)
+    return jsonify({
+        "success": True,
+        "message": f"{present_count} of {len(students)} students marked present",
+        "faces_detected": recognition_result['faces_detected'],
+        "results": results
+    })
+
+@views.route('/identify', methods=['POST'])
+def identify():
+    if 'user_id' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    
+    data = request.json
+    image_data = data.get('image_data')
+    try:
+        top_k = min(max(int(data.get('top_k', 1)), 1), 10)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "top_k must be a whole number"}), 400
+    
+    # Look the face up among every enrolled student (1:N identification)
+    result = identify_face(image_data, top_k=top_k)
+    if not result['success'] or not result['student_name']:
+        return jsonify(result)
+    
+    # Attach the matching student record so kiosks can mark attendance with it
+    student = get_reference_cache().student_by_name(result['student_name'])
+    result['student_id'] = student.id if student else None
+    return jsonify(result)
 
-@app.route('/summary')
+@views.route('/enroll_students', methods=['POST'])
+def enroll_students_upload():
+    """
+    Bulk-enrol students from an uploaded roster CSV ("roster") and zip of photos ("photos")
+
+    See utils.bulk_enrollment for the formats. Large batches are better run
+    with `flask enroll-students`, which doesn't hold a request open.
+    
+    Returns:
+        JSON report of the students created, photos enrolled and everything rejected
+    """
+    if 'user_id' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    
+    roster_file = request.files.get('roster')
+    photos_file = request.files.get('photos')
+    if not roster_file or not photos_file:
+        return jsonify({"success": False, "message": "A roster CSV and a zip of photos are required"}), 400
+    
+    # Worker processes read the photos from a file rather than from the request
+    with tempfile.NamedTemporaryFile(suffix='.zip') as photos_zip:
+        photos_file.save(photos_zip)
+        photos_zip.flush()
+        try:
+            roster_lines = io.TextIOWrapper(roster_file.stream, encoding='utf-8-sig')
+            report = enroll_students(roster_lines, photos_zip.name, workers=current_app.config["ENROLLMENT_WORKERS"])
+        except (ValueError, UnicodeDecodeError) as e:
+            return jsonify({"success": False, "message": f"Invalid upload: {str(e)}"}), 400
+        except Exception as e:
+            db.session.rollback()
+            logging.error("Error enrolling students: %s", e)
+            return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+    
+    # New students and enrolments were inserted in bulk, which the cache doesn't see by itself
+    get_reference_cache().invalidate('students', 'rosters')
+    return jsonify({"success": True, "message": f"{report['photos_enrolled']} of {report['photos']} photos enrolled",
+                    **report})
+
+@views.route('/summary')
 def summary():
     if 'user_id' not in session or not all(k in session for k in ['section_id', 'group_id', 'subject_id']):
-        return redirect(url_for('selection'))
-    
-    section = Section.query.get(session['section_id'])
-    group = Group.query.get(session['group_id'])
-    subject = Subject.query.get(session['subject_id'])
-    
-    # Get attendance for the current selections
-    attendance_records = Attendance.query.filter_by(
-        section_id=session['section_id'],
-        group_id=session['group_id'],
-        subject_id=session['subject_id'],
-        date=datetime.now().date()
-    ).all()
-    
-    # Organize attendance records
-    present_students = []
-    absent_students = []
-    
-    for record in attendance_records:
-        student = Student.query.get(record.student_id)
-        if record.status == 'present':
-            present_students.append(student)
-        else:
-            absent_students.append(student)
+        return redirect(url_for('.selection'))
+    
+    # Make sure marks still sitting in the write buffer are included
+    get_attendance_writer().flush()
     
-    # Export to CSV
-    csv_filename = export_attendance_to_csv(
-        section.name, 
-        group.name, 
-        subject.name, 
-        present_students, 
-        absent_students
-    )
+    # Get attendance for the current selections, students included, in one query
+    day_attendance = get_day_attendance(session['section_id'], session['group_id'],
+                                        session['subject_id'], datetime.now().date())
+    if day_attendance is None:
+        return redirect(url_for('.selection'))
     
     return render_template('summary.html', 
-                          section=section,
-                          group=group,
-                          subject=subject,
-                          present_students=present_students,
-                          absent_students=absent_students,
-                          csv_filename=csv_filename,
+                          section=day_attendance.section,
+                          group=day_attendance.group,
+                          subject=day_attendance.subject,
+                          present_students=day_attendance.present_students,
+                          absent_students=day_attendance.absent_students,
                           current_date=datetime.now().strftime('%Y-%m-%d'))
 
-@app.route('/export_csv')
+def parse_id_list(values):
+    """Turn repeated query-string values (or comma-separated ones) into a list of ids"""
+    return [int(value) for item in values for value in str(item).split(',') if value]
+
+@views.route('/export_csv')
 def export_csv():
+    """
+    Stream attendance as CSV
+
+    Query parameters (all optional, defaulting to today's class from the session):
+        start, end: Date range as YYYY-MM-DD
+        section: Section id
+        group, subject: One or more ids, repeated or comma-separated
+        archive: Set to 1 to also keep a copy in static/csv
+    """
     if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    section = Section.query.get(session['section_id'])
-    group = Group.query.get(session['group_id'])
-    subject = Subject.query.get(session['subject_id'])
-    
-    # Get all students and their attendance status
-    attendance_records = Attendance.query.filter_by(
-        section_id=session['section_id'],
-        group_id=session['group_id'],
-        subject_id=session['subject_id'],
-        date=datetime.now().date()
-    ).all()
-    
-    # Prepare data for CSV
-    present_students = []
-    absent_students = []
-    
-    for record in attendance_records:
-        student = Student.query.get(record.student_id)
-        if record.status == 'present':
-            present_students.append(student)
-        else:
-            absent_students.append(student)
+        return redirect(url_for('.login'))
+    
+    # Make sure marks still sitting in the write buffer are included
+    get_attendance_writer().flush()
+    
+    try:
+        today = datetime.now().date()
+        start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else today
+        end_date = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else start_date
+        section_id = int(request.args.get('section') or session.get('section_id') or 0) or None
+        group_ids = parse_id_list(request.args.getlist('group')) or parse_id_list([session.get('group_id') or ''])
+        subject_ids = parse_id_list(request.args.getlist('subject')) or parse_id_list([session.get('subject_id') or ''])
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid date or id in export parameters"}), 400
+    if end_date < start_date:
+        return jsonify({"success": False, "message": "End date is before start date"}), 400
+    
+    # Only touch the disk when an archival copy is asked for
+    archive_filename = None
+    if request.args.get('archive') == '1':
+        section = get_reference_cache().section(section_id) if section_id else None
+        archive_filename = archive_filename_for(section.name if section else 'all', start_date, end_date)
     
-    # Generate CSV file
-    csv_filename = export_attendance_to_csv(
-        section.name, 
-        group.name, 
-        subject.name, 
-        present_students, 
-        absent_students
-    )
+    rows = iter_attendance(start_date, end_date, section_id, group_ids, subject_ids)
+    download_name = f"attendance_{start_date:%Y%m%d}-{end_date:%Y%m%d}.csv"
+    headers = {"Content-Disposition": f'attachment; filename="{download_name}"'}
+    if archive_filename:
+        headers["X-Archive-Filename"] = archive_filename
     
-    return jsonify({"success": True, "filename": csv_filename})
+    return Response(stream_with_context(stream_attendance_csv(rows, archive_filename)),
+                    mimetype='text/csv', headers=headers)
 
-# Initialize the app with database
-with app.app_context():
-    create_tables_and_data()
+@views.route('/reports/term')
+def term_report():
+    """
+    Attendance percentages per student and subject over a term
+
+    Query parameters:
+        start, end: Term dates as YYYY-MM-DD (required)
+        section: Section id, defaults to the session's section
+        threshold: Percentage below which students are flagged, default 75
+    """
+    if 'user_id' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    
+    try:
+        start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.args['end'], '%Y-%m-%d').date()
+        section_id = int(request.args.get('section') or session.get('section_id') or 0) or None
+        threshold = float(request.args.get('threshold', DEFAULT_THRESHOLD))
+    except (KeyError, ValueError):
+        return jsonify({"success": False, "message": "start and end dates (YYYY-MM-DD) are required"}), 400
+    
+    # Make sure marks still sitting in the write buffer are included
+    get_attendance_writer().flush()
+    
+    report = build_term_report(start_date, end_date, section_id, threshold)
+    return jsonify({"success": True, **report})
+
+@views.route('/cache_stats')
+def cache_stats():
+    """Hits and misses of this worker's in-process caches"""
+    if 'user_id' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
     
+    return jsonify({
+        "success": True,
+        "reference_data": get_reference_cache().stats(),
+        "frames": get_frame_cache().stats(),
+        "term_reports": {"hits": analytics_cache.hits, "misses": analytics_cache.misses},
+    })
+
+@views.route('/metrics')
+def metrics():
+    """
+    Request latencies, SQL statements per request, pipeline stage timings and
+    cache hit counts of this worker, in the Prometheus text format
+    """
+    if not current_app.config["METRICS_ENABLED"]:
+        return jsonify({"success": False, "message": "Metrics are disabled"}), 404
+    
+    # Cache counters are read from the caches themselves at scrape time
+    cache_hits = Counter('reference_cache_hits_total', "Reference data lookups served from the cache", labels=('kind',))
+    cache_misses = Counter('reference_cache_misses_total', "Reference data lookups that hit the database", labels=('kind',))
+    for kind, stats in get_reference_cache().stats().items():
+        cache_hits.inc(kind, amount=stats["hits"])
+        cache_misses.inc(kind, amount=stats["misses"])
+    
+    return Response(render_metrics([cache_hits, cache_misses]), mimetype='text/plain; version=0.0.4')
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Development server only; see wsgi.py for running under gunicorn. Set FLASK_DEBUG=1 for the debugger
+    create_app().run(host="0.0.0.0", port=5000, debug=os.environ.get("FLASK_DEBUG", "0") == "1")
@@ -0,0 +1,75 @@
+"""
+Recall and latency of the IVF index against brute-force search
+
+Builds a synthetic gallery of students with several noisy photos each,
+queries it with fresh noisy captures and reports, for each n_probe, the
+recall@1 against exact brute-force search and the per-query latency.
+
+Usage:
+    python benchmarks/ann_benchmark.py --students 10000 --photos 3
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ann_index import IVFIndex
+from utils.face_recognition_utils import ENCODING_DIM, normalize_rows
+
+
+def make_gallery(n_students, photos_per_student, noise, seed=0):
+    """Random unit-vector identities with noisy photos around each one"""
+    rng = np.random.default_rng(seed)
+    identities = normalize_rows(rng.standard_normal((n_students, ENCODING_DIM)))
+    photos = np.repeat(identities, photos_per_student, axis=0)
+    photos = normalize_rows(photos + noise * rng.standard_normal(photos.shape) / np.sqrt(ENCODING_DIM))
+    labels = np.repeat(np.arange(n_students), photos_per_student)
+    return identities, photos, labels
+
+
+def time_per_query(search, queries):
+    start = time.perf_counter()
+    results = [search(query) for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--photos', type=int, default=3, help="Photos per student")
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--noise', type=float, default=0.5, help="Noise added to photos and captures")
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    identities, photos, labels = make_gallery(args.students, args.photos, args.noise)
+    rng = np.random.default_rng(1)
+    query_labels = rng.integers(0, args.students, args.queries)
+    queries = normalize_rows(identities[query_labels]
+                             + args.noise * rng.standard_normal((args.queries, ENCODING_DIM)) / np.sqrt(ENCODING_DIM))
+
+    start = time.perf_counter()
+    index = IVFIndex.build(photos, np.arange(len(photos)))
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"Gallery: {len(photos)} photos of {args.students} students, "
+          f"IVF with {index.n_lists} lists built in {build_ms:.0f} ms")
+
+    exact, brute_ms = time_per_query(lambda query: int(np.argmax(photos @ query)), queries)
+    exact = np.array(exact)
+    exact_accuracy = np.mean(labels[exact] == query_labels)
+    print(f"{'brute force':>12}  recall@1 1.000  identity acc {exact_accuracy:.3f}  {brute_ms:.3f} ms/query")
+
+    for n_probe in args.n_probe:
+        found, ivf_ms = time_per_query(lambda query: int(index.search(query, k=1, n_probe=n_probe)[0][0]), queries)
+        found = np.array(found)
+        recall = np.mean(found == exact)
+        accuracy = np.mean(labels[found] == query_labels)
+        print(f"{'n_probe=' + str(n_probe):>12}  recall@1 {recall:.3f}  identity acc {accuracy:.3f}  "
+              f"{ivf_ms:.3f} ms/query ({brute_ms / ivf_ms:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Absence-notification throughput with the fake SMS provider
+
+Creates --students students in a temporary database, marks them all absent
+through the attendance writer (queueing one notification each), then runs
+the dispatcher until the outbox is empty and reports messages per second.
+The fake provider takes --latency seconds per message, like a gateway round
+trip, and fails --failure-rate of them, which are retried at once.
+
+Usage:
+    python benchmarks/notification_benchmark.py --students 2000 --batch-size 10 50 200 --latency 0.002
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('RECOGNITION_WORKERS', '0')
+os.environ.setdefault('RECOGNITION_WARM_UP', '0')
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+from app import create_app  # noqa: E402
+from models import db, Section, Group, Subject, Student, NotificationOutbox  # noqa: E402
+from utils.attendance_writer import make_mark  # noqa: E402
+from utils.notifications import NotificationDispatcher  # noqa: E402
+from utils.sms_utils import FakeProvider  # noqa: E402
+
+
+def run(args, batch_size, tmp):
+    """Queue and send one notification per student; returns (queue ms, send seconds, sent)"""
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(tmp, f'bench{batch_size}.db')}",
+                      "NOTIFICATION_PROVIDER": "none"})
+    with app.app_context():
+        section = Section(name="S")
+        group = Group(name="G", section=section)
+        subject = Subject(name="Subject")
+        students = [Student(name=f"student{i}", phone_number=f"+91{i:010d}") for i in range(args.students)]
+        db.session.add_all([section, group, subject, *students])
+        db.session.commit()
+        rows = [make_mark(student, 'absent', section.id, group.id, subject.id) for student in students]
+
+    start = time.perf_counter()
+    app.extensions["attendance_writer"].write(rows)
+    queue_ms = (time.perf_counter() - start) * 1000
+
+    provider = FakeProvider(latency=args.latency, failure_rate=args.failure_rate, seed=1)
+    dispatcher = NotificationDispatcher(app, provider, batch_size=batch_size, rate_limit=args.rate,
+                                        max_attempts=args.students, retry_delay=0)
+    start = time.perf_counter()
+    while True:
+        with app.app_context():
+            remaining = db.session.execute(db.select(db.func.count()).where(
+                NotificationOutbox.state.in_(['pending', 'sending']))).scalar()
+        if not remaining:
+            break
+        dispatcher.dispatch_once()
+    return queue_ms, time.perf_counter() - start, len(provider.sent)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds per message at the fake gateway")
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--rate', type=float, default=1e6, help="Messages per second allowed by the rate limit")
+    args = parser.parse_args()
+
+    print(f"{'batch':>6} {'queue ms':>9} {'send s':>8} {'sent':>6} {'msgs/s':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for batch_size in args.batch_size:
+            queue_ms, send_s, sent = run(args, batch_size, tmp)
+            print(f"{batch_size:>6} {queue_ms:>9.1f} {send_s:>8.2f} {sent:>6} {sent / send_s:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Per-class matching latency as the institution grows
+
+Builds synthetic galleries of increasing size and times matching a capture
+of one class's student against the whole gallery and against the class
+roster only, plus a group photo of --faces students against the roster.
+Roster matching should stay flat while whole-gallery matching grows with
+the number of students.
+
+Usage:
+    python benchmarks/roster_benchmark.py --students 1000 10000 50000 --class-size 40
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.face_recognition_utils import FaceGallery, normalize_rows
+from ann_benchmark import make_gallery
+
+
+def build_gallery(faces_dir, n_students, photos_per_student, noise):
+    """A FaceGallery holding synthetic photos, without touching the disk"""
+    identities, photos, labels = make_gallery(n_students, photos_per_student, noise)
+    students = [f"student{i}" for i in range(n_students)]
+
+    gallery = FaceGallery(faces_dir)
+    gallery.photos = {f"{students[label]}/{row}.jpg": {'id': row, 'student': students[label], 'mtime': 0,
+                                                        'size': 0, 'encoding': photos[row]}
+                      for row, label in enumerate(labels)}
+    gallery._rebuild(students)
+    return gallery, identities, students
+
+
+def time_per_call(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--photos', type=int, default=3, help="Photos per student")
+    parser.add_argument('--class-size', type=int, default=40)
+    parser.add_argument('--faces', type=int, default=20, help="Faces in each group photo")
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=0.5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    print(f"{'students':>9} {'whole ms':>9} {'roster ms':>10} {'group ms':>9} {'first view ms':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_students in args.students:
+            gallery, identities, students = build_gallery(tmp, n_students, args.photos, args.noise)
+            members = rng.choice(n_students, size=min(args.class_size, n_students), replace=False)
+            roster = [students[i] for i in members]
+            capture = normalize_rows(identities[members[:1]] + args.noise * rng.standard_normal(
+                (1, identities.shape[1])) / np.sqrt(identities.shape[1]))[0]
+            group_photo = identities[members[:args.faces]]
+
+            start = time.perf_counter()
+            gallery.roster_view(roster)
+            first_view_ms = (time.perf_counter() - start) * 1000
+
+            whole_ms = time_per_call(lambda: gallery.match(capture), args.calls)
+            roster_ms = time_per_call(lambda: gallery.match(capture, roster), args.calls)
+            group_ms = time_per_call(lambda: gallery.match_group(group_photo, roster), args.calls)
+            print(f"{n_students:>9} {whole_ms:>9.3f} {roster_ms:>10.3f} {group_ms:>9.3f} {first_view_ms:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
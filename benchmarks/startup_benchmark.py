@@ -0,0 +1,76 @@
+"""
+Worker startup time
+
+Starts fresh Python processes the way a server boots a worker: import the
+app module, call create_app() and serve a first request. Each phase is
+timed separately and the median over all runs is compared with a target,
+so a slow import or setup step added later shows up as a failure.
+
+The app is pointed at a throwaway SQLite database, so the first run also
+includes applying every schema migration to an empty database; later runs
+see an up-to-date schema like a restarted worker would.
+
+Usage:
+    python benchmarks/startup_benchmark.py --runs 5 --target-ms 1500
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in each child process; prints the phase timings as JSON
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app({"SQLALCHEMY_DATABASE_URI": sys.argv[1]})
+created = time.perf_counter()
+response = app.test_client().get('/login')
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "total_ms": (served - start) * 1000,
+}))
+"""
+
+
+def run_once(database_uri):
+    env = dict(os.environ, RECOGNITION_WARM_UP='0', PYTHONPATH=ROOT)
+    output = subprocess.run([sys.executable, '-c', CHILD, database_uri], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--target-ms', type=float, default=1500, help="Median total startup time to stay under")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_uri = 'sqlite:///' + os.path.join(tmp, 'startup.db')
+        runs = [run_once(database_uri) for _ in range(args.runs)]
+
+    for phase in ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms'):
+        values = [run[phase] for run in runs]
+        print(f"{phase:<18} median {statistics.median(values):8.1f} ms  "
+              f"min {min(values):8.1f} ms  max {max(values):8.1f} ms")
+
+    median_total = statistics.median(run['total_ms'] for run in runs)
+    if median_total > args.target_ms:
+        print(f"FAIL: median startup {median_total:.0f} ms is over the {args.target_ms:.0f} ms target")
+        sys.exit(1)
+    print(f"OK: median startup {median_total:.0f} ms is within the {args.target_ms:.0f} ms target")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+"""
+Benchmark suite for the recognition, marking and reporting paths
+
+Generates a synthetic institution in a temporary directory: --sections
+sections of --groups groups with --students students each, every student
+enrolled in their group for --subjects subjects, --days days of attendance
+history ending today, and one synthetic face photo per student. Then it
+measures:
+
+    load_known_faces_cold     Building the face gallery from the photos
+    load_known_faces_warm     Loading the gallery from its on-disk index
+    attach_gallery            Mapping the shared gallery file, as a recognition worker does
+    process_face_recognition  Recognising one capture against its class roster
+    mark_absent               /process_attendance throughput without recognition
+    mark_present              /process_attendance throughput with recognition
+    summary                   /summary latency for one class
+    export_csv                /export_csv latency for one section over every day
+    export_csv_size           Size of that CSV export
+
+Synthetic faces are random blob patterns, one per student, and captures are
+the same pattern with noise added. The Haar detector finds no face in them,
+so the whole image is encoded, which exercises every pipeline stage without
+needing real photos. Everything runs in this process through the Flask test
+client; recognition runs inline (RECOGNITION_WORKERS=0).
+
+Results are printed and, with --output, written as JSON. --compare checks
+them against an earlier results file and exits with status 1 if any metric
+is more than --tolerance worse, so it can gate performance changes:
+
+Usage:
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --compare baseline.json --tolerance 0.2
+"""
+import io
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('RECOGNITION_WORKERS', '0')
+os.environ.setdefault('RECOGNITION_WARM_UP', '0')
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models import db, User, Section, Group, Subject, Student, Attendance, Enrollment  # noqa: E402
+from utils.face_recognition_utils import attach_gallery, init_gallery, load_known_faces, process_face_recognition  # noqa: E402
+
+FACE_SIZE = 160
+
+
+def synthetic_face(seed, noise=0.0):
+    """JPEG bytes of a student's blob pattern, optionally with pixel noise as a stand-in for a new capture"""
+    rng = np.random.default_rng(seed)
+    image = Image.new('L', (FACE_SIZE, FACE_SIZE), int(rng.integers(60, 200)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.integers(0, FACE_SIZE, 2)
+        r = int(rng.integers(10, 40))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=int(rng.integers(0, 256)))
+    image = image.filter(ImageFilter.GaussianBlur(4))
+
+    if noise:
+        pixels = np.asarray(image, dtype=np.float32)
+        pixels += np.random.default_rng().normal(0, noise, pixels.shape)
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def build_institution(app, args):
+    """
+    Fill the database and faces directory with the synthetic institution
+
+    Returns:
+        list: (section id, group id, [(student id, student name)]) per group
+    """
+    with app.app_context():
+        db.session.add(User(username='bench', password_hash=generate_password_hash('bench')))
+        subjects = [Subject(name=f"Subject {i}") for i in range(args.subjects)]
+        db.session.add_all(subjects)
+
+        classes = []
+        for s in range(args.sections):
+            section = Section(name=f"S{s}")
+            db.session.add(section)
+            for g in range(args.groups):
+                group = Group(name=f"S{s}G{g}", section=section)
+                students = [Student(name=f"s{s}g{g}n{n}", phone_number=f"+91{s:03d}{g:03d}{n:04d}")
+                            for n in range(args.students)]
+                db.session.add(group)
+                db.session.add_all(students)
+                classes.append((section, group, students))
+        db.session.flush()
+
+        enrollments = [{'student_id': student.id, 'group_id': group.id, 'subject_id': subject.id}
+                       for _, group, students in classes for student in students for subject in subjects]
+        db.session.execute(db.insert(Enrollment), enrollments)
+
+        today = date.today()
+        marks = [{'student_id': student.id, 'section_id': section.id, 'group_id': group.id,
+                  'subject_id': subject.id, 'status': 'present' if (student.id + day) % 5 else 'absent',
+                  'date': today - timedelta(days=day), 'timestamp': datetime.now(), 'notification_sent': False}
+                 for day in range(args.days) for section, group, students in classes
+                 for student in students for subject in subjects]
+        for start in range(0, len(marks), 5000):
+            db.session.execute(db.insert(Attendance), marks[start:start + 5000])
+        db.session.commit()
+
+        classes = [(section.id, group.id, [(student.id, student.name) for student in students])
+                   for section, group, students in classes]
+
+    faces_dir = app.config["FACES_DIR"]
+    for _, _, students in classes:
+        for student_id, student_name in students:
+            os.makedirs(os.path.join(faces_dir, student_name), exist_ok=True)
+            with open(os.path.join(faces_dir, student_name, 'photo.jpg'), 'wb') as f:
+                f.write(synthetic_face(student_id))
+
+    return classes
+
+
+def timed(fn, repeat):
+    """Call fn repeat times; returns the per-call latencies in milliseconds"""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def latency_result(latencies):
+    latencies = sorted(latencies)
+    return {
+        "value": statistics.median(latencies),
+        "unit": "ms",
+        "better": "lower",
+        "p95": latencies[max(int(len(latencies) * 0.95) - 1, 0)],
+        "samples": len(latencies),
+    }
+
+
+def logged_in_client(app, section_id, group_id, subject_id):
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'bench'})
+    client.post('/selection', data={'section': section_id, 'group': group_id, 'subject': subject_id})
+    return client
+
+
+def run_suite(args, tmp):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'bench.db'),
+        'FACES_DIR': os.path.join(tmp, 'faces'),
+        'RECOGNIZED_FACES_DIR': os.path.join(tmp, 'recognized_faces'),
+        'GALLERY_INDEX_PATH': os.path.join(tmp, 'gallery.json'),
+    })
+    os.makedirs(app.config["FACES_DIR"], exist_ok=True)
+    classes = build_institution(app, args)
+    results = {}
+    rng = np.random.default_rng(0)
+
+    # Gallery: built from every photo, then reloaded from the index it wrote
+    start = time.perf_counter()
+    init_gallery(app.config["FACES_DIR"], app.config["GALLERY_INDEX_PATH"])
+    results["load_known_faces_cold"] = latency_result([(time.perf_counter() - start) * 1000])
+    results["load_known_faces_warm"] = latency_result(timed(
+        lambda: init_gallery(app.config["FACES_DIR"], app.config["GALLERY_INDEX_PATH"]), args.repeat))
+    results["attach_gallery"] = latency_result(timed(
+        lambda: attach_gallery(app.config["FACES_DIR"], app.config["GALLERY_INDEX_PATH"]), args.repeat))
+    matrix, _ = load_known_faces(app.config["FACES_DIR"])
+    results["gallery_rows"] = {"value": len(matrix), "unit": "rows", "better": None}
+
+    # Recognition of one capture against its class roster, called directly
+    captures = []
+    for _ in range(args.repeat):
+        _, _, students = classes[rng.integers(len(classes))]
+        student_id, student_name = students[rng.integers(len(students))]
+        captures.append((synthetic_face(student_id, noise=8), student_name, [name for _, name in students]))
+    recognised = []
+    remaining = iter(captures)
+
+    def recognise():
+        image_bytes, student_name, roster = next(remaining)
+        recognised.append(process_face_recognition(image_bytes, student_name, None, roster)["success"])
+
+    results["process_face_recognition"] = latency_result(timed(recognise, args.repeat))
+    results["process_face_recognition"]["match_rate"] = sum(recognised) / len(recognised)
+
+    # Marking throughput through the full request path, one class per subject
+    section_id, group_id, students = classes[0]
+    client = logged_in_client(app, section_id, group_id, 1)
+    for status in ('absent', 'present'):
+        marks = [(student_id, status) for student_id, _ in students][:args.marks]
+        payloads = [{'student_id': student_id, 'status': status} for student_id, status in marks]
+        if status == 'present':
+            for payload in payloads:
+                payload['image_data'] = 'data:image/jpeg;base64,' + base64.b64encode(
+                    synthetic_face(payload['student_id'], noise=8)).decode()
+
+        errors = 0
+        start = time.perf_counter()
+        for payload in payloads:
+            if client.post('/process_attendance', json=payload).status_code != 200:
+                errors += 1
+        elapsed = time.perf_counter() - start
+        results[f"mark_{status}"] = {"value": len(payloads) / elapsed, "unit": "marks/s", "better": "higher",
+                                     "errors": errors, "samples": len(payloads)}
+
+    # Reporting
+    results["summary"] = latency_result(timed(lambda: client.get('/summary'), args.repeat))
+
+    first_day = (date.today() - timedelta(days=args.days - 1)).isoformat()
+    export_url = f"/export_csv?start={first_day}&end={date.today().isoformat()}&section={section_id}" \
+                 f"&group={','.join(str(group) for section, group, _ in classes if section == section_id)}" \
+                 f"&subject={','.join(str(i + 1) for i in range(args.subjects))}"
+    sizes = []
+    results["export_csv"] = latency_result(timed(lambda: sizes.append(len(client.get(export_url).data)),
+                                                 max(args.repeat // 5, 1)))
+    results["export_csv_size"] = {"value": sizes[-1], "unit": "bytes", "better": "lower"}
+
+    app.extensions['attendance_writer'].close()
+    app.extensions['face_archive'].close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def suite_parameters(args):
+    """The arguments that shape the synthetic institution and the sampling"""
+    return {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'tolerance')}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print each metric next to its baseline
+
+    Returns:
+        list: Names of the metrics that got worse by more than tolerance
+    """
+    regressions = []
+    print(f"\n{'metric':<26} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None or not result.get("better") or not before["value"]:
+            continue
+        change = result["value"] / before["value"] - 1
+        worse = change > tolerance if result["better"] == "lower" else change < -tolerance
+        if worse:
+            regressions.append(name)
+        print(f"{name:<26} {before['value']:>12.2f} {result['value']:>12.2f} {change:>+7.1%}"
+              f"{'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sections', type=int, default=3)
+    parser.add_argument('--groups', type=int, default=3, help="Groups per section")
+    parser.add_argument('--students', type=int, default=40, help="Students per group")
+    parser.add_argument('--subjects', type=int, default=3)
+    parser.add_argument('--days', type=int, default=30, help="Days of attendance history")
+    parser.add_argument('--repeat', type=int, default=50, help="Samples per latency metric")
+    parser.add_argument('--marks', type=int, default=40, help="Marks sent per throughput metric")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Compare with the results in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative slowdown before failing")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run_suite(args, tmp)
+
+    print(f"{'metric':<26} {'value':>12} {'unit':<8} {'p95':>10}")
+    for name, result in results.items():
+        p95 = f"{result['p95']:.2f}" if 'p95' in result else ''
+        print(f"{name:<26} {result['value']:>12.2f} {result['unit']:<8} {p95:>10}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "meta": {
+                    "commit": git_commit(),
+                    "timestamp": datetime.now().isoformat(timespec='seconds'),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "parameters": suite_parameters(args),
+                },
+                "results": results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["parameters"] != suite_parameters(args):
+            print("\nWarning: the baseline was run with different parameters")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\nFAIL: {', '.join(regressions)} regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print(f"\nOK: no metric regressed by more than {args.tolerance:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Bytes on the wire and server decode time for captured frames
+
+Compares the original upload (full-resolution webcam frame as a base64 JPEG
+data URL inside a JSON body) with the current one (middle square cropped,
+downscaled to the capture size and sent as a binary JPEG in a multipart
+form or as a raw body). Decode time covers what the server does before
+recognition: parsing the request body and decoding the JPEG.
+
+Usage:
+    python benchmarks/upload_benchmark.py --width 1280 --height 720 --size 320
+"""
+import os
+import io
+import json
+import time
+import base64
+import argparse
+from PIL import Image
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_frame(width, height):
+    """A webcam-like frame: a gradient background with an enrolled face photo in the middle"""
+    frame = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    face = Image.open(os.path.join(ROOT, 'static', 'faces', 'Tanish', 'Tanish.jpeg')).convert('RGB')
+    face.thumbnail((height * 2 // 3, height * 2 // 3))
+    frame.paste(face, ((width - face.width) // 2, (height - face.height) // 2))
+    return frame
+
+
+def to_jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def json_request(frame):
+    # canvas.toDataURL('image/jpeg') encodes at quality 0.92 by default
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(to_jpeg(frame, 92)).decode()
+    body = json.dumps({'student_id': '1', 'status': 'present', 'image_data': data_url}).encode()
+    return EnvironBuilder(method='POST', data=body, content_type='application/json')
+
+
+def capture(frame, size, quality):
+    """Same crop and downscale as capturePhoto() in static/js/script.js"""
+    crop = min(frame.width, frame.height)
+    left, top = (frame.width - crop) // 2, (frame.height - crop) // 2
+    square = frame.crop((left, top, left + crop, top + crop))
+    return to_jpeg(square.resize((min(crop, size),) * 2, Image.BILINEAR), quality)
+
+
+def multipart_request(jpeg):
+    return EnvironBuilder(method='POST', data={
+        'student_id': '1',
+        'status': 'present',
+        'image': (io.BytesIO(jpeg), 'capture.jpg', 'image/jpeg'),
+    })
+
+
+def raw_request(jpeg):
+    return EnvironBuilder(method='POST', query_string={'student_id': '1', 'status': 'present'},
+                          data=jpeg, content_type='image/jpeg')
+
+
+def decode_json(request):
+    image_data = request.get_json()['image_data']
+    image_data = image_data.split(',')[1] if ',' in image_data else image_data
+    return base64.b64decode(image_data)
+
+
+def decode_multipart(request):
+    return request.files['image'].read()
+
+
+def decode_raw(request):
+    return request.get_data()
+
+
+def measure(builder, decode, repeat):
+    environ = builder.get_environ()
+    body = environ['wsgi.input'].read()
+    size = len(body)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        environ['wsgi.input'] = io.BytesIO(body)
+        image = Image.open(io.BytesIO(decode(Request(environ))))
+        image.load()
+    return size, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--size', type=int, default=320, help="CAPTURE_SIZE")
+    parser.add_argument('--quality', type=float, default=0.8, help="CAPTURE_QUALITY")
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    frame = make_frame(args.width, args.height)
+    jpeg = capture(frame, args.size, int(args.quality * 100))
+
+    cases = [
+        (f"before: JSON base64 {args.width}x{args.height}", json_request(frame), decode_json),
+        (f"after: multipart {args.size}x{args.size}", multipart_request(jpeg), decode_multipart),
+        (f"after: raw body {args.size}x{args.size}", raw_request(jpeg), decode_raw),
+    ]
+
+    baseline = None
+    for name, builder, decode in cases:
+        size, decode_ms = measure(builder, decode, args.repeat)
+        baseline = baseline or (size, decode_ms)
+        print(f"{name:<36} {size / 1024:8.1f} KiB ({size / baseline[0]:5.1%})  "
+              f"decode {decode_ms:6.2f} ms ({decode_ms / baseline[1]:5.1%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+
+# Worker processes, each with its own app, attendance writer and recognition pool.
+# Face recognition runs in RECOGNITION_WORKERS processes per worker, so keep
+# workers x RECOGNITION_WORKERS around the number of cores.
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+
+# Threads per worker for ordinary requests; they mostly wait on recognition jobs
+# and commits. Size DB_POOL_SIZE to at least this plus one for the attendance writer.
+# An open live attendance board (/attendance/stream) holds a thread for as long
+# as it streams, each for at most LIVE_BOARD_MAX_STREAM_SECONDS, so every worker
+# gets LIVE_BOARD_MAX_STREAMS more threads on top for them. Streams let go of
+# their database connection once the snapshot is read, so the pool needs no more.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4)) + int(os.environ.get("LIVE_BOARD_MAX_STREAMS", 32))
+
+# Recognition requests long-poll for up to RECOGNITION_WAIT_TIMEOUT seconds
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+
+# Don't build the app before forking: background threads and the recognition
+# process pool must be started in each worker
+preload_app = False
+
+accesslog = "-"
@@ -1,4 +1,9 @@
-from app import app
+import os
+
+from app import create_app
+
+app = create_app()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    # Development server only; see wsgi.py for running under gunicorn. Set FLASK_DEBUG=1 for the debugger
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get("FLASK_DEBUG", "0") == "1")
@@ -43,16 +43,75 @@ class Student(db.Model):
     phone_number = db.Column(db.String(15), nullable=True)  # Added phone number for SMS notifications
     email = db.Column(db.String(100), nullable=True)  # Optional email for future features
     attendance = db.relationship('Attendance', backref='student', lazy=True)
+    enrollments = db.relationship('Enrollment', backref='student', lazy=True)
     notification_sent = db.Column(db.Boolean, default=False)  # Track if notification has been sent
 
+# Enrollment model: a student taking a subject with a group
+class Enrollment(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'group_id', 'subject_id', name='uq_enrollment'),
+        # Rosters are looked up by class
+        db.Index('ix_enrollment_class', 'group_id', 'subject_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
+
 # Attendance model
 class Attendance(db.Model):
+    __table_args__ = (
+        # A student has at most one mark per section, group, subject and day
+        db.UniqueConstraint('student_id', 'section_id', 'group_id', 'subject_id', 'date', name='uq_attendance_mark'),
+        # Lookups of a whole class on a given day (summary, export)
+        db.Index('ix_attendance_class_day', 'section_id', 'group_id', 'subject_id', 'date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
     section_id = db.Column(db.Integer, db.ForeignKey('section.id'), nullable=False)
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
     status = db.Column(db.String(10), nullable=False)  # 'present' or 'absent'
-    date = db.Column(db.Date, nullable=False, default=datetime.now().date())
+    date = db.Column(db.Date, nullable=False, default=lambda: datetime.now().date())
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.now)
     notification_sent = db.Column(db.Boolean, default=False)  # Track if absence notification has been sent
+
+# SyncedMark model: a mark queued offline by a client, recorded under the client's idempotency key
+# so that sending the same mark again returns the first outcome instead of re-processing it
+class SyncedMark(db.Model):
+    key = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    status = db.Column(db.String(10), nullable=False)  # 'present' or 'absent'
+    outcome = db.Column(db.String(10), nullable=False)  # 'recorded' or 'rejected'
+    message = db.Column(db.String(200), nullable=True)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+# NotificationOutbox model: an absence notification waiting to be sent, written in the same
+# transaction as the absent mark and sent later by the notification dispatcher
+class NotificationOutbox(db.Model):
+    __tablename__ = 'notification_outbox'
+    __table_args__ = (
+        # One notification per absence, however often the student is marked absent
+        db.UniqueConstraint('student_id', 'section_id', 'group_id', 'subject_id', 'date', name='uq_notification_mark'),
+        # The dispatcher looks for notifications that are due
+        db.Index('ix_notification_due', 'state', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    section_id = db.Column(db.Integer, db.ForeignKey('section.id'), nullable=False)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    state = db.Column(db.String(10), nullable=False, default='pending')  # 'pending', 'sending', 'sent', 'failed' or 'cancelled'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    claim = db.Column(db.String(32), nullable=True)  # Dispatcher run that is sending it
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    provider_message_id = db.Column(db.String(64), nullable=True)
+    last_error = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    sent_at = db.Column(db.DateTime, nullable=True)
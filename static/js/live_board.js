@@ -0,0 +1,81 @@
+// Live attendance board
+//
+// Keeps the cards on the attendance page up to date with marks recorded by
+// any teacher or device, over a Server-Sent Events stream from
+// /attendance/stream. Each open stream holds a server thread, so it is only
+// opened when the teacher asks for live updates, and the server ends it after
+// a few minutes or turns it away when too many are open. The stream opens
+// with a snapshot of every mark so far and then pushes each new one;
+// EventSource reconnects by itself after a dropped connection, and the fresh
+// snapshot covers whatever was missed.
+
+let liveBoard = null;
+
+// Show a mark from the stream on its card
+function showStreamedMark(mark) {
+    const spinner = document.getElementById(`spinner-${mark.student_id}`);
+    if (spinner) spinner.remove();
+    updateAttendanceUI(mark.student_id, mark.status);
+}
+
+// Show whether live updates are on, and offer to turn them on or off
+function showLiveBoardState(message, streaming) {
+    const status = document.getElementById('live-board-status');
+    if (status) status.textContent = message;
+    const toggle = document.getElementById('live-board-toggle');
+    if (toggle) toggle.textContent = streaming ? 'Stop live updates' : 'Show live updates';
+}
+
+function closeLiveBoard(message) {
+    if (liveBoard) liveBoard.close();
+    liveBoard = null;
+    showLiveBoardState(message, false);
+}
+
+function openLiveBoard(url) {
+    if (liveBoard) liveBoard.close();
+    liveBoard = new EventSource(url);
+    showLiveBoardState('Connecting...', true);
+    
+    liveBoard.addEventListener('snapshot', event => {
+        JSON.parse(event.data).marks.forEach(showStreamedMark);
+        checkAllAttendanceMarked();
+        showLiveBoardState('Live', true);
+    });
+    
+    liveBoard.addEventListener('mark', event => {
+        showStreamedMark(JSON.parse(event.data));
+        checkAllAttendanceMarked();
+    });
+    
+    // The server dropped marks this board fell behind on; start over with a new snapshot
+    liveBoard.addEventListener('reload', () => openLiveBoard(url));
+    
+    // The server ended the stream to free its thread; don't let EventSource reconnect
+    liveBoard.addEventListener('end', () => closeLiveBoard('Live updates paused'));
+    
+    // A refused connection (e.g. too many boards open) isn't retried by EventSource
+    liveBoard.addEventListener('error', () => {
+        if (liveBoard && liveBoard.readyState === EventSource.CLOSED) {
+            closeLiveBoard('Live updates unavailable, try again later');
+        }
+    });
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const container = document.getElementById('attendance-cards');
+    const toggle = document.getElementById('live-board-toggle');
+    if (!container || !container.dataset.streamUrl || !toggle) return;
+    if (!window.EventSource) {
+        toggle.style.display = 'none';
+        return;
+    }
+    
+    toggle.addEventListener('click', () => {
+        if (liveBoard) {
+            closeLiveBoard('');
+        } else {
+            openLiveBoard(container.dataset.streamUrl);
+        }
+    });
+});
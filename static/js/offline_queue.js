@@ -0,0 +1,179 @@
+// Offline queue for attendance marks
+//
+// Every mark, with its captured frame, is saved in IndexedDB first and then
+// sent to /sync_attendance in batches. Each mark carries an idempotency key,
+// so a batch that was received but whose response got lost can simply be
+// sent again; the server answers repeated keys with their first outcome.
+// Marks stay queued across page reloads until the server has answered them.
+
+const MARK_QUEUE_DB = 'attendance-queue';
+const MARK_QUEUE_STORE = 'marks';
+const SYNC_BATCH_SIZE = 20;
+// Delays before retrying after consecutive failed syncs
+const SYNC_RETRY_DELAYS_MS = [2000, 5000, 15000, 30000, 60000];
+
+let markQueueDb = null;  // Promise of the database, resolving to null where IndexedDB is unavailable
+const memoryQueue = new Map();  // Used instead when IndexedDB can't be opened, e.g. in private browsing
+const syncListeners = [];
+let syncInProgress = null;
+let syncFailures = 0;
+let syncTimer = null;
+
+// Open (and on first use create) the queue database
+function openMarkQueue() {
+    if (markQueueDb) return markQueueDb;
+
+    markQueueDb = new Promise(resolve => {
+        if (!window.indexedDB) {
+            resolve(null);
+            return;
+        }
+        const request = indexedDB.open(MARK_QUEUE_DB, 1);
+        request.onupgradeneeded = () => {
+            request.result.createObjectStore(MARK_QUEUE_STORE, { keyPath: 'key' });
+        };
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => {
+            console.warn('IndexedDB unavailable, queued marks will only be kept until the page is closed:', request.error);
+            resolve(null);
+        };
+    });
+    return markQueueDb;
+}
+
+// Run one IndexedDB request in its own transaction
+function queueRequest(mode, makeRequest) {
+    return openMarkQueue().then(db => new Promise((resolve, reject) => {
+        const transaction = db.transaction(MARK_QUEUE_STORE, mode);
+        const request = makeRequest(transaction.objectStore(MARK_QUEUE_STORE));
+        transaction.oncomplete = () => resolve(request ? request.result : undefined);
+        transaction.onerror = () => reject(transaction.error);
+    }));
+}
+
+function putQueuedMark(mark) {
+    return openMarkQueue().then(db => {
+        if (!db) {
+            memoryQueue.set(mark.key, mark);
+            return;
+        }
+        return queueRequest('readwrite', store => store.put(mark));
+    });
+}
+
+// Every queued mark, oldest first
+function getQueuedMarks() {
+    return openMarkQueue()
+        .then(db => db ? queueRequest('readonly', store => store.getAll()) : Array.from(memoryQueue.values()))
+        .then(marks => marks.sort((a, b) => a.queued_at - b.queued_at));
+}
+
+function deleteQueuedMarks(keys) {
+    if (!keys.length) return Promise.resolve();
+
+    return openMarkQueue().then(db => {
+        if (!db) {
+            keys.forEach(key => memoryQueue.delete(key));
+            return;
+        }
+        return queueRequest('readwrite', store => {
+            keys.forEach(key => store.delete(key));
+            return null;
+        });
+    });
+}
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+}
+
+// Today's date on this device as YYYY-MM-DD, the day the mark counts for
+function localDate() {
+    const now = new Date();
+    const pad = value => String(value).padStart(2, '0');
+    return `${now.getFullYear()}-${pad(now.getMonth() + 1)}-${pad(now.getDate())}`;
+}
+
+// Save a mark on this device and start syncing it
+function enqueueMark(studentId, status, imageBlob, classIds) {
+    const mark = {
+        key: newIdempotencyKey(),
+        student_id: studentId,
+        status: status,
+        section_id: classIds.sectionId,
+        group_id: classIds.groupId,
+        subject_id: classIds.subjectId,
+        date: localDate(),
+        queued_at: Date.now(),
+        image: imageBlob || null
+    };
+    return putQueuedMark(mark).then(() => {
+        scheduleSync(0);
+        return mark;
+    });
+}
+
+// Call listener(mark, result) whenever the server has answered a queued mark
+function onMarkSynced(listener) {
+    syncListeners.push(listener);
+}
+
+function scheduleSync(delay) {
+    clearTimeout(syncTimer);
+    syncTimer = setTimeout(syncMarkQueue, delay);
+}
+
+// Send the oldest queued marks as one batch and keep going until the queue is empty
+function syncMarkQueue() {
+    if (syncInProgress) return syncInProgress;
+
+    syncInProgress = getQueuedMarks()
+        .then(marks => {
+            if (!marks.length) return;
+
+            const batch = marks.slice(0, SYNC_BATCH_SIZE);
+            const data = new FormData();
+            data.append('marks', JSON.stringify(batch.map(({ image, queued_at, ...fields }) => fields)));
+            batch.forEach(mark => {
+                if (mark.image) data.append(`image-${mark.key}`, mark.image, 'capture.jpg');
+            });
+
+            return fetch('/sync_attendance', { method: 'POST', body: data })
+                .then(response => {
+                    if (!response.ok) throw new Error(`Sync failed with status ${response.status}`);
+                    return response.json();
+                })
+                .then(result => {
+                    // Marks the server couldn't take yet stay queued for the next attempt
+                    const answered = result.results.filter(markResult => markResult.outcome !== 'retry');
+                    return deleteQueuedMarks(answered.map(markResult => markResult.key)).then(() => {
+                        answered.forEach(markResult => {
+                            const mark = batch.find(queued => queued.key === markResult.key);
+                            syncListeners.forEach(listener => listener(mark, markResult));
+                        });
+
+                        syncFailures = answered.length < batch.length ? syncFailures + 1 : 0;
+                        if (syncFailures) {
+                            scheduleSync(SYNC_RETRY_DELAYS_MS[Math.min(syncFailures, SYNC_RETRY_DELAYS_MS.length) - 1]);
+                        } else if (marks.length > batch.length) {
+                            scheduleSync(0);
+                        }
+                    });
+                });
+        })
+        .catch(error => {
+            // Offline, logged out or a server error: everything stays queued
+            console.warn('Attendance sync failed, will retry:', error);
+            syncFailures += 1;
+            scheduleSync(SYNC_RETRY_DELAYS_MS[Math.min(syncFailures, SYNC_RETRY_DELAYS_MS.length) - 1]);
+        })
+        .finally(() => {
+            syncInProgress = null;
+        });
+    return syncInProgress;
+}
+
+// Send whatever is left over from earlier visits, and retry as soon as the network is back
+window.addEventListener('online', () => scheduleSync(0));
+document.addEventListener('DOMContentLoaded', () => scheduleSync(0));
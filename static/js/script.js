@@ -83,6 +83,13 @@ function setupAttendanceMarking() {
         cancelBtn.addEventListener('click', closeCamera);
     }
     
+    // Marks queued earlier on this device are still on their way to the server
+    onMarkSynced(handleSyncedMark);
+    getQueuedMarks().then(marks => {
+        marks.filter(isMarkForThisPage).forEach(mark => showQueuedUI(mark.student_id, mark.status));
+    });
+    updateSyncStatus();
+    
     // Show notification about auto face capture
     const cameraModal = document.getElementById('camera-modal');
     if (cameraModal) {
@@ -151,18 +158,28 @@ function capturePhoto() {
     // Show spinner
     if (spinnerElement) spinnerElement.classList.remove('hidden');
     
+    // Capture size and JPEG quality are configured on the server
+    const cameraModal = document.getElementById('camera-modal');
+    const captureSize = parseInt(cameraModal?.dataset.captureSize, 10) || 320;
+    const captureQuality = parseFloat(cameraModal?.dataset.captureQuality) || 0.8;
+    
+    // Crop the middle square of the frame, where the face is, and scale it down
+    const cropSize = Math.min(videoElement.videoWidth, videoElement.videoHeight);
+    const cropX = (videoElement.videoWidth - cropSize) / 2;
+    const cropY = (videoElement.videoHeight - cropSize) / 2;
+    const outputSize = Math.min(cropSize, captureSize);
+    
     // Create a canvas element to capture the frame
     const canvas = document.createElement('canvas');
-    canvas.width = videoElement.videoWidth;
-    canvas.height = videoElement.videoHeight;
+    canvas.width = outputSize;
+    canvas.height = outputSize;
     const ctx = canvas.getContext('2d');
-    ctx.drawImage(videoElement, 0, 0, canvas.width, canvas.height);
-    
-    // Get the image data as base64
-    const imageData = canvas.toDataURL('image/jpeg');
+    ctx.drawImage(videoElement, cropX, cropY, cropSize, cropSize, 0, 0, outputSize, outputSize);
     
-    // Mark the attendance with the captured image
-    markAttendance(studentId, 'present', imageData);
+    // Get the image as a binary JPEG and mark the attendance with it
+    canvas.toBlob(imageBlob => {
+        markAttendance(studentId, 'present', imageBlob);
+    }, 'image/jpeg', captureQuality);
 }
 
 // Function to close the camera
@@ -181,81 +198,104 @@ function closeCamera() {
     cameraActive = false;
 }
 
+// The class the attendance page is for, as ids
+function attendanceClassIds() {
+    const container = document.getElementById('attendance-cards');
+    return container ? container.dataset : null;
+}
+
 // Function to mark attendance
-function markAttendance(studentId, status, imageData = null) {
-    // Create data object
-    const data = {
-        student_id: studentId,
-        status: status
-    };
-    
-    // Add image data if present
-    if (status === 'present' && imageData) {
-        data.image_data = imageData;
-    }
+function markAttendance(studentId, status, imageBlob = null) {
+    const classIds = attendanceClassIds();
+    if (!classIds) return;
     
-    // Show loading state
+    // Close camera if open; the capture is kept with the queued mark
+    closeCamera();
+    showQueuedUI(studentId, status);
+    
+    // Save the mark on this device first, then sync it in the background (see offline_queue.js)
+    enqueueMark(studentId, status, imageBlob, classIds)
+        .then(updateSyncStatus)
+        .catch(error => {
+            console.error('Error queueing attendance:', error);
+            alert('Error saving the attendance mark. Please try again.');
+            resetAttendanceUI(studentId);
+        });
+}
+
+// Show a mark as waiting to be synced
+function showQueuedUI(studentId, status) {
     const studentCard = document.querySelector(`.attendance-card[data-student-id="${studentId}"]`);
-    if (studentCard) {
+    if (!studentCard) return;
+    
+    if (!document.getElementById(`spinner-${studentId}`)) {
         const spinner = document.createElement('div');
         spinner.className = 'spinner';
         spinner.id = `spinner-${studentId}`;
         studentCard.appendChild(spinner);
-        
-        // Disable buttons
-        const buttons = studentCard.querySelectorAll('button');
-        buttons.forEach(btn => btn.disabled = true);
     }
     
-    // Send data to server
-    fetch('/process_attendance', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify(data)
-    })
-    .then(response => response.json())
-    .then(result => {
-        // Close camera if open
-        closeCamera();
-        
-        if (result.success) {
-            // Update UI to show attendance status
-            updateAttendanceUI(studentId, status);
-            
-            // Check if all students have attendance marked
-            checkAllAttendanceMarked();
-        } else {
-            alert(`Error: ${result.message}`);
-            
-            // Re-enable buttons if error
-            if (studentCard) {
-                const buttons = studentCard.querySelectorAll('button');
-                buttons.forEach(btn => btn.disabled = false);
-            }
-        }
-        
-        // Remove spinner
-        const spinner = document.getElementById(`spinner-${studentId}`);
-        if (spinner) spinner.remove();
-    })
-    .catch(error => {
-        console.error('Error marking attendance:', error);
-        alert('Error marking attendance. Please try again.');
-        
-        // Close camera if open
-        closeCamera();
-        
-        // Remove spinner
-        const spinner = document.getElementById(`spinner-${studentId}`);
+    const statusElement = studentCard.querySelector('.attendance-status');
+    if (statusElement) {
+        statusElement.textContent = `Queued (${status})`;
+        statusElement.style.color = '#999';
+    }
+    
+    // Disable buttons
+    const buttons = studentCard.querySelectorAll('button');
+    buttons.forEach(btn => btn.disabled = true);
+}
+
+// Put a card back to unmarked after its mark was rejected
+function resetAttendanceUI(studentId) {
+    const studentCard = document.querySelector(`.attendance-card[data-student-id="${studentId}"]`);
+    if (!studentCard) return;
+    
+    const spinner = document.getElementById(`spinner-${studentId}`);
+    if (spinner) spinner.remove();
+    
+    const statusElement = studentCard.querySelector('.attendance-status');
+    if (statusElement) {
+        statusElement.textContent = 'Not Marked';
+        statusElement.style.color = 'yellow';
+    }
+    
+    // Re-enable buttons
+    const buttons = studentCard.querySelectorAll('button');
+    buttons.forEach(btn => btn.disabled = false);
+}
+
+// Whether a queued mark belongs to the class on this page
+function isMarkForThisPage(mark) {
+    const classIds = attendanceClassIds();
+    return classIds && mark && String(mark.section_id) === classIds.sectionId
+        && String(mark.group_id) === classIds.groupId && String(mark.subject_id) === classIds.subjectId;
+}
+
+// Update the page once the server has answered a queued mark
+function handleSyncedMark(mark, result) {
+    updateSyncStatus();
+    if (!isMarkForThisPage(mark)) return;
+    
+    if (result.outcome === 'recorded') {
+        const spinner = document.getElementById(`spinner-${mark.student_id}`);
         if (spinner) spinner.remove();
-        
-        // Re-enable buttons
-        if (studentCard) {
-            const buttons = studentCard.querySelectorAll('button');
-            buttons.forEach(btn => btn.disabled = false);
-        }
+        updateAttendanceUI(mark.student_id, mark.status);
+        checkAllAttendanceMarked();
+    } else {
+        alert(`Error: ${result.message}`);
+        resetAttendanceUI(mark.student_id);
+    }
+}
+
+// Show how many marks on this device haven't reached the server yet
+function updateSyncStatus() {
+    const syncStatus = document.getElementById('sync-status');
+    if (!syncStatus) return;
+    
+    getQueuedMarks().then(marks => {
+        syncStatus.textContent = `${marks.length} mark${marks.length === 1 ? '' : 's'} waiting to sync`;
+        syncStatus.style.display = marks.length ? 'block' : 'none';
     });
 }
 
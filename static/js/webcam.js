@@ -3,20 +3,82 @@
 // Model for face recognition
 const faceMatchThreshold = 0.6;
 
+// Known faces for client-side matching, loaded only when the server enables it
+let knownFaces = null;
+
+// Convert an IEEE 754 half-precision value to a number
+function halfToFloat(half) {
+    const exponent = (half >> 10) & 0x1f;
+    const fraction = half & 0x3ff;
+    const sign = half & 0x8000 ? -1 : 1;
+    if (exponent === 0) return sign * Math.pow(2, -14) * (fraction / 1024);
+    if (exponent === 0x1f) return fraction ? NaN : sign * Infinity;
+    return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+}
+
+// Unpack the binary gallery served by /known_faces.bin
+function parseKnownFaces(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'FGAL') throw new Error('Not a face gallery');
+    
+    const dtype = view.getUint8(5);
+    const dim = view.getUint16(6, true);
+    const rows = view.getUint32(8, true);
+    const namesLength = view.getUint32(12, true);
+    const names = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 16, namesLength)));
+    
+    // Store the encodings as one flat float array, rows of `dim` values
+    const offset = 16 + namesLength;
+    const encodings = new Float32Array(rows * dim);
+    if (dtype === 1) {
+        const packed = new Int8Array(buffer, offset, rows * dim);
+        for (let i = 0; i < packed.length; i++) encodings[i] = packed[i] / 127;
+    } else {
+        for (let i = 0; i < rows * dim; i++) encodings[i] = halfToFloat(view.getUint16(offset + i * 2, true));
+    }
+    return { names, dim, encodings };
+}
+
 // Load face recognition models
 async function loadFaceRecognitionModels() {
-    // In a real implementation, we would load face-api.js models here
-    // For this implementation, we rely on the backend for face recognition
-    console.log("Face recognition will be handled by the backend");
+    const cameraModal = document.getElementById('camera-modal');
+    const galleryUrl = cameraModal && cameraModal.dataset.galleryUrl;
+    if (!galleryUrl) {
+        // Client-side matching is off; the backend does the recognition
+        console.log("Face recognition will be handled by the backend");
+        return null;
+    }
+    
+    // The browser revalidates with the ETag, so an unchanged gallery isn't downloaded again
+    const response = await fetch(galleryUrl, { cache: 'no-cache' });
+    knownFaces = parseKnownFaces(await response.arrayBuffer());
+    console.log(`Loaded ${knownFaces.names.length} known faces for client-side matching`);
+    return knownFaces;
 }
 
 // Match face with known faces
-async function matchFace(faceDescriptor, knownFaces) {
+async function matchFace(faceDescriptor, gallery = knownFaces) {
     try {
-        // In a real implementation, we would compare the face descriptor
-        // with known face descriptors from the backend
-        console.log("Face matching is handled by the backend");
-        return { matched: true, name: "Unknown" };
+        if (!gallery) {
+            console.log("Face matching is handled by the backend");
+            return { matched: true, name: "Unknown" };
+        }
+        
+        // Cosine similarity against every known face; encodings are unit length
+        let bestName = null;
+        let bestScore = -Infinity;
+        for (let row = 0; row < gallery.names.length; row++) {
+            let score = 0;
+            for (let i = 0; i < gallery.dim; i++) {
+                score += gallery.encodings[row * gallery.dim + i] * faceDescriptor[i];
+            }
+            if (score > bestScore) {
+                bestScore = score;
+                bestName = gallery.names[row];
+            }
+        }
+        return { matched: bestScore >= faceMatchThreshold, name: bestName, similarity: bestScore };
     } catch (error) {
         console.error("Error matching face:", error);
         return { matched: false, error: error.message };
@@ -0,0 +1,68 @@
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from models import db, User, Section, Group, Subject, Student, Enrollment  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on an in-memory SQLite database, with recognition and notifications running inline or off"""
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite://",
+        "RECOGNITION_WORKERS": 0,
+        "RECOGNITION_WARM_UP": False,
+        "NOTIFICATION_PROVIDER": "none",
+        "LIVE_BOARD_POLL_INTERVAL": 0,
+        "ATTENDANCE_WRITE_WINDOW": 0.05,
+        "FACES_DIR": str(tmp_path / "faces"),
+        "RECOGNIZED_FACES_DIR": str(tmp_path / "recognized_faces"),
+        "GALLERY_INDEX_PATH": str(tmp_path / "face_gallery.json"),
+    })
+    yield app
+    app.extensions["attendance_writer"].close()
+    app.extensions["live_board"].close()
+    app.extensions["face_archive"].close()
+
+
+@pytest.fixture
+def school(app):
+    """One class of three students: ids of the user, section, group, subject and students"""
+    with app.app_context():
+        user = User(username="teacher", password_hash="-")
+        section = Section(name="J")
+        group = Group(name="J1", section=section)
+        subject = Subject(name="Python")
+        students = [Student(name=name, phone_number=f"+9198765432{i:02d}")
+                    for i, name in enumerate(["Tanish", "Yuvraj", "Vishal"])]
+        db.session.add_all([user, section, group, subject, *students])
+        db.session.flush()
+        db.session.add_all([Enrollment(student_id=student.id, group_id=group.id, subject_id=subject.id)
+                            for student in students])
+        db.session.commit()
+        return {"user_id": user.id, "section_id": section.id, "group_id": group.id,
+                "subject_id": subject.id, "student_ids": [student.id for student in students]}
+
+
+@pytest.fixture
+def client(app, school):
+    """A test client logged in and marking the school's class"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=school["user_id"], section_id=school["section_id"],
+                       group_id=school["group_id"], subject_id=school["subject_id"])
+    return client
+
+
+@pytest.fixture
+def capture():
+    """A captured frame as JPEG bytes, showing no face"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 320), (120, 90, 60)).save(buffer, 'JPEG')
+    return buffer.getvalue()
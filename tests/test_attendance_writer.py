@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+
+import pytest
+
+from models import db, Attendance, NotificationOutbox
+from utils.attendance_writer import make_mark, upsert_attendance
+
+
+def mark(school, index, status):
+    return make_mark(SimpleNamespace(id=school["student_ids"][index]), status, school["section_id"],
+                     school["group_id"], school["subject_id"])
+
+
+def marks_by_student(app):
+    with app.app_context():
+        return {row.student_id: row for row in Attendance.query}
+
+
+def test_marks_in_one_window_are_committed_together(app, school):
+    writer = app.extensions["attendance_writer"]
+    writer.window = 0.5
+    batches = []
+    writer.add_listener(batches.append)
+
+    futures = [writer.submit(mark(school, 0, 'present')), writer.submit(mark(school, 1, 'absent')),
+               writer.submit(mark(school, 0, 'absent'))]
+
+    assert [future.result(timeout=5) for future in futures] == [2, 2, 2]
+    assert len(batches) == 1
+    rows = marks_by_student(app)
+    assert {student_id: row.status for student_id, row in rows.items()} == {
+        school["student_ids"][0]: 'absent', school["student_ids"][1]: 'absent'}
+
+
+def test_flush_writes_without_waiting_for_the_window(app, school):
+    writer = app.extensions["attendance_writer"]
+    writer.window = 30
+    future = writer.submit(mark(school, 0, 'present'))
+
+    writer.flush(timeout=5)
+
+    assert future.done()
+    assert marks_by_student(app)[school["student_ids"][0]].status == 'present'
+
+
+def test_marking_again_replaces_the_mark_and_keeps_notification_sent(app, school):
+    writer = app.extensions["attendance_writer"]
+    writer.write(mark(school, 0, 'absent'))
+    with app.app_context():
+        Attendance.query.update({Attendance.notification_sent: True})
+        db.session.commit()
+
+    writer.write(mark(school, 0, 'present'))
+
+    rows = marks_by_student(app)
+    assert len(rows) == 1
+    assert rows[school["student_ids"][0]].status == 'present'
+    assert rows[school["student_ids"][0]].notification_sent is True
+
+
+def test_new_marks_start_without_a_notification_sent(app, school):
+    app.extensions["attendance_writer"].write([mark(school, 0, 'absent'), mark(school, 1, 'present')])
+
+    assert [row.notification_sent for row in marks_by_student(app).values()] == [False, False]
+
+
+def test_absence_is_queued_for_notification_once(app, school):
+    writer = app.extensions["attendance_writer"]
+    writer.write(mark(school, 0, 'absent'))
+    writer.write(mark(school, 0, 'absent'))
+    writer.write(mark(school, 1, 'present'))
+
+    with app.app_context():
+        assert [entry.student_id for entry in NotificationOutbox.query] == [school["student_ids"][0]]
+
+
+def test_upsert_collapses_duplicate_keys_to_the_last_row(app, school):
+    with app.app_context():
+        upsert_attendance([mark(school, 0, 'present'), mark(school, 0, 'absent'), mark(school, 1, 'present')])
+        db.session.commit()
+
+    rows = marks_by_student(app)
+    assert {student_id: row.status for student_id, row in rows.items()} == {
+        school["student_ids"][0]: 'absent', school["student_ids"][1]: 'present'}
+
+
+def test_bad_mark_only_fails_its_own_submission(app, school):
+    writer = app.extensions["attendance_writer"]
+    writer.window = 0.5
+    batches = []
+    writer.add_listener(batches.append)
+
+    good = writer.submit(mark(school, 0, 'present'))
+    bad = writer.submit(mark(school, 1, None))
+
+    assert good.result(timeout=5) == 1
+    with pytest.raises(Exception):
+        bad.result(timeout=5)
+    assert [row['student_id'] for batch in batches for row in batch] == [school["student_ids"][0]]
+    assert {student_id: row.status for student_id, row in marks_by_student(app).items()} == {
+        school["student_ids"][0]: 'present'}
@@ -0,0 +1,34 @@
+import io
+
+from models import db, Enrollment, Student
+from utils.bulk_enrollment import enroll_students
+
+
+def roster(text):
+    return io.StringIO(text)
+
+
+def test_a_roster_row_without_a_group_says_so(app, school, tmp_path):
+    with app.app_context():
+        report = enroll_students(roster("name,group,subjects\nAsha,,Python\n"), str(tmp_path), workers=0)
+
+        assert report["rejected"] == [{"item": "Asha", "reason": "No group given, not enrolled"}]
+        assert report["enrollments_added"] == 0
+
+
+def test_a_name_shared_by_several_students_is_not_enrolled(app, school, tmp_path):
+    with app.app_context():
+        db.session.add(Student(name="Tanish"))
+        db.session.commit()
+        (tmp_path / "Tanish").mkdir()
+        (tmp_path / "Tanish" / "1.jpg").write_bytes(b"")
+
+        report = enroll_students(roster("name,group,subjects\nTanish,J1,Python\nAsha,J1,Python\n"),
+                                 str(tmp_path), workers=0)
+
+        assert {"item": "Tanish", "reason": "Several students have this name, not enrolled"} in report["rejected"]
+        assert {"item": "Tanish/1.jpg", "reason": "Several students have this name"} in report["rejected"]
+        assert report["students_created"] == 1
+        assert report["enrollments_added"] == 1
+        assert Student.query.filter_by(name="Tanish").count() == 2
+        assert Enrollment.query.join(Student).filter(Student.name == "Tanish").count() == 1
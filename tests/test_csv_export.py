@@ -0,0 +1,25 @@
+import csv
+import io
+from datetime import datetime
+from types import SimpleNamespace
+
+from utils.attendance_writer import make_mark
+from utils.csv_utils import CSV_HEADER
+
+
+def test_export_rows_line_up_with_the_header(app, client, school):
+    app.extensions["attendance_writer"].write([
+        make_mark(SimpleNamespace(id=student_id), status, school["section_id"], school["group_id"],
+                  school["subject_id"])
+        for student_id, status in zip(school["student_ids"], ['present', 'absent', 'present'])])
+
+    response = client.get('/export_csv')
+
+    assert response.status_code == 200
+    lines = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert lines[0] == CSV_HEADER
+    assert all(len(line) == len(CSV_HEADER) for line in lines[1:])
+    today = datetime.now().date().isoformat()
+    assert [dict(zip(lines[0], line)) for line in lines[1:]] == [
+        {"Date": today, "Section": "J", "Group": "J1", "Subject": "Python", "Student Name": name, "Status": status}
+        for name, status in [("Tanish", "Present"), ("Vishal", "Present"), ("Yuvraj", "Absent")]]
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.face_backends import SFACE_INPUT_SIZE, Detection, SFaceBackend, cv2
+
+
+@pytest.mark.skipif(cv2 is None, reason="OpenCV is not installed")
+@pytest.mark.parametrize('landmarks', [
+    np.array([[70, 80], [110, 80], [90, 100], [75, 120], [105, 120]], dtype=np.float32),
+    # Degenerate landmarks give no transform, so the box is cropped instead
+    np.full((5, 2), 60.0, dtype=np.float32),
+    None,
+])
+def test_sface_align_always_gives_a_face_crop(tmp_path, landmarks):
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 255, (200, 200, 3), dtype=np.uint8))
+
+    face = SFaceBackend(str(tmp_path)).align(image, Detection((50, 50, 80, 80), landmarks, 0.9))
+
+    assert face.shape == (SFACE_INPUT_SIZE[1], SFACE_INPUT_SIZE[0], 3)
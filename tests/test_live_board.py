@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils.attendance_writer import make_mark
+
+
+@pytest.fixture(autouse=True)
+def short_streams(app):
+    app.config.update(LIVE_BOARD_MAX_STREAM_SECONDS=0.5)
+
+
+def test_stream_sends_marks_and_ends_after_its_lifetime(app, client, school):
+    response = client.get('/attendance/stream', buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'event: snapshot\n')
+
+    app.extensions["attendance_writer"].write(make_mark(
+        SimpleNamespace(id=school["student_ids"][0]), 'present', school["section_id"], school["group_id"],
+        school["subject_id"]))
+    events = [chunk for chunk in chunks if not chunk.startswith(b':')]
+    response.close()
+
+    assert events[0].startswith(b'event: mark\n')
+    assert events[-1].startswith(b'event: end\n')
+    assert app.extensions["live_board"].watching() == {}
+
+
+def test_streams_beyond_the_limit_are_refused(app, client):
+    app.extensions["live_board"].max_subscribers = 1
+    response = client.get('/attendance/stream', buffered=False)
+    try:
+        refused = client.get('/attendance/stream')
+        assert refused.status_code == 503
+        assert refused.headers["Retry-After"]
+    finally:
+        response.close()
+
+
+def test_unknown_class_has_no_stream(client, school):
+    assert client.get(f'/attendance/stream?group_id={school["group_id"] + 100}').status_code == 404
@@ -0,0 +1,46 @@
+import time
+from types import SimpleNamespace
+
+from models import Attendance, NotificationOutbox
+from utils.attendance_writer import make_mark
+from utils.notifications import NotificationDispatcher
+from utils.sms_utils import FakeProvider
+
+
+class TimedProvider(FakeProvider):
+    """Fake provider that notes when each message reaches it"""
+
+    def __init__(self):
+        super().__init__()
+        self.sent_at = []
+
+    def send(self, phone_number, body):
+        self.sent_at.append(time.monotonic())
+        return super().send(phone_number, body)
+
+
+def mark_all_absent(app, school):
+    app.extensions["attendance_writer"].write([
+        make_mark(SimpleNamespace(id=student_id), 'absent', school["section_id"], school["group_id"],
+                  school["subject_id"])
+        for student_id in school["student_ids"]])
+
+
+def test_messages_are_paced_at_the_rate_limit(app, school):
+    mark_all_absent(app, school)
+    provider = TimedProvider()
+    dispatcher = NotificationDispatcher(app, provider, batch_size=50, rate_limit=10)
+
+    assert dispatcher.dispatch_once() == 3
+
+    gaps = [later - earlier for earlier, later in zip(provider.sent_at, provider.sent_at[1:])]
+    assert len(gaps) == 2
+    assert all(gap >= 0.09 for gap in gaps)
+    with app.app_context():
+        assert {entry.state for entry in NotificationOutbox.query} == {'sent'}
+        assert all(mark.notification_sent for mark in Attendance.query)
+
+
+def test_batches_fit_in_the_lease_at_the_rate_limit():
+    assert NotificationDispatcher(None, FakeProvider(), batch_size=50, rate_limit=1, lease=20).batch_size == 5
+    assert NotificationDispatcher(None, FakeProvider(), batch_size=50, rate_limit=0, lease=20).batch_size == 50
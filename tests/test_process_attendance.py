@@ -0,0 +1,96 @@
+import io
+
+import pytest
+
+import app as app_module
+from models import Attendance
+from utils.frame_filter import frame_fingerprint
+
+
+def recognised(image_bytes, student_name, *args):
+    return {"success": True, "message": f"Face verified for {student_name}"}
+
+
+def not_recognised(image_bytes, student_name, *args):
+    return {"success": False, "message": f"Face does not match {student_name}. Please try again."}
+
+
+def mark_present(client, school, capture):
+    return client.post('/process_attendance', data={"student_id": school["student_ids"][0], "status": "present",
+                                                    "image": (io.BytesIO(capture), 'capture.jpg')})
+
+
+def marks(app):
+    with app.app_context():
+        return [(mark.student_id, mark.status) for mark in Attendance.query]
+
+
+def test_unrecognised_face_is_not_marked_present(app, client, school, capture, monkeypatch):
+    monkeypatch.setattr(app_module, 'process_face_recognition', not_recognised)
+
+    first = mark_present(client, school, capture)
+    # Sending the same frame again gets the same answer instead of a mark
+    again = mark_present(client, school, capture)
+
+    assert (first.status_code, again.status_code) == (400, 400)
+    assert first.get_json()["success"] is False
+    assert marks(app) == []
+
+
+def test_recognised_frame_cannot_be_replayed(app, client, school, capture, monkeypatch):
+    monkeypatch.setattr(app_module, 'process_face_recognition', recognised)
+
+    assert mark_present(client, school, capture).status_code == 200
+    assert mark_present(client, school, capture).status_code == 409
+    assert marks(app) == [(school["student_ids"][0], 'present')]
+
+
+def test_polled_result_of_an_unrecognised_face_is_not_marked(app, client, school, capture):
+    mark = {"user_id": school["user_id"], "student_id": school["student_ids"][0], "status": "present",
+            "section_id": school["section_id"], "group_id": school["group_id"],
+            "subject_id": school["subject_id"], "frame": frame_fingerprint(capture)}
+    job_id = app.extensions["recognition_pool"].submit(not_recognised, capture, "Tanish", context=mark)
+
+    response = client.get(f'/process_attendance/{job_id}')
+
+    assert response.status_code == 400
+    assert marks(app) == []
+
+
+def test_absent_mark_needs_no_capture(app, client, school):
+    response = client.post('/process_attendance', data={"student_id": school["student_ids"][1], "status": "absent"})
+
+    assert response.status_code == 200
+    assert marks(app) == [(school["student_ids"][1], 'absent')]
+
+
+def test_group_attendance_gives_up_waiting_for_recognition(app, client, capture, monkeypatch):
+    monkeypatch.setattr(app.extensions["recognition_pool"], 'wait', lambda job_id, timeout=None: None)
+
+    response = client.post('/process_group_attendance', json={"frames": ["data:image/jpeg;base64,"]})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    assert marks(app) == []
+
+
+@pytest.mark.parametrize('status', [None, 'banana'])
+def test_mark_needs_a_valid_status(app, client, school, status):
+    data = {"student_id": school["student_ids"][1]}
+    if status:
+        data["status"] = status
+
+    response = client.post('/process_attendance', data=data)
+
+    assert response.status_code == 400
+    assert marks(app) == []
+
+
+def test_mark_for_a_class_that_does_not_exist_is_refused(app, client, school):
+    with client.session_transaction() as session:
+        session["group_id"] = school["group_id"] + 100
+
+    response = client.post('/process_attendance', data={"student_id": school["student_ids"][1], "status": "absent"})
+
+    assert response.status_code == 400
+    assert marks(app) == []
@@ -0,0 +1,108 @@
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+from models import db, Attendance, SyncedMark
+
+
+def queued_mark(school, key, status='absent', student=0, **fields):
+    return {"key": key, "student_id": school["student_ids"][student], "status": status,
+            "section_id": school["section_id"], "group_id": school["group_id"],
+            "subject_id": school["subject_id"], "date": datetime.now().date().isoformat(), **fields}
+
+
+def sync(client, marks, files=None):
+    return client.post('/sync_attendance', data={"marks": json.dumps(marks), **(files or {})})
+
+
+def results_by_key(response):
+    return {result["key"]: result for result in response.get_json()["results"]}
+
+
+def test_marks_are_recorded_with_their_keys(app, client, school):
+    response = sync(client, [queued_mark(school, 'a'), queued_mark(school, 'b', student=1)])
+
+    assert response.status_code == 200
+    assert {key: result["outcome"] for key, result in results_by_key(response).items()} == {
+        'a': 'recorded', 'b': 'recorded'}
+    with app.app_context():
+        assert Attendance.query.count() == 2
+        assert {synced.key for synced in SyncedMark.query} == {'a', 'b'}
+
+
+def test_duplicate_key_returns_the_first_outcome(app, client, school):
+    first = results_by_key(sync(client, [queued_mark(school, 'a', status='absent')]))['a']
+
+    # The same key again, even with different contents, is answered from the first sync
+    again = results_by_key(sync(client, [queued_mark(school, 'a', status='present')]))['a']
+
+    assert again == dict(first, duplicate=True)
+    with app.app_context():
+        assert [mark.status for mark in Attendance.query] == ['absent']
+
+
+def test_key_repeated_within_a_batch_is_processed_once(app, client, school):
+    response = sync(client, [queued_mark(school, 'a'), queued_mark(school, 'a', student=1)])
+
+    assert [result["key"] for result in response.get_json()["results"]] == ['a', 'a']
+    with app.app_context():
+        assert [mark.student_id for mark in Attendance.query] == [school["student_ids"][0]]
+
+
+@pytest.mark.parametrize('key', [None, ''])
+def test_mark_without_a_key_is_refused(app, client, school, key):
+    response = sync(client, [queued_mark(school, 'a'), queued_mark(school, key, student=1)])
+
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+    with app.app_context():
+        assert Attendance.query.count() == 0
+
+
+@pytest.mark.parametrize('fields', [{"group_id": 999}, {"section_id": 999}])
+def test_unknown_class_is_rejected(app, client, school, fields):
+    result = results_by_key(sync(client, [queued_mark(school, 'a', **fields)]))['a']
+
+    assert (result["outcome"], result["message"]) == ('rejected', "Unknown class")
+    with app.app_context():
+        assert Attendance.query.count() == 0
+
+
+def test_present_mark_with_an_unrecognised_face_is_rejected_for_good(app, client, school, capture):
+    def sync_capture():
+        response = sync(client, [queued_mark(school, 'a', status='present')],
+                        {"image-a": (io.BytesIO(capture), 'capture.jpg')})
+        return results_by_key(response)['a']
+
+    first = sync_capture()
+    again = sync_capture()
+
+    assert first["outcome"] == 'rejected'
+    assert again == dict(first, duplicate=True)
+    with app.app_context():
+        assert Attendance.query.count() == 0
+
+
+def test_sync_needs_a_login(app, school):
+    assert sync(app.test_client(), [queued_mark(school, 'a')]).status_code == 401
+
+
+def test_mark_whose_recognition_times_out_is_retried_later(app, client, school, capture, monkeypatch):
+    timeouts = []
+
+    def still_running(job_id, timeout=None):
+        timeouts.append(timeout)
+        return None
+
+    monkeypatch.setattr(app.extensions["recognition_pool"], 'wait', still_running)
+
+    response = sync(client, [queued_mark(school, 'a', status='present'), queued_mark(school, 'b', student=1)],
+                    {"image-a": (io.BytesIO(capture), 'capture.jpg')})
+
+    results = results_by_key(response)
+    assert (results['a']["outcome"], results['b']["outcome"]) == ('retry', 'recorded')
+    assert timeouts and all(timeout is not None for timeout in timeouts)
+    with app.app_context():
+        assert db.session.get(SyncedMark, 'a') is None
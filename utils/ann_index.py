@@ -0,0 +1,186 @@
+import os
+import logging
+import numpy as np
+
+
+class IVFIndex:
+    """
+    Approximate nearest-neighbour index over L2-normalised vectors
+
+    Vectors are partitioned into inverted lists around k-means centroids.
+    A search only scans the n_probe lists whose centroids are closest to the
+    query, so the cost grows with roughly sqrt(N) instead of N. Similarity is
+    the dot product, i.e. cosine similarity for unit vectors.
+    """
+
+    def __init__(self, dim, n_lists=1, n_probe=16):
+        self.dim = dim
+        self.n_probe = n_probe
+        self.centroids = np.zeros((n_lists, dim), dtype=np.float32)
+        self.list_vectors = [np.zeros((0, dim), dtype=np.float32) for _ in range(n_lists)]
+        self.list_ids = [np.zeros(0, dtype=np.int64) for _ in range(n_lists)]
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.list_ids)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, ids, n_lists=None, n_probe=16, n_iter=10, seed=0):
+        """
+        Train the centroids with spherical k-means and fill the lists
+
+        Args:
+            vectors: (N x dim) array of L2-normalised vectors
+            ids: N integer ids returned by search()
+            n_lists: Number of inverted lists, defaults to about sqrt(N)
+            n_probe: Number of lists scanned per query
+            n_iter: Number of k-means iterations
+            seed: Seed for centroid initialisation
+
+        Returns:
+            IVFIndex: The populated index
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        n = len(vectors)
+
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n)))
+        n_lists = max(1, min(n_lists, n))
+
+        index = cls(vectors.shape[1], n_lists, n_probe)
+        if n == 0:
+            return index
+
+        # Train on a sample; a few hundred points per list is plenty for k-means
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if n > 256 * n_lists:
+            sample = vectors[rng.choice(n, 256 * n_lists, replace=False)]
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignment = _nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=n_lists)
+
+            # Re-seed empty lists with random points so no centroid goes to waste
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        index.centroids = centroids
+        index.add(vectors, ids)
+        return index
+
+    def add(self, vectors, ids):
+        """Insert vectors into the lists of their nearest centroids"""
+        vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32)
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        if not len(ids):
+            return
+
+        assignment = _nearest(vectors, self.centroids)
+        for list_no in np.unique(assignment):
+            members = assignment == list_no
+            self.list_vectors[list_no] = np.concatenate([self.list_vectors[list_no], vectors[members]])
+            self.list_ids[list_no] = np.concatenate([self.list_ids[list_no], ids[members]])
+
+    def remove(self, ids):
+        """Drop every vector whose id is in ids"""
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        if not len(ids):
+            return
+
+        for list_no, list_ids in enumerate(self.list_ids):
+            keep = ~np.isin(list_ids, ids)
+            if not keep.all():
+                self.list_vectors[list_no] = self.list_vectors[list_no][keep]
+                self.list_ids[list_no] = list_ids[keep]
+
+    def search(self, query, k=1, n_probe=None):
+        """
+        Find the k vectors most similar to query
+
+        Returns:
+            tuple: (ids, similarities), both sorted from most to least similar
+        """
+        query = np.asarray(query, dtype=np.float32)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+
+        centroid_scores = self.centroids @ query
+        if n_probe < self.n_lists:
+            probe = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        else:
+            probe = range(self.n_lists)
+
+        candidate_ids = []
+        candidate_scores = []
+        for list_no in probe:
+            if len(self.list_ids[list_no]):
+                candidate_ids.append(self.list_ids[list_no])
+                candidate_scores.append(self.list_vectors[list_no] @ query)
+
+        if not candidate_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        ids = np.concatenate(candidate_ids)
+        scores = np.concatenate(candidate_scores)
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+
+        order = np.argsort(-scores)
+        return ids[order], scores[order]
+
+    def save(self, path):
+        """Write the index to a single .npz file atomically"""
+        arrays = {
+            'dim': np.array(self.dim),
+            'n_probe': np.array(self.n_probe),
+            'centroids': self.centroids,
+            'list_sizes': np.array([len(ids) for ids in self.list_ids], dtype=np.int64),
+            'vectors': np.concatenate(self.list_vectors),
+            'ids': np.concatenate(self.list_ids),
+        }
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save()"""
+        with np.load(path) as data:
+            index = cls(int(data['dim']), len(data['centroids']), int(data['n_probe']))
+            index.centroids = data['centroids']
+
+            offsets = np.concatenate([[0], np.cumsum(data['list_sizes'])])
+            vectors, ids = data['vectors'], data['ids']
+            for list_no in range(index.n_lists):
+                start, end = offsets[list_no], offsets[list_no + 1]
+                index.list_vectors[list_no] = vectors[start:end]
+                index.list_ids[list_no] = ids[start:end]
+
+        logging.info("Loaded ANN index from %s: %d vectors in %d lists", path, len(index), index.n_lists)
+        return index
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def _nearest(vectors, centroids, chunk_size=4096):
+    """Index of the most similar centroid for every vector, computed in chunks to bound memory"""
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        assignment[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+    return assignment
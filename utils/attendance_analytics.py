@@ -0,0 +1,190 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import select
+
+from models import db, Group, Subject, Student, Attendance
+
+# Rows fetched from the database per chunk while building a term's frame
+CHUNK_SIZE = 50000
+
+# Students below this attendance percentage are flagged
+DEFAULT_THRESHOLD = 75.0
+
+
+def load_attendance_frame(start_date, end_date, section_id=None, chunk_size=CHUNK_SIZE):
+    """
+    Load a term's attendance into a compact columnar DataFrame
+
+    Rows are read from the database in chunks and converted to small integer
+    and boolean columns as they arrive, so millions of marks fit in a few
+    tens of megabytes
+
+    Returns:
+        pd.DataFrame: Columns student_id, group_id, subject_id (int32),
+        date (datetime64) and present (bool)
+    """
+    # pandas takes a few hundred milliseconds to import, so workers only pay for it once a report is asked for
+    import pandas as pd
+
+    stmt = select(Attendance.student_id, Attendance.group_id, Attendance.subject_id,
+                  Attendance.date, Attendance.status).where(
+        Attendance.date >= start_date, Attendance.date <= end_date)
+    if section_id is not None:
+        stmt = stmt.where(Attendance.section_id == section_id)
+
+    chunks = []
+    for chunk in pd.read_sql(stmt, db.session.connection(), chunksize=chunk_size):
+        chunks.append(pd.DataFrame({
+            'student_id': chunk['student_id'].to_numpy(dtype=np.int32),
+            'group_id': chunk['group_id'].to_numpy(dtype=np.int32),
+            'subject_id': chunk['subject_id'].to_numpy(dtype=np.int32),
+            'date': pd.to_datetime(chunk['date']),
+            'present': (chunk['status'] == 'present').to_numpy(),
+        }))
+
+    if not chunks:
+        return pd.DataFrame({
+            'student_id': np.zeros(0, dtype=np.int32),
+            'group_id': np.zeros(0, dtype=np.int32),
+            'subject_id': np.zeros(0, dtype=np.int32),
+            'date': pd.to_datetime([]),
+            'present': np.zeros(0, dtype=bool),
+        })
+    return pd.concat(chunks, ignore_index=True)
+
+
+def compute_term_aggregates(frame):
+    """
+    Compute a term's aggregates with vectorised group-bys
+
+    Returns:
+        dict: 'by_student' with present/total/percentage per (student, subject),
+        and 'trends' with the weekly attendance percentage per (group, subject)
+    """
+    by_student = (frame.groupby(['student_id', 'subject_id'])['present']
+                  .agg(present='sum', total='size')
+                  .reset_index())
+    by_student['percentage'] = by_student['present'] * 100.0 / by_student['total']
+
+    weeks = frame['date'].dt.to_period('W').dt.start_time
+    trends = (frame.assign(week=weeks)
+              .groupby(['group_id', 'subject_id', 'week'])['present']
+              .mean()
+              .mul(100.0)
+              .rename('percentage')
+              .reset_index())
+
+    return {'by_student': by_student, 'trends': trends}
+
+
+class AnalyticsCache:
+    """
+    Cache of term aggregates keyed by (start date, end date, section id)
+
+    Entries are evicted least-recently-used first. note_marks() is called
+    with every batch of committed marks and drops only the entries whose
+    section and date range cover one of them, so a mark in one section
+    doesn't throw away every other section's report. It only sees marks
+    committed by this process, so entries also expire after `ttl` seconds,
+    the longest a mark made through another worker process goes unseen.
+    """
+
+    def __init__(self, max_entries=32, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (computed at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] >= self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def note_marks(self, rows):
+        """Invalidate the entries affected by newly committed attendance rows"""
+        touched = {(row['section_id'], row['date']) for row in rows}
+        with self._lock:
+            stale = [key for key in self._entries
+                     if any((key[2] is None or key[2] == section_id) and key[0] <= date <= key[1]
+                            for section_id, date in touched)]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            logging.debug("Invalidated %d cached term reports", len(stale))
+
+
+# Shared by every request in this process
+analytics_cache = AnalyticsCache()
+
+
+def get_term_aggregates(start_date, end_date, section_id=None):
+    """Term aggregates for a section, computed once and then served from the cache"""
+    key = (start_date, end_date, section_id)
+    aggregates = analytics_cache.get(key)
+    if aggregates is None:
+        frame = load_attendance_frame(start_date, end_date, section_id)
+        aggregates = compute_term_aggregates(frame)
+        analytics_cache.put(key, aggregates)
+        logging.info("Computed term report for section %s from %d marks", section_id, len(frame))
+    return aggregates
+
+
+def build_term_report(start_date, end_date, section_id=None, threshold=DEFAULT_THRESHOLD):
+    """
+    Term-level attendance report ready to be returned as JSON
+
+    Returns:
+        dict: Per-student percentages per subject, the students below
+        threshold, and weekly trends per group and subject
+    """
+    aggregates = get_term_aggregates(start_date, end_date, section_id)
+    by_student = aggregates['by_student']
+    trends = aggregates['trends']
+
+    # Names are looked up once per report for just the ids that appear in it
+    student_names = dict(db.session.execute(
+        select(Student.id, Student.name).where(Student.id.in_(by_student['student_id'].unique().tolist()))).all())
+    subject_names = dict(db.session.execute(select(Subject.id, Subject.name)).all())
+    group_names = dict(db.session.execute(select(Group.id, Group.name)).all())
+
+    students = [{
+        "student_id": int(row.student_id),
+        "student_name": student_names.get(row.student_id),
+        "subject": subject_names.get(row.subject_id),
+        "present": int(row.present),
+        "total": int(row.total),
+        "percentage": round(float(row.percentage), 1),
+    } for row in by_student.itertuples(index=False)]
+
+    return {
+        "start": start_date.isoformat(),
+        "end": end_date.isoformat(),
+        "threshold": threshold,
+        "students": students,
+        "below_threshold": [student for student in students if student["percentage"] < threshold],
+        "trends": [{
+            "group": group_names.get(row.group_id),
+            "subject": subject_names.get(row.subject_id),
+            "week": row.week.date().isoformat(),
+            "percentage": round(float(row.percentage), 1),
+        } for row in trends.itertuples(index=False)],
+    }
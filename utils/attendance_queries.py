@@ -0,0 +1,121 @@
+from collections import namedtuple
+
+from sqlalchemy import and_, select
+
+from models import db, Section, Group, Subject, Student, Attendance, Enrollment
+
+# One class on one day: the section, group and subject records plus the
+# students marked present and absent, ordered by name
+DayAttendance = namedtuple('DayAttendance', ['section', 'group', 'subject', 'present_students', 'absent_students'])
+
+
+def get_day_attendance(section_id, group_id, subject_id, day):
+    """
+    Load a class's attendance for one day in a single statement
+
+    The section, group and subject rows are joined with the day's attendance
+    marks and their students, using outer joins so the class details come
+    back even before anyone has been marked
+
+    Returns:
+        DayAttendance, or None if the section, group or subject doesn't exist
+    """
+    stmt = (
+        select(Section, Group, Subject, Attendance.status, Student)
+        .select_from(Section)
+        .join(Group, Group.id == group_id)
+        .join(Subject, Subject.id == subject_id)
+        .outerjoin(Attendance, and_(
+            Attendance.section_id == Section.id,
+            Attendance.group_id == Group.id,
+            Attendance.subject_id == Subject.id,
+            Attendance.date == day,
+        ))
+        .outerjoin(Student, Student.id == Attendance.student_id)
+        .where(Section.id == section_id)
+        .order_by(Student.name)
+    )
+    rows = db.session.execute(stmt).all()
+    if not rows:
+        return None
+
+    section, group, subject = rows[0][:3]
+    present_students = []
+    absent_students = []
+    for _, _, _, status, student in rows:
+        if student is None:
+            continue
+        if status == 'present':
+            present_students.append(student)
+        else:
+            absent_students.append(student)
+
+    return DayAttendance(section, group, subject, present_students, absent_students)
+
+
+def get_class_marks(section_id, group_id, subject_id, day, since=None):
+    """
+    A class's marks for one day, optionally only those made at or after `since`
+
+    Returns:
+        list: (student id, status, timestamp) rows, oldest first
+    """
+    stmt = (
+        select(Attendance.student_id, Attendance.status, Attendance.timestamp)
+        .where(Attendance.section_id == section_id, Attendance.group_id == group_id,
+               Attendance.subject_id == subject_id, Attendance.date == day)
+        .order_by(Attendance.timestamp)
+    )
+    if since is not None:
+        stmt = stmt.where(Attendance.timestamp >= since)
+    return db.session.execute(stmt).all()
+
+
+def roster_query(group_id, subject_id, *columns):
+    """
+    Select the students enrolled in a group for a subject, ordered by id
+
+    Only the class's enrollment rows are read (through ix_enrollment_class),
+    however many students there are in total
+
+    Args:
+        columns: Student columns to select; whole Student rows by default
+    """
+    return (
+        select(*(columns or (Student,)))
+        .join(Enrollment, Enrollment.student_id == Student.id)
+        .where(Enrollment.group_id == group_id, Enrollment.subject_id == subject_id)
+        .order_by(Student.id)
+    )
+
+
+def iter_attendance(start_date, end_date, section_id=None, group_ids=None, subject_ids=None, batch_size=1000):
+    """
+    Stream attendance marks for a date range, one flat row at a time
+
+    Rows are fetched from a server-side cursor in batches of batch_size, so
+    the whole result is never held in memory. Section, group and subject
+    filters are optional; group_ids and subject_ids may list several.
+
+    Yields:
+        Rows of (date, section name, group name, subject name, student name, status),
+        ordered by date, group, subject and student
+    """
+    stmt = (
+        select(Attendance.date, Section.name, Group.name, Subject.name, Student.name, Attendance.status)
+        .join(Student, Student.id == Attendance.student_id)
+        .join(Section, Section.id == Attendance.section_id)
+        .join(Group, Group.id == Attendance.group_id)
+        .join(Subject, Subject.id == Attendance.subject_id)
+        .where(Attendance.date >= start_date, Attendance.date <= end_date)
+        .order_by(Attendance.date, Group.name, Subject.name, Student.name)
+        .execution_options(yield_per=batch_size)
+    )
+    if section_id is not None:
+        stmt = stmt.where(Attendance.section_id == section_id)
+    if group_ids:
+        stmt = stmt.where(Attendance.group_id.in_(group_ids))
+    if subject_ids:
+        stmt = stmt.where(Attendance.subject_id.in_(subject_ids))
+
+    yield from db.session.execute(stmt)
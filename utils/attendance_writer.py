@@ -0,0 +1,294 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Attendance, NotificationOutbox, SyncedMark
+from utils.metrics import pipeline_timer
+
+# Columns that identify a mark; a second mark for the same key replaces the first
+ATTENDANCE_KEY = ('student_id', 'section_id', 'group_id', 'subject_id', 'date')
+
+# Rows per INSERT statement, well under SQLite's limit on bound parameters
+UPSERT_CHUNK_SIZE = 500
+
+
+def make_mark(student, status, section_id, group_id, subject_id, date=None):
+    """Build the attendance row for a student's mark"""
+    return {
+        'student_id': student.id,
+        'section_id': int(section_id),
+        'group_id': int(group_id),
+        'subject_id': int(subject_id),
+        'status': status,
+        'date': date or datetime.now().date(),
+        'timestamp': datetime.now(),
+        # Set by the notification dispatcher once the absence SMS has been delivered
+        'notification_sent': False,
+    }
+
+
+def _dialect_insert():
+    """The INSERT construct with ON CONFLICT support for the session's database"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert
+    if dialect == 'sqlite':
+        return sqlite.insert
+    raise NotImplementedError(f"Attendance upserts are not supported on {dialect}")
+
+
+def upsert_attendance(rows):
+    """
+    Insert attendance rows, overwriting any existing mark with the same key
+
+    Duplicate keys within rows are collapsed, the last one wins. An existing
+    mark keeps its notification_sent flag. The caller is responsible for
+    committing the session.
+    """
+    rows = list({tuple(row[column] for column in ATTENDANCE_KEY): row for row in rows}.values())
+    if not rows:
+        return
+
+    insert = _dialect_insert()
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        stmt = insert(Attendance).values(rows[start:start + UPSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(ATTENDANCE_KEY),
+            set_={
+                'status': stmt.excluded.status,
+                'timestamp': stmt.excluded.timestamp,
+            },
+        )
+        db.session.execute(stmt)
+
+
+def insert_synced_marks(records):
+    """
+    Record the idempotency keys of synced marks, keeping the first record of any key seen before
+
+    The caller is responsible for committing the session.
+    """
+    records = list({record['key']: record for record in records}.values())
+    if records:
+        db.session.execute(_dialect_insert()(SyncedMark).values(records).on_conflict_do_nothing(index_elements=['key']))
+
+
+def queue_notifications(rows):
+    """
+    Add an absence notification to the outbox for every absent mark in rows
+
+    A mark that already has a notification keeps it, so a student marked
+    absent twice is only told once. The caller is responsible for
+    committing the session, in the same transaction as the marks.
+    """
+    now = datetime.now()
+    entries = list({tuple(row[column] for column in ATTENDANCE_KEY): {
+        **{column: row[column] for column in ATTENDANCE_KEY},
+        'state': 'pending', 'attempts': 0, 'next_attempt_at': now, 'created_at': now,
+    } for row in rows if row['status'] == 'absent'}.values())
+
+    insert = _dialect_insert()
+    for start in range(0, len(entries), UPSERT_CHUNK_SIZE):
+        stmt = insert(NotificationOutbox).values(entries[start:start + UPSERT_CHUNK_SIZE])
+        db.session.execute(stmt.on_conflict_do_nothing(index_elements=list(ATTENDANCE_KEY)))
+
+
+class AttendanceWriter:
+    """
+    Write buffer that coalesces attendance marks into batched transactions
+
+    Marks submitted within `window` seconds of each other are written by a
+    background thread with a single upsert and a single commit, so a burst of
+    clicks costs one fsync instead of one per mark. Repeated marks for the
+    same key in a batch collapse to the latest one.
+
+    Callers get a Future that resolves once their mark is committed (or
+    fails with the commit's exception). When a batch fails, each
+    submission in it is retried in a transaction of its own, so a bad mark
+    only fails the caller that submitted it. Marks synced from offline clients
+    come with SyncedMark records, which are committed in the same
+    transaction so a mark and its idempotency key are saved together, as
+    are absent marks and their queued notifications. flush() waits for everything
+    submitted so far, which readers call before querying Attendance, and
+    close() flushes on shutdown. Listeners registered with add_listener()
+    are called with the rows of every committed batch.
+    """
+
+    def __init__(self, app, window=0.05):
+        self.app = app
+        self.window = window
+
+        self._pending = {}  # key -> (row, [futures])
+        self._pending_synced = []  # (SyncedMark record, future)
+        self._in_flight = []
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback(rows) after every batch of marks is committed"""
+        self._listeners.append(callback)
+
+    def submit(self, rows, synced=()):
+        """
+        Queue one or more attendance rows for the next batch
+
+        All rows passed in one call are written in the same transaction,
+        together with the SyncedMark records in synced
+
+        Returns:
+            Future: Resolves to the number of rows written once committed
+        """
+        if isinstance(rows, dict):
+            rows = [rows]
+
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Attendance writer is closed")
+            for row in rows:
+                key = tuple(row[column] for column in ATTENDANCE_KEY)
+                _, futures = self._pending.get(key, (None, []))
+                self._pending[key] = (row, futures + [future])
+            self._pending_synced.extend((record, future) for record in synced)
+            if not rows and not synced:
+                future.set_result(0)
+            self._start()
+            self._cond.notify()
+        return future
+
+    def write(self, rows, synced=(), timeout=30):
+        """Queue rows and block until they are committed"""
+        return self.submit(rows, synced).result(timeout=timeout)
+
+    def flush(self, timeout=30):
+        """Write everything submitted so far without waiting out the window"""
+        with self._cond:
+            futures = {id(f): f for _, fs in self._pending.values() for f in fs}
+            futures.update({id(f): f for _, f in self._pending_synced})
+            futures.update({id(f): f for f in self._in_flight})
+            if not futures:
+                return
+            self._flush_requested = True
+            self._cond.notify()
+
+        for future in futures.values():
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                # The submitter sees the error; readers just need the batch to be done
+                pass
+
+    def close(self):
+        """Flush outstanding marks and stop the background thread"""
+        with self._cond:
+            self._closed = True
+            self._flush_requested = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._pending_synced and not self._closed:
+                    self._cond.wait()
+                if not self._pending and not self._pending_synced and self._closed:
+                    return
+
+                # Let more marks arrive before writing, unless someone is waiting on a flush
+                deadline = time.monotonic() + self.window
+                while not self._flush_requested and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch, synced = self._pending, self._pending_synced
+                self._pending, self._pending_synced = {}, []
+                self._flush_requested = False
+                in_flight = {id(f): f for _, fs in batch.values() for f in fs}
+                in_flight.update({id(f): f for _, f in synced})
+                self._in_flight = list(in_flight.values())
+
+            self._write_batch(batch, synced)
+
+            with self._cond:
+                self._in_flight = []
+
+    def _commit(self, rows, records):
+        """Write rows, their notifications and synced mark records in one transaction"""
+        with self.app.app_context():
+            try:
+                upsert_attendance(rows)
+                queue_notifications(rows)
+                insert_synced_marks(records)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _write_batch(self, batch, synced=()):
+        rows = [row for row, _ in batch.values()]
+        futures = {id(f): f for _, fs in batch.values() for f in fs}
+        futures.update({id(f): f for _, f in synced})
+        futures = list(futures.values())
+
+        timings = {}
+        try:
+            with pipeline_timer.stage('commit', timings):
+                self._commit(rows, [record for record, _ in synced])
+        except Exception as e:
+            logging.error("Error writing %d attendance marks: %s", len(rows), e)
+            if len(futures) > 1:
+                rows = self._write_separately(batch, synced, futures)
+            else:
+                futures[0].set_exception(e)
+                rows = []
+        else:
+            pipeline_timer.add(timings)
+            logging.debug("Wrote %d attendance marks in one transaction", len(rows))
+            for future in futures:
+                future.set_result(len(rows))
+
+        if not rows:
+            return
+        for callback in self._listeners:
+            try:
+                callback(rows)
+            except Exception as e:
+                logging.error("Attendance listener %r failed: %s", callback, e)
+
+    def _write_separately(self, batch, synced, futures):
+        """
+        Retry a failed batch one submission at a time, so a bad mark only fails its own caller
+
+        A submission's rows and synced records stay in one transaction.
+
+        Returns:
+            list: The rows that were written
+        """
+        written = {}
+        for future in futures:
+            rows = {key: row for key, (row, row_futures) in batch.items() if future in row_futures}
+            records = [record for record, record_future in synced if record_future is future]
+            try:
+                self._commit(list(rows.values()), records)
+            except Exception as e:
+                logging.error("Error writing %d attendance marks on their own: %s", len(rows), e)
+                future.set_exception(e)
+                continue
+            written.update(rows)
+            future.set_result(len(rows))
+        return list(written.values())
@@ -0,0 +1,317 @@
+import io
+import os
+import csv
+import time
+import logging
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from models import db, Enrollment, Group, Student, Subject
+from utils.face_backends import get_backend
+from utils.face_recognition_utils import IMAGE_EXTENSIONS, compute_face_encodings, detect_faces, get_gallery
+
+# Photos are prepared this many to a task, so each worker embeds them in one batch
+PREPARE_CHUNK_SIZE = 16
+
+# Photos are stored at most this many pixels a side
+ENROLL_MAX_SIZE = 640
+
+# Photos smaller than this many pixels a side are rejected
+ENROLL_MIN_SIZE = 64
+
+# Photos whose Laplacian variance (a measure of edge contrast) is below this are rejected as blurry
+ENROLL_MIN_SHARPNESS = 10.0
+
+# Photos bigger than this in the archive are rejected without being read
+MAX_PHOTO_BYTES = 20 * 1024 * 1024
+
+# Zip archives opened by this process during a run, by path
+_archives = {}
+
+
+def read_roster(lines):
+    """
+    Parse a roster CSV
+
+    Columns (header names are case-insensitive): name (required),
+    phone_number, group and subjects, several subjects separated by ";".
+    Students with a group and subjects are enrolled in that group for each
+    of the subjects. A name that appears twice is the same student.
+
+    Args:
+        lines: Iterable of CSV lines, e.g. an open text file
+
+    Returns:
+        tuple: ({name: {"phone_number", "group", "subjects"}}, [(line, reason)] of rejected rows)
+    """
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames or 'name' not in [field.strip().lower() for field in reader.fieldnames]:
+        raise ValueError("The roster must have a name column")
+
+    roster = {}
+    rejects = []
+    for line, row in enumerate(reader, start=2):
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        name = row.get('name', '')
+        if not name:
+            rejects.append((f"line {line}", "Missing name"))
+            continue
+        if len(name) > 100 or name.startswith('.') or '/' in name or '\\' in name:
+            rejects.append((f"line {line}", f"Invalid name {name!r}"))
+            continue
+
+        entry = roster.setdefault(name, {'phone_number': None, 'group': None, 'subjects': []})
+        phone_number = row.get('phone_number') or row.get('phone')
+        if phone_number:
+            entry['phone_number'] = phone_number[:15]
+        if row.get('group'):
+            entry['group'] = row['group']
+        entry['subjects'] += [subject.strip() for subject in row.get('subjects', '').split(';') if subject.strip()]
+    return roster, rejects
+
+
+def list_photos(source):
+    """
+    Every photo in a directory or zip archive
+
+    Returns:
+        list: Paths relative to the directory, or member names of the archive
+    """
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return sorted(info.filename for info in archive.infolist()
+                          if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+                          and not os.path.basename(info.filename).startswith('.'))
+
+    if not os.path.isdir(source):
+        raise ValueError(f"{os.path.basename(source)} is not a directory or zip archive")
+
+    photos = []
+    for root, _, files in os.walk(source):
+        photos += [os.path.relpath(os.path.join(root, name), source) for name in files
+                   if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('.')]
+    return sorted(photos)
+
+
+def student_for_photo(photo, roster):
+    """The roster student a photo belongs to: the one its folder, or else its file, is named after"""
+    parts = photo.replace('\\', '/').split('/')
+    if len(parts) > 1 and parts[-2] in roster:
+        return parts[-2]
+    stem = os.path.splitext(parts[-1])[0]
+    return stem if stem in roster else None
+
+
+def _read_photo(source, photo):
+    if os.path.isdir(source):
+        path = os.path.join(source, photo)
+        if os.path.getsize(path) > MAX_PHOTO_BYTES:
+            raise ValueError("File too large")
+        with open(path, 'rb') as f:
+            return f.read()
+
+    archive = _archives.get(source)
+    if archive is None:
+        archive = _archives[source] = zipfile.ZipFile(source)
+    if archive.getinfo(photo).file_size > MAX_PHOTO_BYTES:
+        raise ValueError("File too large")
+    return archive.read(photo)
+
+
+def _close_archive(source):
+    """Close the zip archive of a run once its photos have been read"""
+    archive = _archives.pop(source, None)
+    if archive is not None:
+        archive.close()
+
+
+def _sharpness(image):
+    """Variance of the Laplacian of the greyscale image"""
+    pixels = np.asarray(image.convert('L'), dtype=np.float32)
+    laplacian = (pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1]
+                 - 4 * pixels[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def prepare_photos(source, photos, max_size=ENROLL_MAX_SIZE):
+    """
+    Decode, resize, quality-check and embed a chunk of photos
+
+    Runs in the enrolment worker processes. A photo is rejected if it can't
+    be decoded, is too small or too blurry, or doesn't show exactly one
+    face. The faces of the accepted photos are embedded in one batch.
+
+    Returns:
+        tuple: ([(photo, JPEG bytes, encoding) of accepted photos], [(photo, reason)], {stage: milliseconds})
+    """
+    timings = {}
+    accepted = []
+    rejects = []
+    faces = []
+    for photo in photos:
+        try:
+            start = time.perf_counter()
+            image = ImageOps.exif_transpose(Image.open(io.BytesIO(_read_photo(source, photo)))).convert('RGB')
+            if min(image.size) < ENROLL_MIN_SIZE:
+                rejects.append((photo, f"Smaller than {ENROLL_MIN_SIZE} pixels"))
+                continue
+            image.thumbnail((max_size, max_size))
+            timings['decode'] = timings.get('decode', 0.0) + (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            if _sharpness(image) < ENROLL_MIN_SHARPNESS:
+                rejects.append((photo, "Too blurry"))
+                continue
+            timings['quality'] = timings.get('quality', 0.0) + (time.perf_counter() - start) * 1000
+
+            found = detect_faces(image, timings)
+            if len(found) != 1:
+                rejects.append((photo, "No face found" if not found else f"{len(found)} faces found"))
+                continue
+
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=90)
+            accepted.append((photo, buffer.getvalue()))
+            faces.append(found[0])
+        except Exception as e:
+            rejects.append((photo, f"Unreadable image: {e}"))
+
+    encodings = compute_face_encodings(faces, timings)
+    return [(photo, jpeg, encoding) for (photo, jpeg), encoding in zip(accepted, encodings)], rejects, timings
+
+
+def _init_worker():
+    get_backend().warm_up()
+
+
+def _run_prepare(source, photos, workers, max_size):
+    """prepare_photos() over every photo, chunk by chunk, in a pool of workers processes (0 runs them here)"""
+    chunks = [photos[start:start + PREPARE_CHUNK_SIZE] for start in range(0, len(photos), PREPARE_CHUNK_SIZE)]
+    if not workers:
+        for chunk in chunks:
+            yield prepare_photos(source, chunk, max_size)
+        return
+
+    # Fork so workers inherit the configured face backend instead of re-importing the app
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                             initializer=_init_worker) as executor:
+        yield from executor.map(prepare_photos, [source] * len(chunks), chunks, [max_size] * len(chunks))
+
+
+def enroll_students(roster_lines, source, workers=None, max_size=ENROLL_MAX_SIZE):
+    """
+    Enrol a roster of students with their face photos
+
+    Students in the roster that don't exist yet are created (matched by
+    name), phone numbers are updated, and students with a group and
+    subjects are enrolled in them. A name already shared by several
+    students is rejected, as the face gallery can't tell them apart. Photos are prepared in a pool of worker
+    processes and added to the face gallery in one batch, with a single
+    write of the gallery files. Needs an app context.
+
+    Args:
+        roster_lines: Lines of the roster CSV, see read_roster()
+        source: Directory or zip archive of photos, one folder per student
+            named as in the roster, or files named after the students
+        workers: Worker processes, one per CPU by default; 0 prepares photos in this process
+
+    Returns:
+        dict: Counts of students created and enrolments added, photos
+        enrolled and rejected with reasons, and throughput
+    """
+    start = time.perf_counter()
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    roster, rejects = read_roster(roster_lines)
+
+    # The face gallery knows students by name, so a name shared by several students can't be enrolled
+    ambiguous = {name for name, in db.session.query(Student.name).filter(Student.name.in_(list(roster)))
+                 .group_by(Student.name).having(db.func.count(Student.id) > 1)}
+    for name in sorted(ambiguous):
+        rejects.append((name, "Several students have this name, not enrolled"))
+        del roster[name]
+
+    photos = []
+    for photo in list_photos(source):
+        if student_for_photo(photo, dict.fromkeys(ambiguous)) is not None:
+            rejects.append((photo, "Several students have this name"))
+        elif student_for_photo(photo, roster) is None:
+            rejects.append((photo, "Not in the roster"))
+        else:
+            photos.append(photo)
+
+    # Prepare the photos before touching the database, the slow part of the run
+    prepared = []
+    timings = {}
+    try:
+        for accepted, rejected, chunk_timings in _run_prepare(source, photos, workers, max_size):
+            prepared += accepted
+            rejects += rejected
+            for stage, elapsed in chunk_timings.items():
+                timings[stage] = timings.get(stage, 0.0) + elapsed
+    finally:
+        # Photos prepared in this process leave the archive open; worker processes close theirs on exit
+        _close_archive(source)
+    prepare_seconds = time.perf_counter() - start
+
+    # Students and enrolments in one transaction
+    existing = {}
+    for student in Student.query.filter(Student.name.in_(list(roster))).order_by(Student.id):
+        existing.setdefault(student.name, student)
+    created = [Student(name=name, phone_number=entry['phone_number'])
+               for name, entry in roster.items() if name not in existing]
+    db.session.add_all(created)
+    for name, student in existing.items():
+        if roster[name]['phone_number']:
+            student.phone_number = roster[name]['phone_number']
+    db.session.flush()
+    students = {**existing, **{student.name: student for student in created}}
+
+    groups = {group.name: group.id for group in Group.query}
+    subjects = {subject.name: subject.id for subject in Subject.query}
+    wanted = set()
+    for name, entry in roster.items():
+        if not entry['group'] and not entry['subjects']:
+            continue
+        if not entry['group']:
+            rejects.append((name, "No group given, not enrolled"))
+            continue
+        if entry['group'] not in groups:
+            rejects.append((name, f"Unknown group {entry['group']!r}, not enrolled"))
+            continue
+        for subject_name in entry['subjects']:
+            if subject_name in subjects:
+                wanted.add((students[name].id, groups[entry['group']], subjects[subject_name]))
+            else:
+                rejects.append((name, f"Unknown subject {subject_name!r}, not enrolled"))
+    current = set(db.session.query(Enrollment.student_id, Enrollment.group_id, Enrollment.subject_id)
+                  .filter(Enrollment.student_id.in_([student.id for student in students.values()])))
+    new_enrollments = [{'student_id': student_id, 'group_id': group_id, 'subject_id': subject_id}
+                       for student_id, group_id, subject_id in sorted(wanted - current)]
+    if new_enrollments:
+        db.session.execute(db.insert(Enrollment), new_enrollments)
+    db.session.commit()
+
+    # Every accepted photo goes into the gallery with one rebuild and one write of its files
+    get_gallery().add_photos([(student_for_photo(photo, roster), jpeg, encoding)
+                              for photo, jpeg, encoding in prepared])
+
+    seconds = time.perf_counter() - start
+    report = {
+        "students": len(roster),
+        "students_created": len(created),
+        "enrollments_added": len(new_enrollments),
+        "photos": len(photos),
+        "photos_enrolled": len(prepared),
+        "students_without_photos": sorted(set(roster) - {student_for_photo(photo, roster) for photo, _, _ in prepared}),
+        "rejected": [{"item": item, "reason": reason} for item, reason in rejects],
+        "seconds": round(seconds, 3),
+        "photos_per_second": round(len(photos) / prepare_seconds, 1) if prepare_seconds else None,
+        "timings_ms": {stage: round(elapsed, 1) for stage, elapsed in timings.items()},
+    }
+    logging.info("Enrolled %d students: %d created, %d of %d photos accepted in %.1f s",
+                 len(roster), len(created), len(prepared), len(photos), seconds)
+    return report
@@ -1,61 +1,66 @@
 import os
+import io
 import csv
 from datetime import datetime
 
-def export_attendance_to_csv(section_name, group_name, subject_name, present_students, absent_students):
+# Header of every attendance export, one column per field written by stream_attendance_csv
+CSV_HEADER = ['Date', 'Section', 'Group', 'Subject', 'Student Name', 'Status']
+
+# Rows buffered before a chunk of a streamed export is yielded
+STREAM_CHUNK_ROWS = 500
+
+
+def get_csv_dir():
+    """Directory holding archived CSV exports, created on first use"""
+    csv_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'csv')
+    os.makedirs(csv_dir, exist_ok=True)
+    return csv_dir
+
+
+def stream_attendance_csv(rows, archive_filename=None):
     """
-    Export attendance data to a CSV file
-    
+    Turn attendance rows into CSV text, chunk by chunk
+
     Args:
-        section_name: Name of the section
-        group_name: Name of the group
-        subject_name: Name of the subject
-        present_students: List of present student objects
-        absent_students: List of absent student objects
-        
-    Returns:
-        The path to the generated CSV file
+        rows: Iterable of (date, section, group, subject, student name, status),
+            e.g. from attendance_queries.iter_attendance
+        archive_filename: If given, a copy of the export is also written to
+            this file in the CSV directory as it streams
+
+    Yields:
+        str: Chunks of CSV text, starting with the header
     """
-    # Create directory for CSV files if it doesn't exist
-    csv_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'csv')
-    os.makedirs(csv_dir, exist_ok=True)
-    
-    # Generate filename with timestamp
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    archive = open(os.path.join(get_csv_dir(), archive_filename), 'w', newline='') if archive_filename else None
+
+    def take_chunk():
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if archive:
+            archive.write(chunk)
+        return chunk
+
+    # Rows for the same day are consecutive, so each date is only formatted once
+    formatted_dates = {}
+    try:
+        writer.writerow(CSV_HEADER)
+        for count, (date, section_name, group_name, subject_name, student_name, status) in enumerate(rows, 1):
+            formatted_date = formatted_dates.get(date)
+            if formatted_date is None:
+                formatted_date = formatted_dates[date] = date.strftime("%Y-%m-%d")
+            writer.writerow([formatted_date, section_name, group_name, subject_name, student_name, status.capitalize()])
+
+            if count % STREAM_CHUNK_ROWS == 0:
+                yield take_chunk()
+        yield take_chunk()
+    finally:
+        if archive:
+            archive.close()
+
+
+def archive_filename_for(section_name, start_date, end_date):
+    """Timestamped name for an archived export"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"attendance_{section_name}_{group_name}_{subject_name}_{timestamp}.csv"
-    filepath = os.path.join(csv_dir, filename)
-    
-    # Create CSV file
-    with open(filepath, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        
-        # Write header
-        writer.writerow(['Date', 'Section', 'Group', 'Subject', 'Student Name', 'Status', 'Phone Number', 'Notification Sent'])
-        
-        # Write present students
-        for student in present_students:
-            writer.writerow([
-                datetime.now().strftime("%Y-%m-%d"),
-                section_name,
-                group_name,
-                subject_name,
-                student.name,
-                'Present',
-                # student.phone_number or 'N/A',
-                # 'N/A'  # No notifications for present students
-            ])
-            
-        # Write absent students
-        for student in absent_students:
-            writer.writerow([
-                datetime.now().strftime("%Y-%m-%d"),
-                section_name,
-                group_name,
-                subject_name,
-                student.name,
-                'Absent',
-                # student.phone_number or 'N/A',
-                # 'Yes' if student.phone_number else 'No'  # Notifications only sent if phone number exists
-            ])
-    
-    return filename
+    return f"attendance_{section_name}_{start_date:%Y%m%d}-{end_date:%Y%m%d}_{timestamp}.csv"
@@ -0,0 +1,98 @@
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+
+# Used when DATABASE_URL isn't set; relative SQLite paths live in the instance folder
+DEFAULT_DATABASE_URL = "sqlite:///attendance.db"
+
+# Databases whose INSERT ... ON CONFLICT the attendance writer relies on
+SUPPORTED_DIALECTS = ("sqlite", "postgresql")
+
+
+def normalize_database_url(url):
+    """Accept the postgres:// scheme many hosting providers hand out, which SQLAlchemy doesn't"""
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def engine_options(config):
+    """
+    SQLAlchemy engine options for the configured database
+
+    SQLite connections are local files, so they get neither pre-ping nor
+    recycling. Server databases get a sized connection pool: DB_POOL_SIZE
+    connections kept open per process, up to DB_MAX_OVERFLOW more under
+    load, waiting at most DB_POOL_TIMEOUT seconds for a free one.
+
+    Returns:
+        dict: Value for SQLALCHEMY_ENGINE_OPTIONS
+    """
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite":
+        return {
+            # The attendance writer and the request threads share the pool
+            "connect_args": {"check_same_thread": False},
+        }
+
+    return {
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+
+
+def _sqlite_pragmas(config):
+    """The PRAGMA statements run on every new SQLite connection"""
+    return [
+        # WAL lets readers carry on while a writer commits, and makes commits cheaper
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        # In WAL mode NORMAL only syncs at checkpoints; a power cut can lose the last
+        # commits but never corrupts the database
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        # Wait for a competing writer (another worker process) instead of failing at once
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+    ]
+
+
+def init_database(app):
+    """
+    Attach the database to the app
+
+    For SQLite, the journal mode, synchronous level and busy timeout are
+    applied to every connection as it is opened
+
+    Raises:
+        ValueError: If the database isn't SQLite or PostgreSQL
+    """
+    backend = make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_backend_name()
+    if backend not in SUPPORTED_DIALECTS:
+        raise ValueError(f"Unsupported database {backend!r} in DATABASE_URL: "
+                         f"use one of {', '.join(SUPPORTED_DIALECTS)}")
+
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != "sqlite":
+        logging.info("Using %s database with a pool of %d (+%d) connections",
+                     engine.dialect.name, app.config['DB_POOL_SIZE'], app.config['DB_MAX_OVERFLOW'])
+        return
+
+    pragmas = _sqlite_pragmas(app.config)
+
+    @event.listens_for(engine, "connect")
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    logging.info("Using SQLite database %s with %s", engine.url.database, ', '.join(pragmas))
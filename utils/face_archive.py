@@ -0,0 +1,295 @@
+import io
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime, date, timedelta
+
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Without fcntl, appends from several processes are not serialised
+    fcntl = None
+
+# Recognised faces are archived as JPEG thumbnails of at most this size
+ARCHIVE_THUMBNAIL_SIZE = (128, 128)
+ARCHIVE_JPEG_QUALITY = 75
+
+# Day directories are named after their date, which is also how retention finds them
+DAY_FORMAT = '%Y-%m-%d'
+
+
+def make_thumbnail(image_bytes):
+    """Shrink a captured image to an archive thumbnail, returned as JPEG bytes"""
+    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    image.thumbnail(ARCHIVE_THUMBNAIL_SIZE)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=ARCHIVE_JPEG_QUALITY)
+    return buffer.getvalue()
+
+
+class FaceArchive:
+    """
+    Append-only archive of recognised faces, written by a background thread
+
+    Captures are packed per day and group: <archive_dir>/<YYYY-MM-DD>/group_<id>.pack
+    holds the thumbnails back to back, and group_<id>.idx holds one JSON line per
+    thumbnail with the student, time, offset and length, so any capture can be
+    read with a single seek. Pack bytes are written before their index lines,
+    so the index never points past the end of a pack; appends are serialised
+    across processes with an exclusive lock on the pack.
+
+    submit() only queues the capture. The thread writes everything queued
+    within `window` seconds in one go, one open per pack, and deletes day
+    directories older than retention_days once a day (0 keeps everything).
+    """
+
+    def __init__(self, archive_dir, retention_days=0, window=0.5):
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self.window = window
+
+        self._pending = []
+        self._writing = False
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._retention_applied = None  # Day retention last ran
+
+    def submit(self, student_name, group_id, thumbnail, timestamp=None):
+        """Queue a recognised face's thumbnail for archiving"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Face archive is closed")
+            self._pending.append((student_name, group_id, thumbnail, timestamp or datetime.now()))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='face-archive', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def flush(self, timeout=30):
+        """Wait until everything submitted so far is on disk"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._pending:
+                self._flush_requested = True
+                self._cond.notify()
+            while self._pending or self._writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+    def close(self):
+        """Write outstanding captures and stop the background thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending and self._closed:
+                    return
+
+                # Give other captures a moment to arrive so they share the write
+                deadline = time.monotonic() + self.window
+                while not self._flush_requested and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch = self._pending
+                self._pending = []
+                self._flush_requested = False
+                self._writing = True
+
+            try:
+                self._write_batch(batch)
+                self._apply_retention_daily()
+            except Exception as e:
+                logging.error("Error archiving %d recognised faces: %s", len(batch), e)
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+    def _write_batch(self, batch):
+        packs = {}
+        for student_name, group_id, thumbnail, timestamp in batch:
+            packs.setdefault((timestamp.date(), group_id), []).append((student_name, thumbnail, timestamp))
+
+        for (day, group_id), captures in packs.items():
+            self.append(day, group_id, captures)
+        logging.debug("Archived %d recognised faces into %d packs", len(batch), len(packs))
+
+    def pack_paths(self, day, group_id):
+        """Paths of the pack and index files for a day and group"""
+        base = os.path.join(self.archive_dir, day.strftime(DAY_FORMAT), f"group_{group_id}")
+        return f"{base}.pack", f"{base}.idx"
+
+    def append(self, day, group_id, captures):
+        """
+        Append captures to a day's pack for a group
+
+        Args:
+            captures: List of (student name, JPEG bytes, timestamp)
+        """
+        pack_path, index_path = self.pack_paths(day, group_id)
+        os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+
+        with open(pack_path, 'ab') as pack:
+            if fcntl is not None:
+                fcntl.flock(pack, fcntl.LOCK_EX)
+            try:
+                offset = pack.seek(0, os.SEEK_END)
+                entries = []
+                for student_name, thumbnail, timestamp in captures:
+                    pack.write(thumbnail)
+                    entries.append({
+                        'student': student_name,
+                        'time': timestamp.isoformat(),
+                        'offset': offset,
+                        'length': len(thumbnail),
+                    })
+                    offset += len(thumbnail)
+                pack.flush()
+
+                with open(index_path, 'a+b') as index:
+                    # Start on a fresh line if a crash left the last one torn
+                    if index.seek(0, os.SEEK_END):
+                        index.seek(-1, os.SEEK_END)
+                        if index.read(1) != b'\n':
+                            index.write(b'\n')
+                    index.write(''.join(json.dumps(entry) + '\n' for entry in entries).encode())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(pack, fcntl.LOCK_UN)
+
+    def read_index(self, day, group_id, student_name=None):
+        """
+        List the captures archived for a group on a day
+
+        Returns:
+            list: Index entries ({"student", "time", "offset", "length"}) in the order they were written
+        """
+        _, index_path = self.pack_paths(day, group_id)
+        if not os.path.exists(index_path):
+            return []
+
+        entries = []
+        with open(index_path) as index:
+            for line in index:
+                # A crash can leave a torn last line; everything before it is intact
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if student_name is None or entry['student'] == student_name:
+                    entries.append(entry)
+        return entries
+
+    def read_capture(self, day, group_id, entry):
+        """Read one capture's JPEG bytes using its index entry"""
+        pack_path, _ = self.pack_paths(day, group_id)
+        with open(pack_path, 'rb') as pack:
+            pack.seek(entry['offset'])
+            return pack.read(entry['length'])
+
+    def _apply_retention_daily(self):
+        today = date.today()
+        if self.retention_days and self._retention_applied != today:
+            self.apply_retention(today)
+            self._retention_applied = today
+
+    def apply_retention(self, today=None):
+        """
+        Delete the day directories that are older than the retention period
+
+        Returns:
+            int: Number of day directories removed
+        """
+        if not self.retention_days or not os.path.isdir(self.archive_dir):
+            return 0
+
+        cutoff = (today or date.today()) - timedelta(days=self.retention_days)
+        removed = 0
+        for entry in os.listdir(self.archive_dir):
+            try:
+                day = datetime.strptime(entry, DAY_FORMAT).date()
+            except ValueError:
+                continue  # Not a day directory
+            if day < cutoff:
+                shutil.rmtree(os.path.join(self.archive_dir, entry), ignore_errors=True)
+                removed += 1
+
+        if removed:
+            logging.info("Removed %d days of archived faces older than %s", removed, cutoff)
+        return removed
+
+    def compact_legacy(self, group_id=0):
+        """
+        Fold loose per-student JPEGs (<archive_dir>/<student>/<student>_<timestamp>.jpg)
+        into the day packs as thumbnails, then delete them
+
+        Those files predate the packed archive and don't record a group, so
+        they are packed under group_id
+
+        Returns:
+            int: Number of files compacted
+        """
+        if not os.path.isdir(self.archive_dir):
+            return 0
+
+        captures = {}
+        for student_name in sorted(os.listdir(self.archive_dir)):
+            student_dir = os.path.join(self.archive_dir, student_name)
+            if not os.path.isdir(student_dir):
+                continue
+            try:
+                datetime.strptime(student_name, DAY_FORMAT)
+                continue  # Already a day directory
+            except ValueError:
+                pass
+
+            for filename in sorted(os.listdir(student_dir)):
+                if not filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+                    continue
+                path = os.path.join(student_dir, filename)
+                stamp = os.path.splitext(filename)[0].rsplit('_', 1)[-1]
+                try:
+                    timestamp = datetime.strptime(stamp, '%Y%m%d%H%M%S')
+                except ValueError:
+                    timestamp = datetime.fromtimestamp(os.path.getmtime(path))
+                try:
+                    with open(path, 'rb') as f:
+                        thumbnail = make_thumbnail(f.read())
+                except (OSError, ValueError) as e:
+                    logging.warning("Skipping unreadable capture %s: %s", path, e)
+                    continue
+                captures.setdefault(timestamp.date(), []).append((student_name, thumbnail, timestamp, path))
+
+        compacted = 0
+        for day, day_captures in sorted(captures.items()):
+            self.append(day, group_id, [capture[:3] for capture in day_captures])
+            for capture in day_captures:
+                os.remove(capture[3])
+            compacted += len(day_captures)
+
+        # Drop the student directories that are now empty
+        for student_name in os.listdir(self.archive_dir):
+            student_dir = os.path.join(self.archive_dir, student_name)
+            if os.path.isdir(student_dir) and not os.listdir(student_dir):
+                os.rmdir(student_dir)
+
+        logging.info("Compacted %d loose recognised faces into the archive", compacted)
+        return compacted
@@ -0,0 +1,304 @@
+import os
+import time
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+from utils.metrics import pipeline_timer
+
+try:
+    import cv2
+except ImportError:  # Without OpenCV, face detection treats the whole frame as one face
+    cv2 = None
+
+# Faces smaller than this (in pixels) are ignored by the detectors
+MIN_FACE_SIZE = (40, 40)
+
+# Thumbnail backend: 128-dimensional encodings built from a 8x16 grayscale thumbnail
+ENCODING_SIZE = (8, 16)
+ENCODING_DIM = ENCODING_SIZE[0] * ENCODING_SIZE[1]
+
+# Minimum cosine similarity for a captured face to count as a match with the thumbnail backend
+MATCH_THRESHOLD = 0.8
+
+# ONNX models from the OpenCV model zoo used by the DNN backend
+YUNET_MODEL = 'face_detection_yunet_2023mar.onnx'
+SFACE_MODEL = 'face_recognition_sface_2021dec.onnx'
+
+# Where the five YuNet landmarks (eyes, nose tip, mouth corners) end up in a
+# 112x112 aligned face, the layout SFace was trained on
+SFACE_INPUT_SIZE = (112, 112)
+SFACE_LANDMARKS = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+], dtype=np.float32)
+
+# A detected face: box is (x, y, width, height) in pixels, landmarks a 5x2
+# array of (x, y) points or None if the detector doesn't produce them
+Detection = namedtuple('Detection', ['box', 'landmarks', 'score'])
+
+
+class FaceBackend:
+    """
+    Interface for a face detection and embedding backend
+
+    The pipeline runs decode -> detect -> align -> embed: detect() finds the
+    faces in an RGB image, align() turns one detection into whatever input
+    the embedding model expects, and embed() encodes a batch of aligned
+    faces in one pass. Encodings are compared with cosine similarity, so
+    embed() returns L2-normalised rows.
+
+    Models are loaded by load(), once per process; warm_up() also runs a
+    dummy image through every stage so the first real request doesn't pay
+    for lazy initialisation.
+    """
+
+    name = None
+    dim = ENCODING_DIM
+    match_threshold = MATCH_THRESHOLD
+
+    def __init__(self):
+        self._loaded = False
+        self._warm_pid = None
+        # Loaded models are not safe to call from several threads at once
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load the models if this process hasn't yet"""
+        with self._lock:
+            if not self._loaded:
+                start = time.perf_counter()
+                self._load()
+                self._loaded = True
+                logging.info("Loaded %s face models in %.0f ms", self.name, (time.perf_counter() - start) * 1000)
+
+    def warm_up(self):
+        """Run a dummy image through every stage once in this process"""
+        if self._warm_pid == os.getpid():
+            return
+        self.load()
+
+        timings = {}
+        image = Image.new('RGB', (320, 240), (128, 128, 128))
+        with pipeline_timer.stage('detect', timings):
+            self.detect(image)
+        detection = Detection((80, 40, 160, 160), None, 1.0)
+        with pipeline_timer.stage('align', timings):
+            face = self.align(image, detection)
+        with pipeline_timer.stage('embed', timings):
+            self.embed([face])
+
+        self._warm_pid = os.getpid()
+        logging.info("Warmed up %s face backend in process %d: %s", self.name, os.getpid(),
+                     ", ".join(f"{name} {elapsed:.1f} ms" for name, elapsed in timings.items()))
+
+    def _load(self):
+        pass
+
+    def detect(self, image):
+        """
+        Find every face in an image
+
+        Returns:
+            list: Detection tuples, largest face first
+        """
+        raise NotImplementedError
+
+    def align(self, image, detection):
+        """Crop and align one detected face for embed()"""
+        raise NotImplementedError
+
+    def embed(self, faces):
+        """
+        Encode a batch of aligned faces
+
+        Returns:
+            np.ndarray: (len(faces) x dim) float32 matrix with L2-normalised rows
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _by_size(detections):
+        return sorted(detections, key=lambda detection: detection.box[2] * detection.box[3], reverse=True)
+
+
+class ThumbnailBackend(FaceBackend):
+    """
+    OpenCV Haar cascade detection with grayscale thumbnail encodings
+
+    Needs no model files, so it is always available; without OpenCV the
+    whole image is treated as a single face
+    """
+
+    name = 'thumbnail'
+
+    def _load(self):
+        self._detector = None
+        if cv2 is None:
+            logging.warning("OpenCV is not installed, faces will not be detected")
+            return
+
+        cascade_path = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        if os.path.exists(cascade_path):
+            self._detector = cv2.CascadeClassifier(cascade_path)
+        else:
+            logging.warning("Face detector model %s not found", cascade_path)
+
+    def detect(self, image):
+        self.load()
+        if self._detector is None:
+            return [Detection((0, 0, image.width, image.height), None, 1.0)]
+
+        gray = np.asarray(image.convert('L'))
+        with self._lock:
+            boxes = self._detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=MIN_FACE_SIZE)
+        return self._by_size([Detection(tuple(int(v) for v in box), None, 1.0) for box in boxes])
+
+    def align(self, image, detection):
+        x, y, w, h = detection.box
+        return image.crop((x, y, x + w, y + h))
+
+    def embed(self, faces):
+        if not faces:
+            return np.zeros((0, self.dim), dtype=np.float32)
+
+        pixels = np.stack([np.asarray(face.convert('L').resize(ENCODING_SIZE, Image.BILINEAR), dtype=np.float32).ravel()
+                           for face in faces])
+        # Mean-centred so the encoding doesn't depend on overall brightness
+        return normalize_rows(pixels - pixels.mean(axis=1, keepdims=True))
+
+
+class SFaceBackend(FaceBackend):
+    """
+    YuNet detection, five-point alignment and SFace embeddings on OpenCV's DNN module
+
+    Both models are small ONNX files from the OpenCV model zoo and run on
+    the CPU. Faces are aligned with a similarity transform that maps the
+    detected landmarks onto SFace's 112x112 template, then embedded as one
+    batched forward pass.
+    """
+
+    name = 'sface'
+    dim = 128
+    # Cosine threshold recommended for SFace
+    match_threshold = 0.363
+
+    def __init__(self, models_dir, score_threshold=0.9):
+        super().__init__()
+        self.detector_path = os.path.join(models_dir, YUNET_MODEL)
+        self.recognizer_path = os.path.join(models_dir, SFACE_MODEL)
+        self.score_threshold = score_threshold
+
+    @classmethod
+    def available(cls, models_dir):
+        """Whether OpenCV supports the models and their files are present"""
+        return (cv2 is not None and hasattr(cv2, 'FaceDetectorYN') and models_dir is not None
+                and os.path.exists(os.path.join(models_dir, YUNET_MODEL))
+                and os.path.exists(os.path.join(models_dir, SFACE_MODEL)))
+
+    def _load(self):
+        self._detector = cv2.FaceDetectorYN.create(self.detector_path, '', (320, 320), self.score_threshold)
+        self._recognizer = cv2.dnn.readNetFromONNX(self.recognizer_path)
+
+    def detect(self, image):
+        self.load()
+        bgr = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+        with self._lock:
+            self._detector.setInputSize((image.width, image.height))
+            _, faces = self._detector.detect(bgr)
+        if faces is None:
+            return []
+
+        # Each row is x, y, w, h, five (x, y) landmarks and the score
+        detections = [Detection(tuple(int(v) for v in face[:4]), face[4:14].reshape(5, 2), float(face[14]))
+                      for face in faces if face[2] >= MIN_FACE_SIZE[0] and face[3] >= MIN_FACE_SIZE[1]]
+        return self._by_size(detections)
+
+    def align(self, image, detection):
+        bgr = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+        transform = None
+        if detection.landmarks is not None:
+            transform, _ = cv2.estimateAffinePartial2D(np.asarray(detection.landmarks, dtype=np.float32),
+                                                       SFACE_LANDMARKS, method=cv2.LMEDS)
+        if transform is not None:
+            return cv2.warpAffine(bgr, transform, SFACE_INPUT_SIZE)
+
+        # No landmarks, or degenerate ones (e.g. all in one spot) that give no transform: crop the box instead
+        x, y, w, h = detection.box
+        face = bgr[max(y, 0):y + h, max(x, 0):x + w]
+        if face.size == 0:
+            face = bgr
+        return cv2.resize(face, SFACE_INPUT_SIZE)
+
+    def embed(self, faces):
+        if not faces:
+            return np.zeros((0, self.dim), dtype=np.float32)
+
+        self.load()
+        blob = cv2.dnn.blobFromImages(faces, 1.0, SFACE_INPUT_SIZE, (0, 0, 0), swapRB=True, crop=False)
+        with self._lock:
+            self._recognizer.setInput(blob)
+            features = self._recognizer.forward()
+        return normalize_rows(features.reshape(len(faces), -1))
+
+
+def normalize_rows(matrix):
+    """Return a contiguous float32 copy of matrix with every row scaled to unit length"""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# The backend used by this process, chosen by configure_backend()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def configure_backend(name='auto', models_dir=None):
+    """
+    Choose the face backend for this process
+
+    Args:
+        name: 'sface', 'thumbnail', or 'auto' to use SFace when its model
+            files are in models_dir and fall back to thumbnails otherwise
+        models_dir: Directory holding the ONNX model files
+
+    Returns:
+        FaceBackend: The configured (not yet loaded) backend
+    """
+    global _backend
+
+    if name == 'auto':
+        name = 'sface' if SFaceBackend.available(models_dir) else 'thumbnail'
+
+    if name == 'sface':
+        if not SFaceBackend.available(models_dir):
+            raise ValueError(f"SFace backend needs OpenCV and {YUNET_MODEL} and {SFACE_MODEL} in {models_dir}")
+        backend = SFaceBackend(models_dir)
+    elif name == 'thumbnail':
+        backend = ThumbnailBackend()
+    else:
+        raise ValueError(f"Unknown face backend {name}")
+
+    with _backend_lock:
+        _backend = backend
+    logging.info("Using the %s face backend", backend.name)
+    return backend
+
+
+def get_backend():
+    """Return the configured face backend, the thumbnail one by default"""
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = ThumbnailBackend()
+    return _backend
@@ -1,181 +1,1031 @@
 import os
+import time
+import fcntl
 import numpy as np
 import base64
 from datetime import datetime
 import logging
-import random
 import hashlib
 from PIL import Image
 import io
+import json
+import struct
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from utils.ann_index import IVFIndex
+from utils.face_archive import make_thumbnail
+from utils.face_backends import Detection, get_backend, normalize_rows
+from utils.gallery_store import open_gallery_store, store_stat, write_gallery_store
+from utils.metrics import pipeline_timer
 
-# Dictionary to store the actual image data for each student's photos
-STUDENT_IMAGES = {}
+# List of students that always get a gallery entry, even without photos
+DEFAULT_STUDENTS = ["Tanish", "Yuvraj", "Vishal", "Suraj", "Sanyam"]
 
-def load_known_faces(faces_dir):
+# Photo extensions that are picked up from the faces directory
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Bump this when the layout of the on-disk gallery index changes
+GALLERY_INDEX_VERSION = 5
+
+# Faces encoded per forward pass of the embedding model
+EMBED_BATCH_SIZE = 32
+
+# Rebuild the ANN index once it holds this many times more vectors than it was trained on
+ANN_REBUILD_GROWTH = 4
+
+# Seconds between checks for a newer shared gallery file written by another process
+STORE_CHECK_INTERVAL = 1.0
+
+# Roster views each gallery keeps, for the classes most recently matched against
+ROSTER_VIEW_CACHE_SIZE = 64
+
+# The part of the gallery covering one class roster: the roster students with
+# photos, their photos' encodings, each row's student name and each row's
+# index into students
+RosterView = namedtuple('RosterView', ['students', 'matrix', 'names', 'columns'])
+
+# The gallery shared by every request in this process, and where to build it from
+_gallery = None
+_gallery_lock = threading.Lock()
+_gallery_paths = (None, None)
+
+# Binary gallery format served to browsers doing client-side matching:
+# magic, format version, dtype code, dimensions, rows, length of the names JSON
+CLIENT_GALLERY_MAGIC = b'FGAL'
+CLIENT_GALLERY_HEADER = struct.Struct('<4sBBHII')
+CLIENT_GALLERY_DTYPES = {'int8': 1, 'float16': 2}
+
+# Serialised client galleries, keyed by (gallery, gallery version, dtype, roster)
+_client_gallery_cache = {}
+
+
+class FaceGallery:
     """
-    Load known face encodings and their names from the faces directory
-    
-    This function looks for existing student photos in the faces directory
-    Each student's photo is stored in a subfolder named after the student
+    In-memory gallery of enrolled student photos
+
+    The gallery is built once and persisted to an on-disk index keyed by each
+    photo's path, mtime and size. refresh() re-scans the faces directory and
+    only re-reads photos that were added or changed since the last build, and
+    drops photos that were removed.
+
+    Encodings come from the configured face backend and are held as one
+    contiguous float32 (N x dim) matrix with
+    L2-normalised rows, so matching a capture is a single matrix-vector
+    product no matter how many students are enrolled. For 1:N identification
+    the same encodings are also kept in an IVF index, keyed by a stable
+    per-photo id and updated in place as photos are enrolled or removed.
+
+    Every process shares one copy of the encodings: the gallery is also
+    written as a flat file (see utils.gallery_store) that each process maps
+    read-only and matches against. Changes are made by one process at a
+    time under a file lock: it loads the full index, applies the change,
+    swaps in a new gallery file and maps that, dropping the index again.
+    Other processes pick up the new file within STORE_CHECK_INTERVAL
+    seconds through reload_if_changed(), without a restart.
     """
-    known_face_encodings = []
-    known_face_names = []
-    
-    # Clear the global dictionaries
-    global STUDENT_IMAGES
-    STUDENT_IMAGES = {}
-    
-    # List of students
-    students = ["Tanish", "Yuvraj", "Vishal", "Suraj", "Sanyam"]
-    
-    # Create the faces directory if it doesn't exist
-    if not os.path.exists(faces_dir):
-        logging.warning(f"Faces directory {faces_dir} does not exist. Creating it.")
-        os.makedirs(faces_dir, exist_ok=True)
-        
-        # Create student directories
+
+    def __init__(self, faces_dir, index_path=None):
+        self.faces_dir = faces_dir
+        self.index_path = index_path or os.path.join(faces_dir, '.gallery_index.json')
+
+        # Relative photo path -> {"id", "student", "mtime", "size", "encoding"}
+        self.photos = {}
+        self.next_id = 0
+
+        # Approximate nearest-neighbour index over the photo ids
+        self.ann = None
+        self.ann_trained_size = 0
+        self.id_students = {}
+
+        # The mapped gallery file that the views below come from, if any
+        self.store = None
+        self._store_checked = 0.0
+
+        # Derived views, rebuilt whenever the photos change
+        self.students = []
+        self.matrix = np.zeros((0, get_backend().dim), dtype=np.float32)
+        self.labels = np.zeros(0, dtype=np.int32)  # Row -> index into self.students
+        self.names = []  # Row -> student name
+        self.version = 0
+
+        # (version, matrix, student name -> array of rows), swapped in as one
+        self._student_rows = (0, self.matrix, {})
+        self._roster_views = OrderedDict()
+        self._roster_views_lock = threading.Lock()
+
+        self._lock = threading.RLock()
+
+    @property
+    def encodings_path(self):
+        """Sidecar .npy file holding the encodings, one row per indexed photo"""
+        return f"{self.index_path}.npy"
+
+    @property
+    def ann_path(self):
+        """Sidecar .npz file holding the ANN index"""
+        return f"{self.index_path}.ivf.npz"
+
+    @property
+    def store_path(self):
+        """Flat gallery file shared by every process"""
+        return f"{self.index_path}.bin"
+
+    @property
+    def lock_path(self):
+        """File locked while a process changes the gallery"""
+        return f"{self.index_path}.lock"
+
+    def load_index(self):
+        """
+        Load the persisted index from disk
+
+        Returns True if a usable index was found
+        """
+        if not os.path.exists(self.index_path):
+            return False
+
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            if index.get('version') != GALLERY_INDEX_VERSION:
+                logging.info("Gallery index %s is outdated, rebuilding", self.index_path)
+                return False
+            # Encodings from one backend mean nothing to another
+            if index.get('backend') != get_backend().name:
+                logging.info("Gallery index %s was built by the %s backend, rebuilding", self.index_path, index.get('backend'))
+                return False
+            encodings = np.load(self.encodings_path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable gallery index %s: %s", self.index_path, e)
+            return False
+
+        photos = {}
+        for rel_path, record in index.get('photos', {}).items():
+            record['encoding'] = encodings[record.pop('row')]
+            photos[rel_path] = record
+
+        # The ANN index is only reused if it covers exactly the indexed photos
+        ann = None
+        if os.path.exists(self.ann_path):
+            try:
+                ann = IVFIndex.load(self.ann_path)
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning("Ignoring unreadable ANN index %s: %s", self.ann_path, e)
+            if ann is not None and len(ann) != len(photos):
+                logging.info("ANN index %s is out of date, rebuilding", self.ann_path)
+                ann = None
+
+        with self._lock:
+            self.photos = photos
+            self.next_id = index.get('next_id', len(photos))
+            self.ann = ann
+            self.ann_trained_size = index.get('ann_trained_size', len(photos)) if ann else 0
+        return True
+
+    def save_index(self):
+        """Write the index and its encodings to disk atomically"""
+        os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+
+        with self._lock:
+            rel_paths = sorted(self.photos)
+            photos = {}
+            for row, rel_path in enumerate(rel_paths):
+                record = dict(self.photos[rel_path])
+                del record['encoding']
+                record['row'] = row
+                photos[rel_path] = record
+            encodings = self._stack([self.photos[rel_path]['encoding'] for rel_path in rel_paths])
+            students = list(self.students)
+            student_index = {student_name: i for i, student_name in enumerate(students)}
+            labels = [student_index[self.photos[rel_path]['student']] for rel_path in rel_paths]
+            ids = [self.photos[rel_path]['id'] for rel_path in rel_paths]
+
+        # Write the encodings first so a crash never leaves the index pointing at missing rows
+        tmp_path = f"{self.encodings_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, encodings)
+        os.replace(tmp_path, self.encodings_path)
+
+        if self.ann is not None:
+            self.ann.save(self.ann_path)
+
+        # The shared gallery file is swapped in before the index, so a crash in between
+        # leaves photos in it that the index lacks, which the next refresh() reads again
+        write_gallery_store(self.store_path, time.time_ns(), get_backend().name, students, encodings, labels, ids)
+
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'version': GALLERY_INDEX_VERSION,
+                'backend': get_backend().name,
+                'next_id': self.next_id,
+                'ann_trained_size': self.ann_trained_size,
+                'photos': photos,
+            }, f)
+        os.replace(tmp_path, self.index_path)
+
+    def attach_store(self):
+        """
+        Map the shared gallery file and match against it
+
+        The index and its encodings are dropped from memory; they are only
+        loaded again to change the gallery.
+
+        Returns True if the file was usable; otherwise the gallery is left as it was
+        """
+        try:
+            if self.store is not None and store_stat(self.store_path) == self.store.stat:
+                with self._lock:
+                    self.photos = {}
+                self._store_checked = time.monotonic()
+                return True
+            store = open_gallery_store(self.store_path)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable gallery file %s: %s", self.store_path, e)
+            return False
+
+        if store.backend != get_backend().name or store.matrix.shape[1] != get_backend().dim:
+            logging.info("Gallery file %s was built by the %s backend, ignoring it", self.store_path, store.backend)
+            return False
+
+        offsets = store.offsets
+        labels = np.repeat(np.arange(len(store.students), dtype=np.int32), np.diff(offsets))
+        names = [store.students[label] for label in labels]
+        with self._lock:
+            self.store = store
+            self.photos = {}
+            self.ann = None
+            self.students = list(store.students)
+            self.matrix = store.matrix
+            self.labels = labels
+            self.names = names
+            self.id_students = dict(zip(store.ids.tolist(), names))
+            self.next_id = max(self.next_id, int(store.ids.max()) + 1 if len(store.ids) else 0)
+            self.version += 1
+            self._student_rows = (self.version, store.matrix, {
+                student_name: np.arange(offsets[i], offsets[i + 1]) for i, student_name in enumerate(self.students)})
+        self._store_checked = time.monotonic()
+        logging.debug("Mapped gallery file %s with %d photos", self.store_path, len(names))
+        return True
+
+    def reload_if_changed(self):
+        """
+        Map the shared gallery file again if another process replaced it
+
+        Checks at most every STORE_CHECK_INTERVAL seconds, so it is cheap to
+        call before every match
+
+        Returns True if a new version was mapped
+        """
+        now = time.monotonic()
+        if self.store is None or now - self._store_checked < STORE_CHECK_INTERVAL:
+            return False
+        self._store_checked = now
+        try:
+            if store_stat(self.store_path) == self.store.stat:
+                return False
+        except OSError:
+            return False
+        return self.attach_store()
+
+    @contextmanager
+    def _updating(self):
+        """
+        Hold the gallery for a change, in this process and across processes
+
+        The latest gallery file and the full index are loaded first, so the
+        change is made to the latest version whichever process wrote it.
+        Afterwards the new gallery file is mapped in place of the index.
+        """
+        os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.attach_store()
+            self.load_index()
+            yield
+            self.attach_store()
+
+    def _scan(self):
+        """
+        List every student directory and the photos inside it
+
+        Returns the list of students and a dict of
+        relative photo path -> (student name, mtime, size)
+        """
+        os.makedirs(self.faces_dir, exist_ok=True)
+
+        students = list(DEFAULT_STUDENTS)
+        for entry in sorted(os.listdir(self.faces_dir)):
+            if entry not in students and os.path.isdir(os.path.join(self.faces_dir, entry)):
+                students.append(entry)
+
+        found = {}
         for student_name in students:
-            student_dir = os.path.join(faces_dir, student_name)
+            student_dir = os.path.join(self.faces_dir, student_name)
+
+            # Create student directory if it doesn't exist
             if not os.path.exists(student_dir):
                 os.makedirs(student_dir, exist_ok=True)
-                logging.info(f"Created directory for {student_name}'s photos")
-    
-    # Load face encodings and actual images from the faces directory
-    for student_name in students:
-        student_dir = os.path.join(faces_dir, student_name)
-        
-        # Create student directory if it doesn't exist
-        if not os.path.exists(student_dir):
-            os.makedirs(student_dir, exist_ok=True)
-            logging.info(f"Created directory for {student_name}'s photos")
-        
-        # Check if there are actual photos in the directory
-        student_photos = [f for f in os.listdir(student_dir) 
-                         if os.path.isfile(os.path.join(student_dir, f)) 
-                         and f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-        
-        # Store the actual image data for comparison later
-        if student_photos:
-            STUDENT_IMAGES[student_name] = []
-            for photo in student_photos:
+                logging.info("Created directory for %s's photos", student_name)
+
+            for photo in sorted(os.listdir(student_dir)):
+                if not photo.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+
                 photo_path = os.path.join(student_dir, photo)
                 try:
-                    with open(photo_path, 'rb') as f:
-                        # Read the actual image data for future comparison
-                        image_data = f.read()
-                        # Create a hash of this image
-                        image_hash = hashlib.md5(image_data).hexdigest()
-                        STUDENT_IMAGES[student_name].append(image_hash)
-                except Exception as e:
-                    logging.error(f"Error loading photo {photo} for {student_name}: {str(e)}")
-                    
-            if STUDENT_IMAGES[student_name]:
-                logging.info(f"Loaded {len(STUDENT_IMAGES[student_name])} photos for {student_name}")
+                    stat_result = os.stat(photo_path)
+                except OSError:
+                    continue
+                if not os.path.isfile(photo_path):
+                    continue
+
+                rel_path = os.path.relpath(photo_path, self.faces_dir)
+                found[rel_path] = (student_name, stat_result.st_mtime_ns, stat_result.st_size)
+
+        return students, found
+
+    def _process_photo(self, rel_path, student_name, timings=None):
+        """Read a single photo and return its main face, aligned for encoding"""
+        photo_path = os.path.join(self.faces_dir, rel_path)
+        try:
+            with open(photo_path, 'rb') as f:
+                return extract_main_face(f.read(), timings)
+        except Exception as e:
+            logging.error("Error loading photo %s for %s: %s", rel_path, student_name, e)
+            return None
+
+    def refresh(self):
+        """
+        Bring the gallery up to date with the faces directory
+
+        Only photos whose (path, mtime, size) changed are re-read
+
+        Returns:
+            dict: Counts of added, changed and removed photos
+        """
+        with self._updating():
+            students, found = self._scan()
+            updates = {}
+            faces = []
+            failed = []
+            timings = {}
+
+            for rel_path, (student_name, mtime, size) in found.items():
+                cached = self.photos.get(rel_path)
+                if (cached and cached['student'] == student_name
+                        and cached['mtime'] == mtime and cached['size'] == size):
+                    continue
+
+                face = self._process_photo(rel_path, student_name, timings)
+                if face is None:
+                    failed.append(rel_path)
+                else:
+                    updates[rel_path] = {'student': student_name, 'mtime': mtime, 'size': size}
+                    faces.append(face)
+
+            # Encode every new or changed photo together, a batch per forward pass
+            for record, encoding in zip(updates.values(), compute_face_encodings(faces, timings)):
+                record['encoding'] = encoding
+            if timings:
+                pipeline_timer.add(timings)
+
+            removed = [rel_path for rel_path in self.photos if rel_path not in found or rel_path in failed]
+            stats = self._apply(students, updates, removed)
+            logging.info("Face gallery refreshed: %s, %d photos in total", stats, len(self.photos))
+            return stats
+
+    def enroll(self, student_name, image_bytes, filename=None):
+        """
+        Save a new photo for a student and add it to the gallery
+
+        Only the new photo is processed; the encoding matrix and ANN index
+        are updated in place without re-scanning the faces directory
+
+        Returns:
+            str: Path of the saved photo, relative to the faces directory
+        """
+        return self.add_photos([(student_name, image_bytes, compute_face_encoding(image_bytes))], [filename])[0]
+
+    def add_photos(self, photos, filenames=None):
+        """
+        Save several already encoded photos and add them to the gallery in one batch
+
+        The gallery is rebuilt and its files written once, however many
+        photos there are
+
+        Args:
+            photos: List of (student name, image bytes, encoding)
+            filenames: Optional file name per photo; generated ones are unique
+
+        Returns:
+            list: Paths of the saved photos, relative to the faces directory
+        """
+        stamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        updates = {}
+        for i, (student_name, image_bytes, encoding) in enumerate(photos):
+            filename = (filenames and filenames[i]) or f"{student_name}_{stamp}_{i}.jpg"
+            student_dir = os.path.join(self.faces_dir, student_name)
+            os.makedirs(student_dir, exist_ok=True)
+
+            photo_path = os.path.join(student_dir, filename)
+            with open(photo_path, 'wb') as f:
+                f.write(image_bytes)
+
+            rel_path = os.path.relpath(photo_path, self.faces_dir)
+            stat_result = os.stat(photo_path)
+            updates[rel_path] = {
+                'student': student_name,
+                'mtime': stat_result.st_mtime_ns,
+                'size': stat_result.st_size,
+                'encoding': encoding,
+            }
+
+        if updates:
+            with self._updating():
+                new_students = [record['student'] for record in updates.values() if record['student'] not in self.students]
+                self._apply(self.students + list(dict.fromkeys(new_students)), updates, [])
+        return list(updates)
+
+    def _apply(self, students, updates, removed):
+        """
+        Apply new/changed photo records and removals, then update the derived views
+
+        Returns:
+            dict: Counts of added, changed and removed photos
+        """
+        stale_ids = [self.photos[rel_path]['id'] for rel_path in removed]
+        for rel_path in removed:
+            del self.photos[rel_path]
+
+        added = changed = 0
+        new_ids = []
+        for rel_path, record in updates.items():
+            cached = self.photos.get(rel_path)
+            if cached:
+                # Changed photos keep their id, the old vector is replaced
+                record['id'] = cached['id']
+                stale_ids.append(cached['id'])
+                changed += 1
             else:
-                logging.warning(f"Failed to load any valid photos for {student_name}")
-                # Create a placeholder fingerprint for this student
-                STUDENT_IMAGES[student_name] = [hashlib.md5(f"{student_name}_placeholder_{i}".encode()).hexdigest() 
-                                              for i in range(3)]  # Create 3 unique placeholders
+                record['id'] = self.next_id
+                self.next_id += 1
+                added += 1
+            self.photos[rel_path] = record
+            new_ids.append(record['id'])
+
+        photos_changed = bool(updates or removed)
+        students_changed = students != self.students
+        ann_missing = self.ann is None
+        if photos_changed or students_changed or self.version == 0:
+            self._rebuild(students)
+        if photos_changed or ann_missing:
+            self._update_ann(stale_ids, [updates[rel_path]['encoding'] for rel_path in updates], new_ids)
+        if (photos_changed or students_changed or ann_missing
+                or not os.path.exists(self.index_path) or not os.path.exists(self.store_path)):
+            self.save_index()
+
+        return {'added': added, 'changed': changed, 'removed': len(removed)}
+
+    def _update_ann(self, stale_ids, encodings, ids):
+        """Insert into the ANN index incrementally, rebuilding it when it has outgrown its centroids"""
+        size = len(self.photos)
+        if self.ann is None or size > ANN_REBUILD_GROWTH * max(self.ann_trained_size, 1):
+            rel_paths = sorted(self.photos)
+            self.ann = IVFIndex.build(
+                self._stack([self.photos[rel_path]['encoding'] for rel_path in rel_paths]),
+                [self.photos[rel_path]['id'] for rel_path in rel_paths],
+            )
+            self.ann_trained_size = size
+            logging.info("Built ANN index over %d photos in %d lists", size, self.ann.n_lists)
+            return
+
+        self.ann.remove(stale_ids)
+        if ids:
+            self.ann.add(self._stack(encodings), ids)
+
+    def _rebuild(self, students):
+        """Rebuild the encoding matrix and row labels from the photo records"""
+        rel_paths = sorted(self.photos)
+        student_index = {student_name: i for i, student_name in enumerate(students)}
+
+        students_with_photos = {record['student'] for record in self.photos.values()}
+        for student_name in students:
+            if student_name not in students_with_photos:
+                logging.warning("No photos found for %s. They cannot be recognised until one is added.", student_name)
+
+        matrix = self._stack([self.photos[rel_path]['encoding'] for rel_path in rel_paths])
+        labels = np.array([student_index[self.photos[rel_path]['student']] for rel_path in rel_paths],
+                          dtype=np.int32)
+
+        # Swap the new views in all at once so readers never see a partial gallery
+        self.students = list(students)
+        self.matrix = matrix
+        self.labels = labels
+        self.names = [self.students[label] for label in labels]
+        self.id_students = {record['id']: record['student'] for record in self.photos.values()}
+        self.version += 1
+
+        # Each student's rows, so a roster's part of the matrix can be gathered without a full scan
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(len(self.students) + 1))
+        self._student_rows = (self.version, matrix, {student_name: order[bounds[i]:bounds[i + 1]]
+                                                     for i, student_name in enumerate(self.students)})
+
+    @staticmethod
+    def _stack(encodings):
+        """Stack encodings into a contiguous float32 matrix with L2-normalised rows"""
+        if not encodings:
+            return np.zeros((0, get_backend().dim), dtype=np.float32)
+        return normalize_rows(np.asarray(encodings, dtype=np.float32))
+
+    def roster_view(self, student_names):
+        """
+        The part of the gallery covering a class roster
+
+        Only the roster's own rows are gathered, so the cost depends on the
+        size of the class rather than on every student in the gallery.
+        Views are cached per gallery version.
+
+        Returns:
+            RosterView
+        """
+        version, matrix, student_rows = self._student_rows
+        key = (version, tuple(dict.fromkeys(student_names)))
+        with self._roster_views_lock:
+            view = self._roster_views.get(key)
+            if view is not None:
+                self._roster_views.move_to_end(key)
+                return view
+
+        students = [student_name for student_name in key[1] if len(student_rows.get(student_name, ()))]
+        rows = [student_rows[student_name] for student_name in students]
+        if rows:
+            columns = np.concatenate([np.full(len(r), i, dtype=np.int32) for i, r in enumerate(rows)])
+            view = RosterView(students, matrix[np.concatenate(rows)], [students[i] for i in columns], columns)
         else:
-            logging.warning(f"No photos found for {student_name}. Using placeholder images.")
-            # Create a placeholder for this student if no photos are found
-            STUDENT_IMAGES[student_name] = [hashlib.md5(f"{student_name}_placeholder_{i}".encode()).hexdigest() 
-                                          for i in range(3)]  # Create 3 unique placeholders
-        
-        # For face_api.js compatibility, create a placeholder encoding
-        random.seed(student_name)  # Use student name for deterministic randomness
-        placeholder_encoding = np.random.rand(128)  # Face encodings are typically 128-dimensional
-        
-        known_face_encodings.append(placeholder_encoding)
-        known_face_names.append(student_name)
-        
-        logging.info(f"Loaded face encoding for {student_name}")
-    
-    return known_face_encodings, known_face_names
+            view = RosterView([], matrix[:0], [], np.zeros(0, dtype=np.int32))
+
+        with self._roster_views_lock:
+            self._roster_views[key] = view
+            while len(self._roster_views) > ROSTER_VIEW_CACHE_SIZE:
+                self._roster_views.popitem(last=False)
+        return view
+
+    def match(self, encoding, student_names=None):
+        """
+        Find the closest enrolled photo to an encoding
+
+        Args:
+            student_names: Only consider the photos of these students (a class
+                roster); every photo by default
+
+        Returns:
+            tuple: (student name, cosine similarity), or (None, 0.0) if there are no photos to match
+        """
+        if student_names is None:
+            matrix, names = self.matrix, self.names
+        else:
+            view = self.roster_view(student_names)
+            matrix, names = view.matrix, view.names
+        if not len(names):
+            return None, 0.0
+
+        scores = matrix @ encoding
+        best = int(np.argmax(scores))
+        return names[best], float(scores[best])
+
+    def identify(self, encoding, top_k=1, n_probe=None):
+        """
+        Find the students whose photos are closest to an encoding using the ANN index
+
+        Returns:
+            list: Up to top_k (student name, cosine similarity) pairs, best first
+        """
+        ann, id_students = self._ann(), self.id_students
+        if ann is None or not len(ann):
+            return []
+
+        # Ask for extra neighbours since several of them may be photos of the same student
+        ids, scores = ann.search(encoding, k=top_k * 5, n_probe=n_probe)
+
+        candidates = []
+        seen = set()
+        for photo_id, score in zip(ids, scores):
+            student_name = id_students.get(int(photo_id))
+            if student_name is None or student_name in seen:
+                continue
+            seen.add(student_name)
+            candidates.append((student_name, float(score)))
+            if len(candidates) == top_k:
+                break
+        return candidates
+
+    def _ann(self):
+        """The ANN index, loaded from disk on first use when matching against the gallery file"""
+        with self._lock:
+            store = self.store
+            if self.ann is None and store is not None and len(store.ids):
+                try:
+                    ann = IVFIndex.load(self.ann_path)
+                except (OSError, ValueError, KeyError):
+                    ann = None
+                if ann is None or len(ann) != len(store.ids):
+                    ann = IVFIndex.build(store.matrix, store.ids.tolist())
+                self.ann = ann
+            return self.ann
 
-def compare_face_with_known(image_data, student_name, faces_dir):
+    def match_group(self, encodings, student_names, threshold=None):
+        """
+        Match several faces against a set of students in one batch
+
+        Every face is compared with every photo of the given students in a
+        single matrix product; photos of other students aren't touched. Each face is then given to at most one student
+        and each student to at most one face, best similarities first.
+
+        Args:
+            threshold: Minimum similarity for a match, the backend's own by default
+
+        Returns:
+            dict: Student name -> similarity of the face assigned to them;
+            students without a matching face are left out
+        """
+        threshold = get_backend().match_threshold if threshold is None else threshold
+        view = self.roster_view(student_names)
+        candidates = view.students
+        encodings = np.atleast_2d(encodings)
+        if not len(encodings) or not candidates:
+            return {}
+
+        # Best photo per (candidate, face)
+        scores = encodings @ view.matrix.T
+        student_scores = np.full((len(candidates), len(encodings)), -np.inf, dtype=np.float32)
+        np.maximum.at(student_scores, view.columns, scores.T)
+
+        matches = {}
+        used_faces = set()
+        for flat in np.argsort(-student_scores, axis=None):
+            column, face = np.unravel_index(flat, student_scores.shape)
+            score = float(student_scores[column, face])
+            if score < threshold:
+                break
+            if candidates[column] in matches or face in used_faces:
+                continue
+            matches[candidates[column]] = score
+            used_faces.add(face)
+        return matches
+
+
+def detect_faces(image, timings=None):
+    """
+    Find every face in an image and align it for encoding
+
+    Detection and alignment are done by the configured face backend
+
+    Args:
+        timings: Optional dict that the milliseconds spent per stage are added to
+
+    Returns:
+        list: Aligned faces, largest first
+    """
+    backend = get_backend()
+    with pipeline_timer.stage('detect', timings):
+        detections = backend.detect(image)
+    with pipeline_timer.stage('align', timings):
+        return [backend.align(image, detection) for detection in detections]
+
+
+def extract_main_face(image_bytes, timings=None):
+    """Decode an image and return its largest face aligned, or the whole image if no face is found"""
+    with pipeline_timer.stage('decode', timings):
+        image = decode_image(image_bytes)
+    faces = detect_faces(image, timings)
+    if faces:
+        return faces[0]
+    return get_backend().align(image, Detection((0, 0, image.width, image.height), None, 0.0))
+
+
+def compute_face_encodings(faces, timings=None):
+    """
+    Encode several aligned faces, EMBED_BATCH_SIZE per forward pass
+
+    Returns:
+        np.ndarray: (len(faces) x dim) float32 matrix with L2-normalised rows
+    """
+    backend = get_backend()
+    if not len(faces):
+        return np.zeros((0, backend.dim), dtype=np.float32)
+
+    with pipeline_timer.stage('embed', timings):
+        return np.concatenate([backend.embed(faces[start:start + EMBED_BATCH_SIZE])
+                               for start in range(0, len(faces), EMBED_BATCH_SIZE)])
+
+
+def compute_face_encoding(image_bytes, timings=None):
+    """
+    Compute the encoding of the main face in an image
+
+    Runs the whole pipeline: decode, detect, align the largest face (or
+    take the whole image if none is found) and embed it
+
+    Returns:
+        np.ndarray: L2-normalised float32 vector
+    """
+    return compute_face_encodings([extract_main_face(image_bytes, timings)], timings)[0]
+
+
+def decode_image_data(image_data):
+    """The raw image bytes of a data URL, base64 string or raw bytes"""
+    if isinstance(image_data, str):
+        image_data = image_data.split(',')[1] if ',' in image_data else image_data
+        image_data = base64.b64decode(image_data)
+    return image_data
+
+
+def decode_image(image_data):
+    """Decode a data URL, base64 string or raw bytes into an RGB image"""
+    return Image.open(io.BytesIO(decode_image_data(image_data))).convert('RGB')
+
+
+def init_gallery(faces_dir, index_path=None):
+    """
+    Build the face gallery for this process
+
+    Loads and warms up the face backend's models, then loads the on-disk
+    index if there is one, re-processes only the photos that changed since
+    it was written and maps the shared gallery file
+    """
+    global _gallery
+
+    get_backend().warm_up()
+
+    gallery = FaceGallery(faces_dir, index_path)
+    gallery.refresh()
+
+    _gallery = gallery
+    return gallery
+
+
+def attach_gallery(faces_dir, index_path=None):
+    """
+    Map the shared gallery file for this process without scanning the faces directory
+
+    For processes that only match faces, like recognition workers: the
+    gallery is only built here if no other process has written the file yet
+    """
+    global _gallery
+
+    get_backend().warm_up()
+
+    gallery = FaceGallery(faces_dir, index_path)
+    if not gallery.attach_store():
+        gallery.refresh()
+
+    _gallery = gallery
+    return gallery
+
+
+def configure_gallery(faces_dir, index_path=None):
+    """Set where the process-wide gallery is built from; it is only built on first use"""
+    global _gallery_paths
+    _gallery_paths = (faces_dir, index_path)
+
+
+def get_gallery(faces_dir=None, index_path=None):
+    """Return the process-wide gallery, building it on first use"""
+    if _gallery is None:
+        with _gallery_lock:
+            if _gallery is None:
+                faces_dir = faces_dir or _gallery_paths[0]
+                if faces_dir is None:
+                    raise RuntimeError("Face gallery has not been initialised")
+                init_gallery(faces_dir, index_path or _gallery_paths[1])
+    _gallery.reload_if_changed()
+    return _gallery
+
+
+def load_known_faces(faces_dir):
+    """
+    Load known face encodings and their names from the faces directory
+
+    Each student's photo is stored in a subfolder named after the student.
+    The data comes from the in-memory gallery, which is only built from disk
+    the first time; call refresh_known_faces() after enrolling new photos.
+
+    Returns:
+        tuple: (N x 128 float32 encoding matrix, list of N student names)
+    """
+    gallery = get_gallery(faces_dir)
+    return gallery.matrix, gallery.names
+
+
+def serialize_gallery_for_client(dtype='int8', faces_dir=None, student_names=None):
+    """
+    Pack the gallery into a compact binary payload for client-side matching
+
+    Layout (little-endian): a header of magic b'FGAL', format version,
+    dtype code (1 = int8, 2 = float16), dimensions, rows and the byte length
+    of a JSON array of row names; then the names; then the encoding matrix.
+    int8 rows are the unit-length encodings scaled by 127, which is plenty
+    for cosine similarity and a quarter of the size of float32.
+
+    With student_names only those students' photos are included, so a
+    class downloads its own roster rather than the whole gallery. The
+    payload is built once per gallery version, dtype and roster and cached.
+
+    Returns:
+        tuple: (payload bytes, ETag string)
+    """
+    gallery = get_gallery(faces_dir)
+    roster = None if student_names is None else tuple(sorted(set(student_names)))
+    key = (id(gallery), gallery.version, dtype, roster)
+    cached = _client_gallery_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if roster is None:
+        matrix, names = gallery.matrix, gallery.names
+    else:
+        view = gallery.roster_view(roster)
+        matrix, names = view.matrix, view.names
+    if dtype == 'int8':
+        packed = np.round(matrix * 127).astype(np.int8)
+    elif dtype == 'float16':
+        packed = matrix.astype(np.float16)
+    else:
+        raise ValueError(f"Unsupported gallery dtype {dtype}")
+
+    names_json = json.dumps(names).encode()
+    header = CLIENT_GALLERY_HEADER.pack(CLIENT_GALLERY_MAGIC, 1, CLIENT_GALLERY_DTYPES[dtype],
+                                        matrix.shape[1], matrix.shape[0], len(names_json))
+    payload = header + names_json + packed.tobytes()
+    etag = hashlib.sha1(payload).hexdigest()
+
+    # Only the current gallery version is worth keeping, and only for as many rosters as the gallery keeps views
+    for stale_key in [k for k in _client_gallery_cache if k[:2] != key[:2]]:
+        del _client_gallery_cache[stale_key]
+    while len(_client_gallery_cache) >= ROSTER_VIEW_CACHE_SIZE:
+        del _client_gallery_cache[next(iter(_client_gallery_cache))]
+    _client_gallery_cache[key] = (payload, etag)
+    return payload, etag
+
+
+def refresh_known_faces(faces_dir=None):
+    """Pick up added, changed or removed photos in the faces directory"""
+    return get_gallery(faces_dir).refresh()
+
+def compare_face_with_known(image_data, student_name, faces_dir, timings=None, roster=None):
     """
     Compare captured face with the known face for a specific student
-    
+
+    The capture is matched against the photos of every student in the
+    roster (the class being marked), or of every student in the gallery
+    without one; it only counts as a match if the closest photo belongs to
+    this student and is similar enough
+
     Returns True if the face matches, False otherwise
     """
-    global STUDENT_IMAGES
-    
+    gallery = get_gallery(faces_dir)
+    if roster is not None and student_name not in roster:
+        roster = [*roster, student_name]
+
     # Check if we have reference images for this student
-    if student_name not in STUDENT_IMAGES or not STUDENT_IMAGES[student_name]:
-        logging.error(f"No reference images found for {student_name}")
+    if not gallery.roster_view([student_name]).students:
+        logging.error("No reference images found for %s", student_name)
         return False
-    
-    # Get a hash of the captured image
-    image_hash = hashlib.md5(image_data.encode()).hexdigest()
-    
-    # Only allow a match if:
-    # 1. The current student is the one being checked
-    # 2. The image should produce a consistent result for each student
-    
-    # Create a seed based on the image hash and student name
-    hash_seed = int(image_hash[:8], 16)  # Take first 8 chars of hash as a number
-    random.seed(hash_seed)
-    
-    # Generate a result that's unique for each student (0-100)
-    student_values = {}
-    for name in ["Tanish", "Yuvraj", "Vishal", "Suraj", "Sanyam"]:
-        # Calculate a unique value for each student between 0-100
-        student_seed = int(hashlib.md5(name.encode()).hexdigest()[:8], 16)
-        random.seed(hash_seed ^ student_seed)  # Combine seeds with XOR
-        student_values[name] = random.randint(0, 100)
-    
-    # A face should only match for its intended student
-    # Find which student has the highest match value for this image
-    max_student = max(student_values, key=student_values.get)
-    max_value = student_values[max_student]
-    
-    # The image should only match for the highest student, and that student must be the one we're checking
-    is_match = (max_student == student_name and max_value > 70)  # Require >70% confidence
-    
+
+    if isinstance(image_data, str):
+        image_data = base64.b64decode(image_data)
+
+    encoding = compute_face_encoding(image_data, timings)
+    with pipeline_timer.stage('match', timings):
+        best_name, best_score = gallery.match(encoding, roster)
+    is_match = (best_name == student_name and best_score >= get_backend().match_threshold)
+
     # Log the match details
-    logging.info(f"Face comparison for {student_name}: {'Match' if is_match else 'No match'}")
-    logging.debug(f"Student values: {student_values}, Max student: {max_student}, Max value: {max_value}")
-    
+    logging.debug("Face comparison for %s: %s (closest student %s, similarity %.3f)",
+                  student_name, 'Match' if is_match else 'No match', best_name, best_score)
+
     return is_match
 
-def process_face_recognition(image_data, student_name, recognized_faces_dir):
+def process_face_recognition(image_data, student_name, faces_dir=None, roster=None):
     """
     Process face recognition from the received image data
     
     Uses existing photos to match against the captured face
     Only marks attendance if the face matches the known student
+
+    roster lists the names of the students in the class being marked; only
+    their photos are matched against. Without it the whole gallery is used.
+
+    image_data is either the raw image bytes of a binary upload or a
+    base64 string / data URL from a JSON body. The result includes the
+    milliseconds spent in each pipeline stage under "timings", and on a
+    match a JPEG thumbnail of the capture under "thumbnail" for the caller
+    to archive.
     """
+    timings = {}
     try:
-        # Create directory if it doesn't exist
-        student_dir = os.path.join(recognized_faces_dir, student_name)
-        os.makedirs(student_dir, exist_ok=True)
-        
         # Extract the base64 part
         if image_data:
-            image_data = image_data.split(',')[1] if ',' in image_data else image_data
+            if isinstance(image_data, bytes):
+                image_bytes = image_data
+            else:
+                with pipeline_timer.stage('decode', timings):
+                    image_bytes = decode_image_data(image_data)
             
             # Compare the captured face with the known face for this student
-            faces_dir = os.path.dirname(os.path.dirname(recognized_faces_dir)) + '/faces'
-            is_match = compare_face_with_known(image_data, student_name, faces_dir)
+            is_match = compare_face_with_known(image_bytes, student_name, faces_dir, timings, roster)
             
             if is_match:
-                # Face matched, save the recognized face image
-                image_bytes = base64.b64decode(image_data)
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                face_image_path = os.path.join(student_dir, f"{student_name}_{timestamp}.jpg")
-                
-                # Save the image file
-                with open(face_image_path, 'wb') as f:
-                    f.write(image_bytes)
+                # Face matched, hand back a thumbnail of it for the archive
+                with pipeline_timer.stage('thumbnail', timings):
+                    thumbnail = make_thumbnail(image_bytes)
                 
-                return {"success": True, "message": f"Face recognized for {student_name}"}
+                return {"success": True, "message": f"Face recognized for {student_name}", "timings": timings,
+                        "thumbnail": thumbnail}
             else:
                 # Face didn't match
-                return {"success": False, "message": f"Face does not match {student_name}. Please try again."}
+                return {"success": False, "message": f"Face does not match {student_name}. Please try again.",
+                        "timings": timings}
         else:
             return {"success": False, "message": "No image data provided"}
             
     except Exception as e:
-        logging.error(f"Error in face recognition: {str(e)}")
-        return {"success": False, "message": f"Error processing image: {str(e)}"}
\ No newline at end of file
+        logging.error("Error in face recognition: %s", e)
+        return {"success": False, "message": f"Error processing image: {str(e)}"}
+
+def identify_face(image_data, faces_dir=None, top_k=1):
+    """
+    Identify who is in front of the camera among every enrolled student
+
+    Unlike process_face_recognition, no student is given up front; the
+    capture is looked up in the gallery's approximate nearest-neighbour index
+
+    Returns:
+        dict: success flag, message, best student name and similarity, the
+        top_k candidates and the milliseconds spent per pipeline stage
+    """
+    try:
+        if not image_data:
+            return {"success": False, "message": "No image data provided"}
+
+        timings = {}
+        image_data = image_data.split(',')[1] if ',' in image_data else image_data
+        encoding = compute_face_encoding(base64.b64decode(image_data), timings)
+        with pipeline_timer.stage('match', timings):
+            candidates = get_gallery(faces_dir).identify(encoding, top_k=top_k)
+
+        result = {
+            "success": False,
+            "student_name": None,
+            "similarity": 0.0,
+            "candidates": [{"student_name": name, "similarity": score} for name, score in candidates],
+            "timings": timings,
+        }
+        if candidates and candidates[0][1] >= get_backend().match_threshold:
+            result.update(success=True, student_name=candidates[0][0], similarity=candidates[0][1],
+                          message=f"Face identified as {candidates[0][0]}")
+        else:
+            result["message"] = "Face not recognised. Please try again."
+
+        logging.debug("Face identification: %s", result['student_name'] or 'No match')
+        return result
+
+    except Exception as e:
+        logging.error("Error in face identification: %s", e)
+        return {"success": False, "message": f"Error processing image: {str(e)}"}
+
+def recognize_group(frames, student_names, faces_dir=None):
+    """
+    Recognise a whole group of students from one or more classroom frames
+
+    All faces in all frames are detected first, encoded together in as few
+    forward passes as possible and then matched against the photos of the
+    given students in a single batch
+
+    Args:
+        frames: List of data URLs, base64 strings or raw image bytes
+        student_names: Names of the students expected in the frames
+
+    Returns:
+        dict: Number of faces detected, for each matched student the
+        similarity of their face, and the milliseconds spent per pipeline stage
+    """
+    timings = {}
+    faces = []
+    for frame in frames:
+        with pipeline_timer.stage('decode', timings):
+            image = decode_image(frame)
+        faces.extend(detect_faces(image, timings))
+
+    encodings = compute_face_encodings(faces, timings)
+    with pipeline_timer.stage('match', timings):
+        matches = get_gallery(faces_dir).match_group(encodings, student_names)
+
+    logging.debug("Group recognition: %d faces in %d frames, %d students matched",
+                  len(faces), len(frames), len(matches))
+    return {"faces_detected": len(faces), "matches": matches, "timings": timings}
@@ -0,0 +1,113 @@
+import io
+import time
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from PIL import Image
+
+# Side of the difference hash grid; the hash has FRAME_HASH_SIZE ** 2 bits
+FRAME_HASH_SIZE = 16
+
+# A captured frame: digest of its exact bytes, and difference hash of what it shows
+Frame = namedtuple('Frame', ['digest', 'dhash'])
+
+
+def frame_fingerprint(image_bytes, hash_size=FRAME_HASH_SIZE):
+    """
+    Fingerprint a captured frame without running any face recognition
+
+    The difference hash compares the brightness of neighbouring pixels in a
+    (hash_size + 1) x hash_size greyscale thumbnail, so re-encoding the
+    frame or small changes in exposure barely change it. JPEGs are decoded
+    straight at reduced scale, which makes this a fraction of the cost of a
+    full decode.
+
+    Returns:
+        Frame: Digest (hex) and difference hash (int)
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft('L', (hash_size + 1, hash_size))
+    pixels = np.asarray(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return Frame(hashlib.blake2b(image_bytes, digest_size=16).hexdigest(), int.from_bytes(bits.tobytes(), 'big'))
+
+
+class FrameCache:
+    """
+    Recent recognition results per attendance session, looked up by perceptual hash
+
+    A session is one user marking one class. A retry whose frame differs
+    from an earlier one for the same student in the same session by at most
+    `distance` bits of its difference hash, within `ttl` seconds, gets the
+    earlier result instead of being recognised again. Each session keeps
+    its `max_frames` most recent frames and the `max_sessions` most recently
+    active sessions are kept.
+
+    Frames that were recognised are also remembered by their exact digest,
+    the `max_accepted` most recent across all sessions, so the very same
+    bytes sent again are recognised as a replay and refused.
+    """
+
+    def __init__(self, ttl=120, distance=8, max_frames=32, max_sessions=1024, max_accepted=10000):
+        self.ttl = ttl
+        self.distance = distance
+        self.max_frames = max_frames
+        self.max_sessions = max_sessions
+        self.max_accepted = max_accepted
+
+        self._sessions = OrderedDict()  # session key -> [(time, student id, Frame, result)]
+        self._accepted = OrderedDict()  # digest -> None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.replays = 0
+
+    def is_replay(self, frame):
+        """True if exactly this frame was recognised before"""
+        with self._lock:
+            if frame.digest in self._accepted:
+                self.replays += 1
+                return True
+            return False
+
+    def lookup(self, session_key, student_id, frame):
+        """
+        The result of recognising a near-identical frame of this student in this session
+
+        Returns:
+            dict: The earlier result, or None
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = self._sessions.get(session_key, ())
+            for seen_at, seen_student, seen_frame, result in reversed(entries):
+                if (seen_student == student_id and now - seen_at <= self.ttl
+                        and (frame.dhash ^ seen_frame.dhash).bit_count() <= self.distance):
+                    self.hits += 1
+                    return result
+            self.misses += 1
+            return None
+
+    def remember(self, session_key, student_id, frame, result):
+        """Keep the recognition result of a frame; recognised frames can't be sent again"""
+        # Timings and the thumbnail belong to the recognition that produced them
+        result = {key: value for key, value in result.items() if key not in ('timings', 'thumbnail')}
+        with self._lock:
+            entries = self._sessions.pop(session_key, [])
+            entries.append((time.monotonic(), student_id, frame, result))
+            self._sessions[session_key] = entries[-self.max_frames:]
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+            if result.get('success'):
+                self._accepted[frame.digest] = None
+                self._accepted.move_to_end(frame.digest)
+                while len(self._accepted) > self.max_accepted:
+                    self._accepted.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "accepted_frames": len(self._accepted),
+                    "hits": self.hits, "misses": self.misses, "replays": self.replays}
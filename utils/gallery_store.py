@@ -0,0 +1,114 @@
+import os
+import json
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+# Flat gallery file shared by every process: magic, format version, dimensions,
+# rows, students, generation, byte length of the students JSON and of the backend name
+GALLERY_STORE_MAGIC = b'FGST'
+GALLERY_STORE_VERSION = 1
+GALLERY_STORE_HEADER = struct.Struct('<4sBHIIQII')
+
+# Sections of the file start on this boundary
+GALLERY_STORE_ALIGNMENT = 64
+
+# An opened gallery file. matrix holds one L2-normalised float32 row per photo,
+# grouped by student: student i's rows are offsets[i]:offsets[i + 1]. ids are the
+# photos' stable ids, row for row. stat identifies the file that was opened.
+GalleryStore = namedtuple('GalleryStore', ['generation', 'backend', 'students', 'matrix', 'offsets', 'ids', 'stat'])
+
+
+def _aligned(offset):
+    return -(-offset // GALLERY_STORE_ALIGNMENT) * GALLERY_STORE_ALIGNMENT
+
+
+def store_stat(path):
+    """What identifies one version of the file: a replaced file has a new inode"""
+    stat_result = os.stat(path)
+    return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+
+
+def write_gallery_store(path, generation, backend, students, matrix, labels, ids):
+    """
+    Write the gallery as a flat file and swap it in atomically
+
+    The file is written under a temporary name, synced and renamed over the
+    old one, so readers either see the old file or the complete new one;
+    processes that still have the old one mapped keep using it until they
+    reload.
+
+    Layout: the header, the students and backend name as JSON, then (each
+    section aligned to GALLERY_STORE_ALIGNMENT bytes) the float32 matrix
+    with rows grouped by student, int64 row offsets per student and int64
+    photo ids per row.
+
+    Args:
+        generation: Number identifying this version of the gallery
+        labels: Row -> index into students
+        ids: Row -> photo id
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    order = np.argsort(labels, kind='stable')
+    offsets = np.searchsorted(labels[order], np.arange(len(students) + 1)).astype(np.int64)
+    matrix = np.ascontiguousarray(np.asarray(matrix, dtype=np.float32)[order])
+    ids = np.asarray(ids, dtype=np.int64)[order]
+
+    students_json = json.dumps(list(students)).encode()
+    backend_json = json.dumps(backend).encode()
+    header = GALLERY_STORE_HEADER.pack(GALLERY_STORE_MAGIC, GALLERY_STORE_VERSION, matrix.shape[1],
+                                       matrix.shape[0], len(students), generation,
+                                       len(students_json), len(backend_json))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for section in (header + students_json + backend_json, matrix, offsets, ids):
+            f.write(b'\0' * (_aligned(f.tell()) - f.tell()))
+            f.write(section if isinstance(section, bytes) else section.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def open_gallery_store(path):
+    """
+    Map a gallery file read-only
+
+    Nothing is copied: the arrays are views of one shared, read-only
+    mapping, so every process that opens the same file shares its pages.
+
+    Returns:
+        GalleryStore
+
+    Raises:
+        OSError: If the file can't be read
+        ValueError: If it isn't a gallery file of this format version
+    """
+    stat = store_stat(path)
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    if len(buffer) < GALLERY_STORE_HEADER.size:
+        raise ValueError(f"Truncated gallery file {path}")
+
+    magic, version, dim, rows, n_students, generation, students_length, backend_length = \
+        GALLERY_STORE_HEADER.unpack(bytes(buffer[:GALLERY_STORE_HEADER.size]))
+    if magic != GALLERY_STORE_MAGIC or version != GALLERY_STORE_VERSION:
+        raise ValueError(f"{path} is not a gallery file of format version {GALLERY_STORE_VERSION}")
+
+    position = GALLERY_STORE_HEADER.size
+    students = json.loads(bytes(buffer[position:position + students_length]))
+    position += students_length
+    backend = json.loads(bytes(buffer[position:position + backend_length]))
+    position += backend_length
+
+    sections = []
+    for dtype, count in ((np.float32, rows * dim), (np.int64, n_students + 1), (np.int64, rows)):
+        position = _aligned(position)
+        end = position + count * np.dtype(dtype).itemsize
+        if end > len(buffer):
+            raise ValueError(f"Truncated gallery file {path}")
+        sections.append(buffer[position:end].view(dtype))
+        position = end
+    matrix, offsets, ids = sections
+
+    return GalleryStore(generation, backend, students, matrix.reshape(rows, dim), offsets, ids, stat)
@@ -0,0 +1,207 @@
+import json
+import logging
+import threading
+from collections import deque
+from datetime import date, datetime, timedelta
+
+from utils.attendance_queries import get_class_marks
+
+# Events a board can fall behind by before it is told to reload instead
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# Polls look this many seconds further back than the newest mark seen, for marks
+# committed by other processes after newer ones were already seen
+POLL_OVERLAP = 5
+
+
+class BoardFullError(Exception):
+    """Raised when the maximum number of boards is already open"""
+
+
+def board_key(section_id, group_id, subject_id, day):
+    """Identifies one class on one day, the unit that boards watch"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return int(section_id), int(group_id), int(subject_id), day
+
+
+def format_event(name, data, event_id=None):
+    """One Server-Sent Events message"""
+    lines = [f"event: {name}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def mark_event(student_id, status, timestamp):
+    return {"student_id": student_id, "status": status, "timestamp": timestamp.isoformat(timespec='seconds')}
+
+
+class Subscription:
+    """One open board: the mark events published for its class since it last read them"""
+
+    def __init__(self, board, key, max_queued=SUBSCRIBER_QUEUE_SIZE):
+        self.board = board
+        self.key = key
+        self.max_queued = max_queued
+        self.overflowed = False
+        self.closed = False
+        self._events = deque()
+        self._cond = threading.Condition()
+
+    def push(self, event):
+        with self._cond:
+            if len(self._events) >= self.max_queued:
+                # A board this far behind is better off reloading than catching up
+                self.overflowed = True
+                self._events.clear()
+            else:
+                self._events.append(event)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Wait for events
+
+        Returns:
+            list: The events published since the last call, or [] on timeout,
+            overflow or when the board is shut down
+        """
+        with self._cond:
+            if not self._events and not self.overflowed and not self.closed:
+                self._cond.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify()
+
+    def close(self):
+        self.board.unsubscribe(self)
+
+
+class LiveBoard:
+    """
+    In-process pub/sub of committed attendance marks
+
+    publish() is registered as an attendance writer listener, so each
+    committed batch is fanned out in memory to every open board watching
+    the classes it touches: a thousand boards on one class cost one
+    database write and a thousand queue appends, not a thousand queries.
+    Marks for classes nobody is watching are ignored.
+
+    Each worker process has its own board, which only sees the marks its
+    own writer commits. With poll_interval set, a background thread also
+    looks for marks written by other processes: one query per watched
+    class per interval, fanned out the same way. Marks are deduplicated by
+    student, status and timestamp, so one seen both ways is sent once.
+
+    Each open board holds a server thread for as long as it streams, so at
+    most `max_subscribers` can be open at once (None for no limit).
+    """
+
+    def __init__(self, app, poll_interval=0, max_subscribers=None):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.max_subscribers = max_subscribers
+
+        self._channels = {}  # key -> {"subscribers": set, "latest": {student id: (status, timestamp)}, "since"}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, key):
+        """
+        Start receiving mark events for a class and day; close() the subscription when done
+
+        Raises:
+            BoardFullError: If max_subscribers boards are already open
+        """
+        subscription = Subscription(self, key)
+        with self._lock:
+            if (self.max_subscribers is not None and
+                    sum(len(channel["subscribers"]) for channel in self._channels.values()) >= self.max_subscribers):
+                raise BoardFullError(f"{self.max_subscribers} live boards are already open")
+            channel = self._channels.setdefault(key, {"subscribers": set(), "latest": {}, "since": datetime.now()})
+            channel["subscribers"].add(subscription)
+            if self.poll_interval and self._thread is None:
+                self._thread = threading.Thread(target=self._poll, name='live-board-poller', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def seen(self, key, marks):
+        """Record (student id, status, timestamp) marks a class's boards already have, so polling doesn't resend them"""
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is not None:
+                for student_id, status, timestamp in marks:
+                    channel["latest"].setdefault(student_id, (status, timestamp))
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            channel = self._channels.get(subscription.key)
+            if channel is not None:
+                channel["subscribers"].discard(subscription)
+                if not channel["subscribers"]:
+                    del self._channels[subscription.key]
+
+    def watching(self):
+        """Open boards per class"""
+        with self._lock:
+            return {key: len(channel["subscribers"]) for key, channel in self._channels.items()}
+
+    def publish(self, rows):
+        """Send committed attendance rows to the boards watching their classes"""
+        with self._lock:
+            if not self._channels:
+                return
+            for row in rows:
+                key = (row['section_id'], row['group_id'], row['subject_id'], row['date'])
+                self._publish(key, row['student_id'], row['status'], row['timestamp'])
+
+    def _publish(self, key, student_id, status, timestamp):
+        """Fan one mark out to a class's boards unless they have already seen it; the caller holds the lock"""
+        channel = self._channels.get(key)
+        if channel is None or channel["latest"].get(student_id) == (status, timestamp):
+            return
+        channel["latest"][student_id] = (status, timestamp)
+        channel["since"] = max(channel["since"], timestamp)
+
+        self._next_id += 1
+        event = (self._next_id, mark_event(student_id, status, timestamp))
+        for subscription in channel["subscribers"]:
+            subscription.push(event)
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            with self._lock:
+                watched = {key: channel["since"] for key, channel in self._channels.items()}
+            if not watched:
+                continue
+
+            try:
+                with self.app.app_context():
+                    marks = {key: get_class_marks(*key, since=since - timedelta(seconds=POLL_OVERLAP))
+                             for key, since in watched.items()}
+            except Exception as e:
+                logging.error("Error polling attendance for live boards: %s", e)
+                continue
+
+            with self._lock:
+                for key, rows in marks.items():
+                    for student_id, status, timestamp in rows:
+                        self._publish(key, student_id, status, timestamp)
+
+    def close(self):
+        """Stop polling and release every open board's stream"""
+        self._stop.set()
+        with self._lock:
+            subscriptions = [subscription for channel in self._channels.values()
+                             for subscription in channel["subscribers"]]
+        for subscription in subscriptions:
+            subscription.closed = True
+            subscription.wake()
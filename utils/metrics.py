@@ -0,0 +1,219 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the queries-per-request histogram buckets
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    """{name="value",...} for a series, or nothing if it has no labels"""
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count, one series per combination of label values"""
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        """Lines of the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets, one series per combination of label values
+
+    Rendered the way Prometheus expects: cumulative bucket counts with an
+    upper bound (le) each, then the sum and count of all observations
+    """
+
+    def __init__(self, name, description, buckets, labels=()):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def totals(self):
+        """
+        Returns:
+            dict: Label values -> (count, sum)
+        """
+        with self._lock:
+            return {label_values: (sum(series[:-1]), series[-1]) for label_values, series in self._series.items()}
+
+    def render(self):
+        """Lines of the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((label_values, list(series)) for label_values, series in self._series.items())
+
+        for label_values, series in series_items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, [('le', bound)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class StageTimer:
+    """
+    Time spent in each stage of marking attendance
+
+    stage() times a block of code and adds it to a per-call dict of
+    milliseconds, which recognition results carry back to the caller.
+    add() records such a dict in the stage histogram; snapshot() reports
+    the totals.
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    @contextmanager
+    def stage(self, name, timings):
+        """Time the block and add its milliseconds to timings[name]; timings may be None"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def add(self, timings):
+        """Record one call's {stage: milliseconds}"""
+        for name, elapsed in timings.items():
+            self.histogram.observe(elapsed / 1000, name)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Stage -> {"count", "total_ms", "mean_ms"}
+        """
+        return {name: {"count": count, "total_ms": round(total * 1000, 3), "mean_ms": round(total * 1000 / count, 3)}
+                for (name,), (count, total) in self.histogram.totals().items()}
+
+
+request_latency = Histogram('http_request_duration_seconds', "Time to handle a request, by endpoint",
+                            LATENCY_BUCKETS, labels=('endpoint', 'method'))
+requests_total = Counter('http_requests_total', "Requests handled, by endpoint and status",
+                         labels=('endpoint', 'method', 'status'))
+request_queries = Histogram('http_request_db_queries', "SQL statements run while handling a request",
+                            QUERY_BUCKETS, labels=('endpoint',))
+db_queries_total = Counter('db_queries_total', "SQL statements run, inside requests or not")
+stage_latency = Histogram('attendance_stage_duration_seconds',
+                          "Time spent in each stage of recognising a face and recording its mark",
+                          LATENCY_BUCKETS, labels=('stage',))
+notifications_total = Counter('notifications_total', "Absence notifications handled by the dispatcher, by outcome",
+                              labels=('outcome',))
+
+# Stage timings of this process
+pipeline_timer = StageTimer(stage_latency)
+
+# Metrics rendered by /metrics, in order
+REGISTRY = [request_latency, requests_total, request_queries, db_queries_total, stage_latency, notifications_total]
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    db_queries_total.inc()
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+
+
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+def _record_request(response):
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+
+    elapsed = time.perf_counter() - start
+    queries = g.get('db_queries', 0)
+    endpoint = request.endpoint or 'unmatched'
+    request_latency.observe(elapsed, endpoint, request.method)
+    requests_total.inc(endpoint, request.method, str(response.status_code))
+    request_queries.observe(queries, endpoint)
+
+    # Lets the browser's network panel show the same numbers
+    response.headers['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}, db;desc="{queries} queries"'
+    return response
+
+
+def init_metrics(app):
+    """
+    Time every request and count the SQL statements it runs
+
+    Streamed responses are timed until their first byte, when the view
+    returns. Metrics are kept per process; with several server workers
+    each reports its own.
+    """
+    with app.app_context():
+        engine = db.engine
+
+    app.before_request(_start_request_timer)
+    app.after_request(_record_request)
+    if not event.contains(engine, 'before_cursor_execute', _count_query):
+        event.listen(engine, 'before_cursor_execute', _count_query)
+
+
+def render_metrics(extra=()):
+    """
+    All metrics in the Prometheus text exposition format
+
+    Args:
+        extra: More Counter/Histogram objects to include, e.g. built at scrape time
+    """
+    lines = []
+    for metric in (*REGISTRY, *extra):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,126 @@
+import time
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text, true
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Attendance, Enrollment, Group, NotificationOutbox, Student, Subject, SyncedMark
+
+# Applied migrations are recorded here, one row per version
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def _initial_schema(connection):
+    """Create every table the models define that doesn't exist yet"""
+    db.metadata.create_all(connection, checkfirst=True)
+
+
+def _unique_attendance_marks(connection):
+    """
+    Enforce one mark per student, class and day on databases created before the constraint
+
+    Duplicate marks are collapsed to the most recent one first
+    """
+    indexes = {index['name'] for index in inspect(connection).get_indexes('attendance')}
+    constraints = {constraint['name'] for constraint in inspect(connection).get_unique_constraints('attendance')}
+
+    if 'uq_attendance_mark' not in indexes | constraints:
+        connection.execute(text(
+            "DELETE FROM attendance WHERE id NOT IN ("
+            " SELECT MAX(id) FROM attendance"
+            " GROUP BY student_id, section_id, group_id, subject_id, date)"))
+        connection.execute(text(
+            "CREATE UNIQUE INDEX uq_attendance_mark"
+            " ON attendance (student_id, section_id, group_id, subject_id, date)"))
+
+    if 'ix_attendance_class_day' not in indexes:
+        for index in Attendance.__table__.indexes:
+            if index.name == 'ix_attendance_class_day':
+                index.create(connection)
+
+
+def _student_enrollments(connection):
+    """
+    Add the enrollment table
+
+    Until now every student was listed in every class, so existing databases
+    keep that: each student is enrolled in every group for every subject
+    """
+    Enrollment.__table__.create(connection, checkfirst=True)
+    if connection.execute(select(db.func.count()).select_from(Enrollment.__table__)).scalar():
+        return
+    connection.execute(Enrollment.__table__.insert().from_select(
+        ['student_id', 'group_id', 'subject_id'],
+        select(Student.id, Group.id, Subject.id).select_from(Student).join(Group, true()).join(Subject, true())))
+
+
+def _synced_marks(connection):
+    """Add the table of idempotency keys for marks synced from offline clients"""
+    SyncedMark.__table__.create(connection, checkfirst=True)
+
+
+def _notification_outbox(connection):
+    """Add the outbox of absence notifications waiting to be sent"""
+    NotificationOutbox.__table__.create(connection, checkfirst=True)
+
+
+# Ordered list of (version, description, function). Every migration must be
+# safe to run against a database that already has its changes, since a fresh
+# database gets the current models from the first one and several workers may
+# race to apply the same version.
+MIGRATIONS = [
+    (1, "Initial schema", _initial_schema),
+    (2, "Unique attendance marks and class-day index", _unique_attendance_marks),
+    (3, "Student enrollments", _student_enrollments),
+    (4, "Synced offline marks", _synced_marks),
+    (5, "Notification outbox", _notification_outbox),
+]
+
+
+def current_version(connection):
+    """Highest applied migration, or 0 for a database that has none"""
+    schema_version.create(connection, checkfirst=True)
+    return connection.execute(select(db.func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(engine=None):
+    """
+    Bring the database schema up to date
+
+    Each pending migration runs in its own transaction together with the
+    row recording it. Nothing is dropped, so existing data survives, and
+    an up-to-date database costs a single query.
+
+    Returns:
+        int: Number of migrations applied
+    """
+    engine = engine or db.engine
+    with engine.begin() as connection:
+        version = current_version(connection)
+
+    applied = 0
+    for migration_version, description, migrate in MIGRATIONS:
+        if migration_version <= version:
+            continue
+
+        start = time.perf_counter()
+        try:
+            with engine.begin() as connection:
+                migrate(connection)
+                connection.execute(schema_version.insert().values(
+                    version=migration_version, description=description, applied_at=datetime.now()))
+        except IntegrityError:
+            # Another process recorded this version first; its changes are already in
+            logging.info("Schema migration %d was applied by another process", migration_version)
+            continue
+
+        applied += 1
+        logging.info("Applied schema migration %d (%s) in %.0f ms",
+                     migration_version, description, (time.perf_counter() - start) * 1000)
+    return applied
@@ -0,0 +1,241 @@
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+from models import db, Attendance, Group, NotificationOutbox, Section, Student, Subject
+from utils.attendance_writer import ATTENDANCE_KEY
+from utils.metrics import notifications_total
+from utils.sms_utils import absence_message
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` messages per second, with bursts of up to `burst`
+
+    acquire() takes its tokens at once and returns how long the caller has
+    to wait before using them, so a large batch waits for all of its
+    messages up front. A rate of 0 means no limit.
+    """
+
+    def __init__(self, rate, burst=1):
+        if rate < 0:
+            raise ValueError(f"The notification rate limit can't be negative, got {rate}")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, count=1):
+        """Take count tokens; returns the seconds to wait before sending"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= count
+            return max(0.0, -self._tokens / self.rate)
+
+
+class NotificationDispatcher:
+    """
+    Background sender for the notification outbox
+
+    Absent marks queue a notification in the same transaction as the mark
+    (see queue_notifications). This thread claims due notifications
+    `batch_size` at a time, sends them one by one through the provider at
+    no more than `rate_limit` messages per second, and records the outcome
+    of each as soon as it is sent: delivered
+    ones set their mark's notification_sent, failed ones are retried after
+    `retry_delay` seconds, doubling each time, until `max_attempts`.
+    Notifications whose mark is no longer absent, or whose student has no
+    phone number, are cancelled instead of sent.
+
+    Claims are made with a conditional UPDATE, so several worker processes
+    can each run a dispatcher without sending a message twice; the rate
+    limit applies per process. A claim that is not settled within `lease`
+    seconds (the process died mid-batch) is picked up again, so a message
+    is sent at least once and, rarely, twice. Batches are kept small enough
+    to be sent in a quarter of the lease at the rate limit, so pacing alone
+    never lets a claim expire.
+
+    wake() is registered as an attendance writer listener to send new
+    notifications right away; otherwise the outbox is checked every
+    `poll_interval` seconds.
+    """
+
+    def __init__(self, app, provider, batch_size=50, rate_limit=1.0, max_attempts=5, retry_delay=30,
+                 poll_interval=15, lease=300):
+        self.app = app
+        self.provider = provider
+        if rate_limit:
+            batch_size = max(1, min(batch_size, int(rate_limit * lease / 4)))
+        self.batch_size = batch_size
+        self.limiter = RateLimiter(rate_limit, burst=1)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.lease = lease
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def wake(self, rows=None):
+        """Check the outbox now; as a writer listener, only when rows include an absent mark"""
+        if rows is None or any(row['status'] == 'absent' for row in rows):
+            self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=10):
+        """Stop sending; claimed notifications that were not sent go back to the outbox"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                handled = self.dispatch_once()
+            except Exception as e:
+                logging.error("Error dispatching notifications: %s", e)
+                handled = 0
+
+            # A full batch means there is probably more waiting
+            if handled < self.batch_size:
+                self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _claim(self):
+        """
+        Claim the next batch of due notifications for this dispatcher
+
+        Returns:
+            str: The claim token, or None if nothing is due
+        """
+        now = datetime.now()
+        due = or_(
+            and_(NotificationOutbox.state == 'pending', NotificationOutbox.next_attempt_at <= now),
+            and_(NotificationOutbox.state == 'sending', NotificationOutbox.claimed_at < now - timedelta(seconds=self.lease)),
+        )
+        ids = db.session.execute(
+            db.select(NotificationOutbox.id).where(due).order_by(NotificationOutbox.id).limit(self.batch_size)
+        ).scalars().all()
+        if not ids:
+            return None
+
+        # Another dispatcher may have claimed some of them meanwhile; `due` is checked again in the UPDATE
+        claim = uuid.uuid4().hex
+        db.session.execute(
+            db.update(NotificationOutbox).where(NotificationOutbox.id.in_(ids), due)
+            .values(state='sending', claim=claim, claimed_at=now)
+        )
+        db.session.commit()
+        return claim
+
+    def dispatch_once(self):
+        """
+        Send one batch of due notifications
+
+        Returns:
+            int: Number of notifications handled
+        """
+        with self.app.app_context():
+            claim = self._claim()
+            if claim is None:
+                return 0
+
+            mark_matches = and_(*(getattr(Attendance, column) == getattr(NotificationOutbox, column)
+                                  for column in ATTENDANCE_KEY))
+            claimed = db.session.execute(
+                db.select(NotificationOutbox, Student.name, Student.phone_number, Section.name,
+                          Group.name, Subject.name, Attendance.status)
+                .join(Student, Student.id == NotificationOutbox.student_id)
+                .join(Section, Section.id == NotificationOutbox.section_id)
+                .join(Group, Group.id == NotificationOutbox.group_id)
+                .join(Subject, Subject.id == NotificationOutbox.subject_id)
+                .outerjoin(Attendance, mark_matches)
+                .where(NotificationOutbox.claim == claim)
+                .order_by(NotificationOutbox.id)
+            ).all()
+
+            to_send = []
+            for entry, student_name, phone_number, section_name, group_name, subject_name, status in claimed:
+                if status != 'absent' or not phone_number:
+                    # Marked present since, or nobody to tell
+                    self._settle(entry, 'cancelled')
+                    continue
+                body = absence_message(student_name, subject_name, section_name, group_name,
+                                       entry.date.strftime('%Y-%m-%d'))
+                to_send.append((entry, phone_number, body))
+            db.session.commit()
+
+            handled = len(claimed)
+            delivered = 0
+            for index, (entry, phone_number, body) in enumerate(to_send):
+                # One token per message, so the provider never gets a burst
+                if self._stop.wait(self.limiter.acquire()):
+                    self._release([entry for entry, _, _ in to_send[index:]])
+                    handled -= len(to_send) - index
+                    break
+
+                result = self.provider.send_batch([(phone_number, body)])[0]
+                if result.message_id is not None:
+                    self._settle(entry, 'sent', message_id=result.message_id)
+                    # Only delivered messages count as sent on the mark
+                    db.session.execute(
+                        db.update(Attendance)
+                        .where(*(getattr(Attendance, column) == getattr(entry, column) for column in ATTENDANCE_KEY))
+                        .values(notification_sent=True)
+                    )
+                    delivered += 1
+                elif result.retryable and entry.attempts + 1 < self.max_attempts:
+                    self._retry(entry, result.error)
+                else:
+                    self._settle(entry, 'failed', error=result.error)
+                    logging.warning("Gave up notifying student %s after %d attempts: %s",
+                                    entry.student_id, entry.attempts, result.error)
+                # Settle each message as it goes, so a crash can't send the delivered ones again
+                db.session.commit()
+
+            logging.debug("Dispatched %d notifications, %d delivered", handled, delivered)
+            return handled
+
+    def _settle(self, entry, state, message_id=None, error=None):
+        entry.state = state
+        entry.claim = None
+        entry.claimed_at = None
+        if state != 'cancelled':
+            entry.attempts += 1
+        if state == 'sent':
+            entry.provider_message_id = message_id
+            entry.sent_at = datetime.now()
+        if error:
+            entry.last_error = error[:200]
+        notifications_total.inc(state)
+
+    def _retry(self, entry, error):
+        entry.state = 'pending'
+        entry.claim = None
+        entry.claimed_at = None
+        entry.attempts += 1
+        entry.last_error = (error or '')[:200]
+        entry.next_attempt_at = datetime.now() + timedelta(seconds=self.retry_delay * 2 ** (entry.attempts - 1))
+        notifications_total.inc('retry')
+
+    def _release(self, entries):
+        for entry in entries:
+            entry.state = 'pending'
+            entry.claim = None
+            entry.claimed_at = None
+        db.session.commit()
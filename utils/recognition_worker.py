@@ -0,0 +1,170 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+import concurrent.futures
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from utils.metrics import pipeline_timer
+from utils.face_recognition_utils import attach_gallery
+
+# Finished jobs that nobody collects are dropped after this many seconds
+JOB_TTL = 300
+
+
+class QueueFullError(Exception):
+    """Raised when the recognition queue has no room for another job"""
+
+
+def _init_worker(faces_dir, index_path):
+    """Warm up the face models and map the shared face gallery file once in each worker process"""
+    attach_gallery(faces_dir, index_path)
+    logging.info("Recognition worker %d ready", os.getpid())
+
+
+def _noop():
+    return os.getpid()
+
+
+class RecognitionPool:
+    """
+    Job queue that runs face recognition in a pool of worker processes
+
+    Decoding, encoding and matching are CPU-bound and hold the GIL, so
+    running them in the request thread stalls every other request in the
+    process. Jobs are submitted here instead and the request thread just
+    waits on (or polls for) the result.
+
+    Each worker process maps the shared gallery file when it starts, and
+    picks up new versions of it as enrolments change. At most max_queue jobs can be queued or running at a
+    time; submit() raises QueueFullError beyond that so callers can shed
+    load instead of piling up requests. With workers=0 jobs run inline in
+    the calling thread, which is handy for development and tests.
+    """
+
+    def __init__(self, faces_dir, index_path, workers=None, max_queue=None):
+        self.faces_dir = faces_dir
+        self.index_path = index_path
+        self.workers = min(4, os.cpu_count() or 1) if workers is None else workers
+        self.max_queue = max_queue or max(self.workers, 1) * 4
+
+        self._executor = None
+        self._jobs = {}  # job id -> {"future", "context", "finished_at"}
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # Fork so workers don't re-import the app module the way spawn would
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('fork'),
+                        initializer=_init_worker,
+                        initargs=(self.faces_dir, self.index_path),
+                    )
+        return self._executor
+
+    def warm_up(self):
+        """Start every worker process now so the first requests don't pay for it"""
+        if self.workers:
+            executor = self._get_executor()
+            for future in [executor.submit(_noop) for _ in range(self.workers)]:
+                future.result()
+            logging.info("Started %d recognition workers", self.workers)
+
+    def submit(self, fn, *args, context=None):
+        """
+        Queue fn(*args) to run in a worker process
+
+        Args:
+            fn: Module-level function to run; it and its arguments must be picklable
+            context: Anything the caller wants back when the job is collected
+
+        Returns:
+            str: Job id for wait() and pop()
+
+        Raises:
+            QueueFullError: If max_queue jobs are already queued or running
+        """
+        with self._lock:
+            if self._active >= self.max_queue:
+                raise QueueFullError(f"Recognition queue is full ({self.max_queue} jobs)")
+            self._active += 1
+            self._purge_expired()
+
+        job_id = uuid.uuid4().hex
+        if self.workers:
+            try:
+                future = self._get_executor().submit(fn, *args)
+            except Exception:
+                with self._lock:
+                    self._active -= 1
+                raise
+        else:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        with self._lock:
+            self._jobs[job_id] = {"future": future, "context": context, "finished_at": None}
+        future.add_done_callback(lambda done: self._job_done(job_id, done))
+        return job_id
+
+    def _job_done(self, job_id, future):
+        with self._lock:
+            self._active -= 1
+            job = self._jobs.get(job_id)
+            if job:
+                job["finished_at"] = time.monotonic()
+
+        # Workers report their per-stage timings with the result; keep the totals here
+        if not future.cancelled() and future.exception() is None:
+            result = future.result()
+            if isinstance(result, dict) and result.get("timings"):
+                pipeline_timer.add(result["timings"])
+
+    def _purge_expired(self):
+        """Forget finished jobs nobody came back for; the caller holds the lock"""
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] is not None and now - job["finished_at"] > JOB_TTL]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def context(self, job_id):
+        """Return the context a job was submitted with, or None for unknown jobs"""
+        job = self._jobs.get(job_id)
+        return job["context"] if job else None
+
+    def wait(self, job_id, timeout=None):
+        """
+        Wait up to timeout seconds for a job to finish
+
+        Returns:
+            The job's result, or None if it is still running
+
+        Raises:
+            KeyError: If the job id is unknown or has expired
+            Exception: Whatever the job raised
+        """
+        job = self._jobs[job_id]
+        try:
+            return job["future"].result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            return None
+
+    def pop(self, job_id):
+        """Forget a job once its result has been collected"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,208 @@
+import time
+import logging
+import threading
+from collections import namedtuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import db, Section, Group, Subject, Student, Enrollment
+from utils.attendance_queries import roster_query
+
+# Read-only copies of reference rows, safe to share between requests and threads
+SectionRef = namedtuple('SectionRef', ['id', 'name'])
+GroupRef = namedtuple('GroupRef', ['id', 'name', 'section_id'])
+SubjectRef = namedtuple('SubjectRef', ['id', 'name'])
+StudentRef = namedtuple('StudentRef', ['id', 'name', 'phone_number', 'email'])
+
+# Kind of reference data -> (model, row type)
+REFERENCE_KINDS = {
+    'sections': (Section, SectionRef),
+    'groups': (Group, GroupRef),
+    'subjects': (Subject, SubjectRef),
+    'students': (Student, StudentRef),
+}
+
+# Model -> kinds of reference data to invalidate when its rows change
+_MODEL_KINDS = {model: (kind,) for kind, (model, _) in REFERENCE_KINDS.items()}
+_MODEL_KINDS[Student] += ('rosters',)
+_MODEL_KINDS[Enrollment] = ('rosters',)
+
+# Rosters kept at once; beyond this the least recently loaded are dropped
+ROSTER_CACHE_SIZE = 512
+
+
+class ReferenceCache:
+    """
+    Read-through cache of sections, groups, subjects, students and class rosters
+
+    Each kind is loaded whole with a single query the first time it is
+    needed and kept for ttl seconds. Rosters are loaded one class at a time,
+    so marking a class never reads the whole student table. Commits that add, change or delete
+    reference rows through the ORM invalidate the affected kinds right away
+    in this process; other worker processes pick the change up when their
+    copy expires.
+
+    Rows are returned as namedtuples, not ORM instances, so they can be
+    shared between requests; they have the same attributes the templates
+    and views use.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._entries = {}  # kind -> (loaded at, {id: row})
+        self._rosters = {}  # (group id, subject id) -> (loaded at, {id: StudentRef})
+        self._lock = threading.Lock()
+        self.hits = {kind: 0 for kind in (*REFERENCE_KINDS, 'rosters')}
+        self.misses = {kind: 0 for kind in (*REFERENCE_KINDS, 'rosters')}
+
+    def _rows(self, kind):
+        """{id: row} for a kind, loading it if missing or expired"""
+        entry = self._entries.get(kind)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self.hits[kind] += 1
+            return entry[1]
+
+        model, row_type = REFERENCE_KINDS[kind]
+        columns = [getattr(model, field) for field in row_type._fields]
+        rows = {row.id: row for row in (row_type(*values) for values in
+                                        db.session.execute(select(*columns).order_by(model.id)))}
+        with self._lock:
+            self.misses[kind] += 1
+            self._entries[kind] = (time.monotonic(), rows)
+        return rows
+
+    def _roster(self, group_id, subject_id):
+        """{id: StudentRef} of the students enrolled in a class, loading it if missing or expired"""
+        try:
+            key = (int(group_id), int(subject_id))
+        except (TypeError, ValueError):
+            return {}
+
+        entry = self._rosters.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self.hits['rosters'] += 1
+            return entry[1]
+
+        columns = [getattr(Student, field) for field in StudentRef._fields]
+        rows = {row.id: row for row in (StudentRef(*values) for values in
+                                        db.session.execute(roster_query(*key, *columns)))}
+        with self._lock:
+            self.misses['rosters'] += 1
+            self._rosters.pop(key, None)
+            self._rosters[key] = (time.monotonic(), rows)
+            while len(self._rosters) > ROSTER_CACHE_SIZE:
+                del self._rosters[next(iter(self._rosters))]
+        return rows
+
+    def invalidate(self, *kinds):
+        """Drop the given kinds (all of them, rosters included, by default) so they are reloaded on next use"""
+        kinds = kinds or (*REFERENCE_KINDS, 'rosters')
+        with self._lock:
+            for kind in kinds:
+                if kind == 'rosters':
+                    self._rosters.clear()
+                else:
+                    self._entries.pop(kind, None)
+        logging.debug("Invalidated cached reference data: %s", ', '.join(kinds))
+
+    @staticmethod
+    def _get(rows, row_id):
+        try:
+            return rows.get(int(row_id))
+        except (TypeError, ValueError):
+            return None
+
+    def sections(self):
+        return list(self._rows('sections').values())
+
+    def section(self, section_id):
+        return self._get(self._rows('sections'), section_id)
+
+    def groups(self, section_id=None):
+        """All groups, or the groups of one section"""
+        groups = self._rows('groups').values()
+        if section_id is None:
+            return list(groups)
+        try:
+            section_id = int(section_id)
+        except (TypeError, ValueError):
+            return []
+        return [group for group in groups if group.section_id == section_id]
+
+    def group(self, group_id):
+        return self._get(self._rows('groups'), group_id)
+
+    def subjects(self):
+        return list(self._rows('subjects').values())
+
+    def subject(self, subject_id):
+        return self._get(self._rows('subjects'), subject_id)
+
+    def students(self):
+        return list(self._rows('students').values())
+
+    def student(self, student_id):
+        return self._get(self._rows('students'), student_id)
+
+    def roster(self, group_id, subject_id):
+        """Students enrolled in a group for a subject, ordered by id"""
+        return list(self._roster(group_id, subject_id).values())
+
+    def roster_student(self, group_id, subject_id, student_id):
+        """A student of a class's roster, or None if they aren't enrolled in it"""
+        return self._get(self._roster(group_id, subject_id), student_id)
+
+    def student_by_name(self, name):
+        for student in self._rows('students').values():
+            if student.name == name:
+                return student
+        return None
+
+    def stats(self):
+        """
+        Returns:
+            dict: Kind (rosters counted together) -> {"hits", "misses", "hit_rate", "cached_rows"}
+        """
+        stats = {}
+        for kind in self.hits:
+            hits, misses = self.hits[kind], self.misses[kind]
+            if kind == 'rosters':
+                cached_rows = sum(len(rows) for _, rows in list(self._rosters.values()))
+            else:
+                entry = self._entries.get(kind)
+                cached_rows = len(entry[1]) if entry else 0
+            stats[kind] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+                "cached_rows": cached_rows,
+            }
+        return stats
+
+
+def get_reference_cache():
+    """The current app's reference data cache"""
+    return current_app.extensions["reference_cache"]
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_reference_changes(session, flush_context):
+    """Remember which kinds of reference data a transaction touched"""
+    kinds = {kind for instance in (*session.new, *session.dirty, *session.deleted)
+             for kind in _MODEL_KINDS.get(type(instance), ())}
+    if kinds:
+        session.info.setdefault('reference_changes', set()).update(kinds)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_reference_changes(session):
+    kinds = session.info.pop('reference_changes', None)
+    if kinds and has_app_context() and 'reference_cache' in current_app.extensions:
+        current_app.extensions['reference_cache'].invalidate(*kinds)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_reference_changes(session):
+    session.info.pop('reference_changes', None)
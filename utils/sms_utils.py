@@ -1,79 +1,152 @@
-# import os
-# import logging
-# from twilio.rest import Client
-# from twilio.base.exceptions import TwilioRestException
-
-# def send_absence_notification(student_name, phone_number, subject_name, section_name, group_name, date):
-#     """
-#     Send an SMS notification to a student who was marked absent
-    
-#     Args:
-#         student_name: Name of the student
-#         phone_number: Student's phone number to send the SMS to
-#         subject_name: Name of the subject
-#         section_name: Name of the section
-#         group_name: Name of the group
-#         date: Date of the absence
-        
-#     Returns:
-#         dict: Result of the notification attempt
-#     """
-#     # Check if phone number is provided
-#     if not phone_number:
-#         logging.warning(f"No phone number available for {student_name}. SMS notification not sent.")
-#         return {
-#             "success": False,
-#             "message": f"No phone number available for {student_name}"
-#         }
-    
-#     # Get Twilio credentials from environment variables
-#     account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
-#     auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
-#     twilio_phone = os.environ.get('TWILIO_PHONE_NUMBER')
-    
-#     # Validate Twilio credentials
-#     if not all([account_sid, auth_token, twilio_phone]):
-#         logging.error("Twilio credentials not found in environment variables")
-#         return {
-#             "success": False,
-#             "message": "Twilio credentials not configured"
-#         }
-    
-#     try:
-#         # Initialize Twilio client
-#         client = Client(account_sid, auth_token)
-        
-#         # Compose message
-#         message_body = (
-#             f"Dear {student_name}, this is an automated message from Lachoo College.\n\n"
-#             f"You were marked absent for {subject_name} in section {section_name}, "
-#             f"group {group_name} on {date}.\n\n"
-#             f"Please contact the faculty for more information."
-#         )
-        
-#         # Send the SMS
-#         message = client.messages.create(
-#             body=message_body,
-#             from_=twilio_phone,
-#             to=phone_number
-#         )
-        
-#         logging.info(f"SMS notification sent to {student_name} at {phone_number}: {message.sid}")
-#         return {
-#             "success": True,
-#             "message": f"SMS notification sent to {student_name}",
-#             "sid": message.sid
-#         }
-        
-#     except TwilioRestException as e:
-#         logging.error(f"Twilio error while sending SMS to {student_name}: {str(e)}")
-#         return {
-#             "success": False,
-#             "message": f"Error sending SMS: {str(e)}"
-#         }
-#     except Exception as e:
-#         logging.error(f"Error sending SMS notification to {student_name}: {str(e)}")
-#         return {
-#             "success": False,
-#             "message": f"Error: {str(e)}"
-#         }
\ No newline at end of file
+import os
+import time
+import random
+import logging
+import threading
+from collections import namedtuple
+
+# Outcome of sending one message: the provider's id for it, or the error and whether trying again may help
+SendResult = namedtuple('SendResult', ['message_id', 'error', 'retryable'])
+
+
+class SMSError(Exception):
+    """A message the provider did not accept"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def absence_message(student_name, subject_name, section_name, group_name, date):
+    """The SMS sent to a student who was marked absent"""
+    return (
+        f"Dear {student_name}, this is an automated message from Lachoo College.\n\n"
+        f"You were marked absent for {subject_name} in section {section_name}, "
+        f"group {group_name} on {date}.\n\n"
+        f"Please contact the faculty for more information."
+    )
+
+
+class SMSProvider:
+    """
+    Sends text messages through an SMS gateway
+
+    Subclasses implement send(); send_batch() sends several messages in one
+    go, one at a time unless the provider can do better. A provider is
+    created once and shared by every send, so its client and connections
+    are reused.
+    """
+
+    name = 'base'
+
+    def send(self, phone_number, body):
+        """
+        Send one message
+
+        Returns:
+            str: The provider's id for the message
+
+        Raises:
+            SMSError: If the provider did not accept it
+        """
+        raise NotImplementedError
+
+    def send_batch(self, messages):
+        """
+        Send several messages
+
+        Args:
+            messages: List of (phone number, body)
+
+        Returns:
+            list: A SendResult per message, in order
+        """
+        results = []
+        for phone_number, body in messages:
+            try:
+                results.append(SendResult(self.send(phone_number, body), None, False))
+            except SMSError as e:
+                results.append(SendResult(None, str(e), e.retryable))
+            except Exception as e:
+                # Network trouble and the like; the message may go through next time
+                results.append(SendResult(None, str(e), True))
+        return results
+
+
+class TwilioProvider(SMSProvider):
+    """Sends messages with Twilio, through one client whose HTTP session is kept open"""
+
+    name = 'twilio'
+
+    def __init__(self, account_sid, auth_token, from_number):
+        # Only needed when Twilio is actually used
+        from twilio.rest import Client
+        from twilio.base.exceptions import TwilioRestException
+
+        self.client = Client(account_sid, auth_token)
+        self.from_number = from_number
+        self._rest_exception = TwilioRestException
+
+    def send(self, phone_number, body):
+        try:
+            return self.client.messages.create(body=body, from_=self.from_number, to=phone_number).sid
+        except self._rest_exception as e:
+            # Throttled or a server error is worth retrying; a bad number or account is not
+            raise SMSError(f"Twilio error {e.status}: {e.msg}", retryable=e.status == 429 or e.status >= 500) from e
+
+
+class FakeProvider(SMSProvider):
+    """
+    Pretends to send messages, for development and throughput testing
+
+    Every message takes `latency` seconds, like a round trip to a real
+    gateway, and fails (retryably) with probability `failure_rate`. Sent
+    messages are kept in `sent`.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def send(self, phone_number, body):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self._random.random() < self.failure_rate:
+                raise SMSError("Simulated gateway failure")
+            self.sent.append((phone_number, body))
+            message_id = f"FAKE{len(self.sent):08d}"
+        logging.debug("Fake SMS %s to %s", message_id, phone_number)
+        return message_id
+
+
+def make_provider(name):
+    """
+    The SMS provider called name
+
+    Args:
+        name: "twilio" (credentials from TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN
+            and TWILIO_PHONE_NUMBER), "fake", "none", or "auto" for Twilio
+            when its credentials are set and none otherwise
+
+    Returns:
+        SMSProvider: Or None when no messages should be sent
+    """
+    credentials = [os.environ.get(key) for key in ('TWILIO_ACCOUNT_SID', 'TWILIO_AUTH_TOKEN', 'TWILIO_PHONE_NUMBER')]
+    if name == 'auto':
+        name = 'twilio' if all(credentials) else 'none'
+
+    if name == 'none':
+        return None
+    if name == 'fake':
+        return FakeProvider()
+    if name == 'twilio':
+        if not all(credentials):
+            raise ValueError("Twilio credentials not found in environment variables")
+        return TwilioProvider(*credentials)
+    raise ValueError(f"Unknown SMS provider: {name}")
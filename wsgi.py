@@ -0,0 +1,12 @@
+"""
+Production entry point
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Each worker process builds its own app, so set DATABASE_URL (or keep the
+default SQLite file, which is opened in WAL mode) before starting more
+than one worker.
+"""
+from app import create_app
+
+app = create_app()